@@ -0,0 +1,92 @@
+"""Description. Command-line tool to predict the prices of many properties at once.
+
+The input file (csv or parquet) contains one row per property with the columns
+property_type, street_number, street_name, zip_code, city, num_rooms, surface, field_surface, dependance
+and optionally longitude and latitude.
+
+Example:
+~\mon-predicteur-immo> python batch_prediction.py -input portfolio.csv -output predictions.csv
+~\mon-predicteur-immo> python batch_prediction.py -input portfolio.parquet -output predictions.parquet -no_geocoding
+~\mon-predicteur-immo> python batch_prediction.py -input portfolio.csv -output predictions.csv -offline_geocoding -geocoding_cache geocodes.sqlite
+Predicted 25,341 prices out of 25,600 properties in 41.2s.
+File successfully saved at predictions.parquet.
+"""
+
+# required libraries
+from lib.inference import PredictionEngine, OfflineGeocoder, CachedGeocoder, get_default_geocoder
+from lib.dataset.loader import list_dvfplus_tables
+
+import pandas as pd
+
+import sys
+import time
+
+# enums
+DATA_DIR = "./data/"
+MODEL_DIR = "./backup/models/"
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+def read_table(file_path: str) -> pd.DataFrame:
+    """Description. Read csv or parquet file."""
+
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path)
+
+    elif file_path.endswith(".csv"):
+        return pd.read_csv(file_path)
+
+    raise ValueError(f"Extension of {file_path} must be .csv or .parquet.")
+
+def write_table(df: pd.DataFrame, file_path: str):
+    """Description. Write csv or parquet file."""
+
+    if file_path.endswith(".parquet"):
+        df.to_parquet(file_path, index=False)
+
+    elif file_path.endswith(".csv"):
+        df.to_csv(file_path, index=False)
+
+    else:
+        raise ValueError(f"Extension of {file_path} must be .csv or .parquet.")
+
+for flag in ("-input", "-output"):
+    if flag not in sys.argv:
+        print(f"You must provide file path using the {flag} flag")
+        sys.exit(1)
+
+data_dir = extract_info(flag="-data_dir") if "-data_dir" in sys.argv else DATA_DIR
+model_dir = extract_info(flag="-model_dir") if "-model_dir" in sys.argv else MODEL_DIR
+output_path = extract_info(flag="-output")
+
+users = read_table(extract_info(flag="-input"))
+users["zip_code"] = users["zip_code"].astype(int)
+
+cache_path = extract_info(flag="-geocoding_cache") if "-geocoding_cache" in sys.argv else None
+
+if "-offline_geocoding" in sys.argv:
+    tables = list_dvfplus_tables(zip_dir=data_dir, zip_name="dvf+")
+    offline_geocoder = None
+    geocoder = OfflineGeocoder.from_dvfplus(data_dir=data_dir, tables=tables)
+
+    if cache_path is not None:
+        geocoder = CachedGeocoder(cache_path=cache_path, geocoder=geocoder)
+else:
+    # offline geocoder completed with each area loaded by the engine, Google Maps for unknown streets
+    offline_geocoder = OfflineGeocoder(zip_code_fallback=False)
+    geocoder = get_default_geocoder(data_dir, offline_geocoder, cache_path=cache_path)
+
+engine = PredictionEngine(data_dir=data_dir, model_dir=model_dir, geocoder=geocoder, offline_geocoder=offline_geocoder)
+
+start = time.time()
+users["predicted_price"] = engine.predict_batch(users, geocode="-no_geocoding" not in sys.argv)
+duration = time.time() - start
+
+n_predicted = users["predicted_price"].notna().sum()
+print(f"Predicted {n_predicted:,} prices out of {users.shape[0]:,} properties in {duration:.1f}s.")
+
+write_table(users, output_path)
+print(f"File successfully saved at {output_path}.")
@@ -0,0 +1,284 @@
+"""Description. Automated script to time data loading, preprocessing, training and inference on synthetic DVF+ tables.
+
+Synthetic tables follow the schema of lib.enums (see synthetic.py). Each stage is run -repeat times (default: 3)
+and its median and minimum wall times are saved to a json file. If a baseline json file is provided, median
+times are compared with the baseline and the script exits with code 1 when a stage is slower than
+baseline * (1 + tolerance).
+
+Example:
+~\\mon-predicteur-immo\\benchmarks> python run_benchmarks.py -size 10000 -size 100000 -output results.json -save_baseline
+~\\mon-predicteur-immo\\benchmarks> python run_benchmarks.py -size 10000 -size 100000 -baseline baseline.json -tolerance 0.2
+┏━━━━━━━━┳━━━━━━━━━━━━━━━━━━━━━━━━━━━┳━━━━━━━━━━━━━━┳━━━━━━━━━━━━━┳━━━━━━━┳━━━━━━━━━━━━┓
+┃ Size   ┃ Stage                     ┃ Baseline (s) ┃ Current (s) ┃ Ratio ┃ Status     ┃
+┡━━━━━━━━╇━━━━━━━━━━━━━━━━━━━━━━━━━━━╇━━━━━━━━━━━━━━╇━━━━━━━━━━━━━╇━━━━━━━╇━━━━━━━━━━━━┩
+│ 10000  │ load_dvfplus              │ 0.412        │ 0.405       │ 0.98  │ ok         │
+│ 10000  │ prepare_dataset           │ 0.233        │ 0.231       │ 0.99  │ ok         │
+│ ...    │ ...                       │ ...          │ ...         │ ...   │ ...        │
+└────────┴───────────────────────────┴──────────────┴─────────────┴───────┴────────────┘
+"""
+
+# required libraries
+import sys
+sys.path.append("../")
+
+from lib.dataset.loader import load_dvfplus
+from lib.dataset.build import prepare_dataset, prepare_dummies
+from lib.dataset.utils import calc_movav_prices, get_categorical_vars, get_most_frequent_levels
+from lib.dataset.split import temporal_train_test_split, get_feature_vector, get_target_vector
+from lib.model.estimator import CustomRegressor
+from lib.model.loader import save_model
+from lib.model.training import PREPROC_ARGS, TO_REMOVE
+from lib.inference.predict import Prediction
+from lib.inference.geocoding import OfflineGeocoder
+
+from synthetic import make_dvfplus_table, write_dvfplus_zip
+
+from xgboost import XGBRegressor
+from sklearn.ensemble import RandomForestRegressor
+
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import numpy as np
+
+from rich.console import Console
+from rich.table import Table
+
+import platform
+import tempfile
+import sklearn
+import time
+import json
+import io
+import os
+
+# enums
+GEO_AREA = "essonne"
+PROPERTY_TYPE = "flats"
+TARGET = "l_valeur_fonciere"
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+def extract_all_info(flag: str):
+    """Description. Extract information of repeated flag from command line."""
+    return [sys.argv[i + 1] for i, arg in enumerate(sys.argv) if arg == flag]
+
+def time_stage(run: Callable, setup: Optional[Callable]=None, repeat: int=3) -> Dict:
+    """Description. Time run(setup()) repeat times, setup is not timed. Return median, min and all times (s)."""
+
+    times = []
+
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    return {"median": float(np.median(times)), "min": float(np.min(times)), "times": times}
+
+def get_metadata(n_threads: int) -> Dict:
+    """Description. Versions and machine information stored with results."""
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "n_threads": n_threads,
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "scikit-learn": sklearn.__version__,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+def run_size(n_rows: int, work_dir: str, repeat: int=3, n_threads: int=1, seed: int=0) -> Dict:
+    """Description. Time every stage on a synthetic table of n_rows transactions."""
+
+    data_dir = f"{work_dir}/data_{n_rows}"
+    model_dir = f"{work_dir}/models_{n_rows}"
+    os.makedirs(model_dir, exist_ok=True)
+
+    write_dvfplus_zip(make_dvfplus_table(n_rows, GEO_AREA, PROPERTY_TYPE, seed=seed), data_dir, GEO_AREA, PROPERTY_TYPE)
+
+    results = {}
+
+    # data loading
+    results["load_dvfplus"] = time_stage(lambda: load_dvfplus(data_dir, "dvf+", GEO_AREA, PROPERTY_TYPE), repeat=repeat)
+    df = load_dvfplus(data_dir, "dvf+", GEO_AREA, PROPERTY_TYPE)
+
+    # preprocessing
+    prepare = lambda df: prepare_dataset(df, target_var=TARGET, print_summary=False, return_var_names=False, **PREPROC_ARGS)
+    results["prepare_dataset"] = time_stage(prepare, lambda: (df.copy(),), repeat)
+    df_prep = prepare(df.copy())
+
+    categorical_vars = get_categorical_vars(df_prep, n_levels_max=30)
+    ref_levels = get_most_frequent_levels(df_prep, categorical_vars)
+    dummies = lambda df: prepare_dummies(df, categorical_vars, ref_levels)
+    results["prepare_dummies"] = time_stage(dummies, lambda: (df_prep.copy(),), repeat)
+    df_dum = dummies(df_prep.copy())
+
+    movav = lambda df: calc_movav_prices(df, window_size=30, lag=1, neighborhood_var=PREPROC_ARGS["neighborhood_var"])
+    results["calc_movav_prices"] = time_stage(movav, lambda: (df.copy(),), repeat)
+
+    df_dum = df_dum.set_index("id_mutation").drop(labels=[col for col in TO_REMOVE if col in df_dum.columns], axis=1)
+    split = lambda df: temporal_train_test_split(df, date_var="date_mutation", train_prop=.8)
+    results["temporal_train_test_split"] = time_stage(split, lambda: (df_dum.copy(),), repeat)
+    df_train, _, _, _ = split(df_dum.copy())
+
+    # training
+    X_tr, features = get_feature_vector(df_train, return_features=True, target=TARGET, return_df=False)
+    y_tr = get_target_vector(df_train, target=TARGET, return_series=False)
+
+    estimators = {
+        "fit_xgbregressor": lambda: XGBRegressor(n_estimators=200, tree_method="hist", n_jobs=n_threads),
+        "fit_randomforestregressor": lambda: RandomForestRegressor(n_estimators=20, max_depth=12, n_jobs=n_threads)
+    }
+
+    for stage, get_estimator in estimators.items():
+        results[stage] = time_stage(lambda model: model.fit(X_tr, y_tr), lambda: (CustomRegressor(get_estimator()),), repeat)
+
+    model = CustomRegressor(estimators["fit_xgbregressor"]())
+    model.fit(X_tr, y_tr)
+
+    # inference
+    with redirect_stdout(io.StringIO()):
+        save_model(model_dir, model, features, {}, 0, GEO_AREA, PROPERTY_TYPE)
+
+    geocoder = OfflineGeocoder(df)
+    row = df.iloc[len(df) // 2]
+    user_args = {
+        "property_type": PROPERTY_TYPE,
+        "street_number": int(row["adresse_numero"]),
+        "street_name": row["adresse_nom_voie"],
+        "zip_code": int(row["code_postal"]),
+        "city": row["nom_commune"],
+        "num_rooms": int(row["nombre_pieces_principales"]),
+        "surface": float(row["surface_reelle_bati"]),
+        "field_surface": 0,
+        "dependance": 0
+    }
+
+    def predict():
+        with redirect_stdout(io.StringIO()):
+            prediction = Prediction(dict(user_args), geocoder=geocoder)
+            prediction.load_data(data_dir, backend="zip")
+            prediction.load_model(model_dir)
+            prediction.predict()
+
+    results["prediction_predict"] = time_stage(predict, repeat=repeat)
+
+    return results
+
+def compare_results(results: Dict, baseline: Dict, tolerance: float=.2) -> List[Dict]:
+    """Description. Compare median times of results with baseline, stages missing from baseline are skipped.
+
+    Returns:
+        List[Dict]: size, stage, baseline and current median times, ratio and status (ok, regression or improvement)."""
+
+    comparison = []
+
+    for size, stages in results["results"].items():
+        for stage, timings in stages.items():
+
+            if stage not in baseline["results"].get(size, {}):
+                continue
+
+            reference = baseline["results"][size][stage]["median"]
+            ratio = timings["median"] / reference if reference > 0 else float("inf")
+
+            if ratio > 1 + tolerance:
+                status = "regression"
+            elif ratio < 1 - tolerance:
+                status = "improvement"
+            else:
+                status = "ok"
+
+            comparison.append({
+                "size": size,
+                "stage": stage,
+                "baseline": reference,
+                "current": timings["median"],
+                "ratio": ratio,
+                "status": status
+            })
+
+    return comparison
+
+def print_comparison(comparison: List[Dict]):
+    """Description. Print comparison with baseline as a table."""
+
+    table = Table()
+
+    for column in ("Size", "Stage", "Baseline (s)", "Current (s)", "Ratio", "Status"):
+        table.add_column(column)
+
+    for row in comparison:
+        table.add_row(
+            row["size"],
+            row["stage"],
+            f"{row['baseline']:.3f}",
+            f"{row['current']:.3f}",
+            f"{row['ratio']:.2f}",
+            row["status"]
+        )
+
+    Console().print(table)
+
+def print_results(results: Dict):
+    """Description. Print median times as a table."""
+
+    table = Table()
+
+    for column in ("Size", "Stage", "Median (s)", "Min (s)"):
+        table.add_column(column)
+
+    for size, stages in results["results"].items():
+        for stage, timings in stages.items():
+            table.add_row(size, stage, f"{timings['median']:.3f}", f"{timings['min']:.3f}")
+
+    Console().print(table)
+
+if __name__ == "__main__":
+
+    sizes = [int(size) for size in extract_all_info(flag="-size")] or [10000, 100000]
+    repeat = int(extract_info(flag="-repeat")) if "-repeat" in sys.argv else 3
+    n_threads = int(extract_info(flag="-n_threads")) if "-n_threads" in sys.argv else 1
+    tolerance = float(extract_info(flag="-tolerance")) if "-tolerance" in sys.argv else .2
+    output = extract_info(flag="-output") if "-output" in sys.argv else "results.json"
+    baseline_path = extract_info(flag="-baseline") if "-baseline" in sys.argv else "baseline.json"
+
+    results = {"metadata": get_metadata(n_threads), "results": {}}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_rows in sizes:
+            print(f"Benchmarking {n_rows} transactions...")
+            results["results"][str(n_rows)] = run_size(n_rows, work_dir, repeat, n_threads)
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results saved at {output}.")
+
+    if "-save_baseline" in sys.argv:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+        print(f"Baseline saved at {baseline_path}.")
+        print_results(results)
+
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+
+        comparison = compare_results(results, baseline, tolerance)
+        print_comparison(comparison)
+
+        if any(row["status"] == "regression" for row in comparison):
+            sys.exit(1)
+
+    else:
+        print_results(results)
@@ -0,0 +1,131 @@
+"""Description. Synthetic DVF+ tables with the schema of lib.enums, used by benchmarks."""
+
+import sys
+sys.path.append("../")
+
+from lib.enums import (
+    DVF_SELECTED_VARS,
+    BNB_SELECTED_VARS,
+    VARS_WITH_LIST_VALUES,
+    AVAILABLE_DEPARTMENTS
+)
+
+from pandas.core.frame import DataFrame
+from zipfile import ZipFile, ZIP_DEFLATED
+from typing import Optional
+
+import pandas as pd
+import numpy as np
+
+import os
+
+PERIODS = ["avant 1948", "1948-1974", "1975-1988", "1989-2000", "2001-2012", "2013-2021"]
+ALEAS = ["Faible", "Moyen", "Fort"]
+DUMMY_PREFIXES = tuple(f"{var}_" for var in VARS_WITH_LIST_VALUES.keys()) + ("presence_", "qpv", "mur_pos_isol_ext")
+
+def get_department_code(geo_area: str) -> int:
+    """Description. Return code of department covered by geographical area."""
+
+    codes = {name: code for code, name in AVAILABLE_DEPARTMENTS.items()}
+
+    if geo_area not in codes:
+        raise ValueError(f"geo_area must be in {list(codes.keys())}, got {geo_area}.")
+
+    return codes[geo_area]
+
+def make_dvfplus_table(
+    n_rows: int,
+    geo_area: str="essonne",
+    property_type: str="flats",
+    n_communes: Optional[int]=None,
+    n_streets: int=500,
+    start_date: str="2017-01-01",
+    n_days: int=2000,
+    seed: int=0
+) -> DataFrame:
+    """Description. Generate DVF+ table with the columns of DVF_SELECTED_VARS, DVF_LOCATION_VARS and BNB_SELECTED_VARS.
+
+    Details: prices depend on surface, number of rooms, commune and date so that models have something to learn.
+    About 10% of BNB values are missing.
+
+    Args:
+        n_rows (int): number of transactions.
+        geo_area (str): department of AVAILABLE_DEPARTMENTS.
+        property_type (str): type of property (flats or houses).
+        n_communes (Optional[int]): number of communes, one per 5000 transactions (at least 3) if None so that 
+            communes have enough dates for 90 days moving averages.
+        n_streets (int): number of streets.
+        start_date (str): date of first transaction.
+        n_days (int): number of days covered by transactions.
+        seed (int): seed of random generator.
+
+    Returns:
+        DataFrame: DVF+ table sorted by date."""
+
+    if n_communes is None:
+        n_communes = max(3, n_rows // 5000)
+
+    rng = np.random.default_rng(seed)
+    dpt_code = get_department_code(geo_area)
+
+    communes = np.array([f"Commune {i}" for i in range(n_communes)])
+    commune_idxs = rng.integers(0, n_communes, n_rows)
+    zip_codes = dpt_code * 1000 + 10 * (commune_idxs % 99)
+
+    dates = pd.Timestamp(start_date) + pd.to_timedelta(np.sort(rng.integers(0, n_days, n_rows)), unit="D")
+
+    n_rooms = rng.integers(1, 7, n_rows).astype("float64")
+    surface = np.clip(rng.normal(20 + 15 * n_rooms, 10), 10, None).round()
+    years = dates.year.to_numpy()
+    price_m2 = 3000 * (1 + commune_idxs / n_communes) * (1 + .05 * (years - years.min()))
+    price = (surface * price_m2 * rng.lognormal(0, .15, n_rows)).round()
+
+    df = pd.DataFrame({
+        "id_mutation": [f"{date.year}-{i}" for i, date in enumerate(dates)],
+        "date_mutation": dates.strftime("%Y-%m-%d"),
+        "valeur_fonciere": price,
+        "nom_commune": communes[commune_idxs],
+        "nom_departement": geo_area.capitalize(),
+        "surface_reelle_bati": surface,
+        "nombre_pieces_principales": n_rooms,
+        "surface_terrain": np.nan if property_type == "flats" else rng.integers(100, 2000, n_rows).astype("float64"),
+        "dependance": rng.integers(0, 2, n_rows),
+        "trimestre": dates.quarter.to_numpy(dtype="float64"),
+        "mois": dates.month.to_numpy(dtype="float64"),
+        "adresse_numero": rng.integers(1, 150, n_rows).astype("float64"),
+        "adresse_nom_voie": [f"RUE {i}" for i in rng.integers(0, n_streets, n_rows)],
+        "code_postal": zip_codes.astype("float64"),
+        "longitude": 2.2 + commune_idxs / n_communes * .5 + rng.normal(0, .01, n_rows),
+        "latitude": 48.5 + commune_idxs / n_communes * .3 + rng.normal(0, .01, n_rows),
+        "code_departement": dpt_code,
+        "type_local": "Appartement" if property_type == "flats" else "Maison",
+    })
+
+    for var in BNB_SELECTED_VARS:
+
+        if var.startswith("periode_construction"):
+            values = rng.choice(PERIODS, n_rows).astype(object)
+        elif var.startswith("alea"):
+            values = rng.choice(ALEAS, n_rows).astype(object)
+        elif var.startswith(DUMMY_PREFIXES):
+            values = (rng.random(n_rows) < .2).astype("float64")
+        elif var.startswith("nb_"):
+            values = rng.poisson(5, n_rows).astype("float64")
+        else:
+            values = rng.gamma(2., 50., n_rows)
+
+        values[rng.random(n_rows) < .1] = np.nan
+        df[var] = values
+
+    return df[DVF_SELECTED_VARS + [col for col in df.columns if col not in DVF_SELECTED_VARS]]
+
+def write_dvfplus_zip(df: DataFrame, data_dir: str, geo_area: str, property_type: str, zip_name: str="dvf+") -> str:
+    """Description. Write DVF+ table to {data_dir}/{zip_name}.zip as load_dvfplus expects it, return zip path."""
+
+    os.makedirs(data_dir, exist_ok=True)
+    zip_path = f"{data_dir}/{zip_name}.zip"
+
+    with ZipFile(zip_path, "w", compression=ZIP_DEFLATED) as zip_folder:
+        zip_folder.writestr(f"{zip_name}/{geo_area}_{property_type}.csv", df.to_csv(index=False))
+
+    return zip_path
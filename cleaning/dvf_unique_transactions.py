@@ -1,9 +1,11 @@
 """Description. Automated script to preprocess DVF dataset for one year.
 
+The csv file is read in chunks: each (geo_area, property_type) slice is appended to a partition of the 
+parquet store data/dvf_parquet/geo_area=.../property_type=.../year=.../ so that peak memory does not depend 
+on the size of the year. Use -chunk_size to change the number of rows per chunk (default: 100000).
+
 Example: 
 ~\business-data-challenge\cleaning> dvf_unique_transactions.py -year 2017
-File successfully loaded.
-394243 transactions uniques pour l'année 2017
 ┏━━━━━━━━━━━━━━━━━━━┳━━━━━━━━━┳━━━━━━━━━━━━━━┓
 ┃ Zone géographique ┃ Maisons ┃ Appartements ┃
 ┡━━━━━━━━━━━━━━━━━━━╇━━━━━━━━━╇━━━━━━━━━━━━━━┩
@@ -21,29 +23,25 @@ File successfully loaded.
 │ rural_areas       │ 114,071 │ 21,693       │
 │ Total             │ 213,683 │ 180,428      │
 └───────────────────┴─────────┴──────────────┘
-File sucessefully saved at ../data/cleaned/dvf_splitted_2017.pkl.
+Partitions of 2017 sucessefully saved at ../data/dvf_parquet/.
 """
 
 # required libraries
 import sys
 sys.path.append("../")
 
-from lib.preprocessing import dvf, geo
-from lib.preprocessing.utils import get_unique_entries, add_date_components
+from lib.preprocessing import dvf
 
 import pandas as pd 
-import numpy as np 
 
 from rich import print 
 from rich.console import Console
 from rich.table import Table
 
-import sys
-import pickle as pkl 
-
 # enums
 DATA_DIR = "../data/"
 ZIP_DIR = f"{DATA_DIR}dvf.zip"
+STORE_DIR = f"{DATA_DIR}dvf_parquet/"
 GEOGRAPHY_DIR = f"{DATA_DIR}geography/"
 DENSITY_DIR = f"{DATA_DIR}densite/"
 
@@ -58,120 +56,21 @@ if "-year" not in sys.argv:
     sys.exit(1)
 
 year = extract_info(flag="-year")
-df = dvf.load_zip_csv(zip_dir=ZIP_DIR, year=year)
-
-print(f"File successfully loaded.")
-
-# select sales
-df_sales = dvf.select_sales(df) 
-del df 
-
-# remove industrial facilities
-df_sales = dvf.remove_industrial_facilities(df_sales)
-
-# split houses/flats and dependencies
-dict_sales = {
-    "houses_flats": df_sales.loc[df_sales.code_type_local != 3], 
-    "dependencies": df_sales.loc[df_sales.code_type_local == 3]
-}
-
-del df_sales
-
-# get id_mutation related to one row
-unique_ids = get_unique_entries(dict_sales["houses_flats"], "id_mutation")
-n_unique_ids = len(unique_ids)
-print(f"{n_unique_ids} transactions uniques pour l'année {year}")
-
-dict_sales = {
-    k: df.loc[df.id_mutation.isin(unique_ids), :]
-    for k, df in dict_sales.items()
-}
-
-# split houses and flats
-dict_sales["houses"] = dict_sales["houses_flats"]\
-    .loc[dict_sales["houses_flats"].code_type_local==1, :]
-
-dict_sales["flats"] = dict_sales["houses_flats"]\
-    .loc[dict_sales["houses_flats"].code_type_local==2, :]
-
-del dict_sales["houses_flats"]
-
-# add dependency dummy 
-dependencies = dict_sales["dependencies"]
-del dict_sales["dependencies"]
+chunk_size = int(extract_info(flag="-chunk_size")) if "-chunk_size" in sys.argv else 100000
 
-dict_sales = {
-    property_type: dvf.add_dependency_dummy(df, dependencies)
-    for property_type, df in dict_sales.items()
-}
-
-# convert department id to character
-for property_type, df in dict_sales.items(): 
-    df["code_departement"] = df["code_departement"].astype(str)
-    dict_sales[property_type] = df
-
-del df 
-
-# add regions 
+# regions and density levels are small tables merged with each chunk
 regions_dpts = pd.read_csv(f"{GEOGRAPHY_DIR}regions_departments.csv")
-
-dict_sales = {
-    property_type: pd.merge(left=df, right=regions_dpts, how="left", on="code_departement")
-    for property_type, df in dict_sales.items()
-} 
-
-# convert code_commune to character
-for property_type, df in dict_sales.items(): 
-    df["code_commune"] = df["code_commune"].astype(str)
-    dict_sales[property_type] = df
-
-del df 
-
-# add density level and population
 density = pd.read_csv(f"{DENSITY_DIR}municipality_density_levels.csv")
 
-dict_sales = {
-    property_type: pd.merge(left=df, right=density, how="left", on="code_commune")
-    for property_type, df in dict_sales.items()
-}
-
-# add year, quarter, month and day
-dict_sales = {
-    property_type: add_date_components(df, date_var="date_mutation") 
-    for property_type, df in dict_sales.items()
-}
-
-# split by geo area
-dict_sales_splitted = {
-
-    property_type: {
-        "cities": geo.split_by_city(df), 
-        "urban_areas": geo.get_urban_areas(df), 
-        "rural_areas": geo.get_rural_areas(df)
-    } 
-
-    for property_type, df in dict_sales.items()
-    
-}
-
-# check coherence of transactions number per property type
-
-for property_type, dfs_splitted in dict_sales_splitted.items(): 
-
-    n1 = dict_sales[property_type].shape[0] 
-    n1 -= dict_sales[property_type]\
-        .degre_densite\
-        .isna()\
-        .sum()
-        
-    n2 = 0    
-    for key, dfs in dfs_splitted.items(): 
-        if key == "cities": 
-            n2 += sum(df.shape[0] for df in dfs.values()) 
-        else:
-            n2 += dfs.shape[0] 
-    
-    assert n1 == n2
+# preprocess chunks and write partitions 
+counts = dvf.stream_year_to_parquet(
+    zip_dir=ZIP_DIR, 
+    year=year, 
+    store_dir=STORE_DIR, 
+    regions_dpts=regions_dpts, 
+    density=density, 
+    chunk_size=chunk_size
+)
 
 # build summary table 
 table = Table()
@@ -180,34 +79,12 @@ table.add_column("Zone géographique")
 table.add_column("Maisons")
 table.add_column("Appartements")
 
-n_houses_tot, n_flats_tot = 0, 0
+for geo_area, row in counts.iterrows(): 
+    table.add_row(geo_area, f"{row['houses']:,}", f"{row['flats']:,}")
 
-for city in geo.CITIES:         
-    n_houses = dict_sales_splitted["houses"]["cities"][city].shape[0]
-    n_flats = dict_sales_splitted["flats"]["cities"][city].shape[0]
-    table.add_row(city, f"{n_houses:,}", f"{n_flats:,}")
-
-    n_houses_tot += n_houses
-    n_flats_tot += n_flats 
-
-for area in ("urban_areas", "rural_areas"): 
-    n_houses = dict_sales_splitted["houses"][area].shape[0]
-    n_flats = dict_sales_splitted["flats"][area].shape[0]
-    table.add_row(area, f"{n_houses:,}", f"{n_flats:,}")
-
-    n_houses_tot += n_houses
-    n_flats_tot += n_flats 
-
-table.add_row("Total", f"{n_houses_tot:,}", f"{n_flats_tot:,}")
+table.add_row("Total", f"{counts['houses'].sum():,}", f"{counts['flats'].sum():,}")
 
 console = Console()
 console.print(table)
 
-# save as pickle file
-
-file_path = f"{DATA_DIR}cleaned/dvf_splitted_{year}.pkl"
-
-with open(file_path, "wb") as file: 
-    pkl.dump(dict_sales_splitted, file)
-
-print(f"File sucessefully saved at {file_path}.")
\ No newline at end of file
+print(f"Partitions of {year} sucessefully saved at {STORE_DIR}.")
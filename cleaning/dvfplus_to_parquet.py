@@ -0,0 +1,52 @@
+"""Description. Automated script to convert DVF+ tables from zip folder to parquet partitioned by department.
+
+Example:
+~\mon-predicteur-immo\cleaning> python dvfplus_to_parquet.py
+~\mon-predicteur-immo\cleaning> python dvfplus_to_parquet.py -geo_area Paris -property_type flats
+Paris_flats successfully saved at ../data/dvf+_parquet/geo_area=Paris/property_type=flats.
+"""
+
+# required libraries
+import sys
+sys.path.append("../")
+
+from lib.dataset.loader import list_dvfplus_tables, convert_dvfplus_to_parquet
+
+from tqdm import tqdm
+
+# enums
+DATA_DIR = "../data"
+ZIP_NAME = "dvf+"
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+tables = list_dvfplus_tables(zip_dir=DATA_DIR, zip_name=ZIP_NAME)
+
+if "-geo_area" in sys.argv:
+    geo_area = extract_info(flag="-geo_area")
+    tables = [table for table in tables if table[0] == geo_area]
+
+if "-property_type" in sys.argv:
+    property_type = extract_info(flag="-property_type")
+    tables = [table for table in tables if table[1] == property_type]
+
+if len(tables) == 0:
+    print("No DVF+ table matches the provided flags.")
+    sys.exit(1)
+
+loop = tqdm(tables)
+
+for geo_area, property_type in loop:
+    loop.set_description(f"Converting {geo_area}_{property_type}")
+
+    table_dir = convert_dvfplus_to_parquet(
+        zip_dir=DATA_DIR,
+        zip_name=ZIP_NAME,
+        geo_area=geo_area,
+        property_type=property_type
+    )
+
+    print(f"{geo_area}_{property_type} successfully saved at {table_dir}.")
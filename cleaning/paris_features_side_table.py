@@ -0,0 +1,33 @@
+"""Description. Automated script to pre-join the external features of Paris in a memory-mapped side table indexed by id_mutation.
+
+Example:
+~\mon-predicteur-immo\cleaning> python paris_features_side_table.py
+Side table of 256,113 transactions and 24 features successfully saved at ../data/other/paris_features.
+"""
+
+# required libraries
+import sys
+sys.path.append("../")
+
+from lib.dataset.external import EXTERNAL_FILES, SideTable, build_side_table
+
+import os
+
+# enums
+DATA_DIR = "../data/"
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+data_dir = extract_info(flag="-data_dir") if "-data_dir" in sys.argv else DATA_DIR
+
+for file_name in EXTERNAL_FILES:
+    if not os.path.exists(f"{data_dir}other/{file_name}.csv"):
+        print(f"{data_dir}other/{file_name}.csv is missing.")
+        sys.exit(1)
+
+table = SideTable(build_side_table(data_dir=data_dir))
+
+print(f"Side table of {len(table):,} transactions and {len(table.columns)} features successfully saved at {table.table_dir}.")
@@ -1,13 +1,20 @@
-from .loader import load_dvfplus, to_dataloader
+from .loader import load_dvfplus, convert_dvfplus_to_parquet, to_dataloader
 from .build import prepare_dataset, prepare_dummies
+from .trend import TrendPriceStore
+from .external import SideTable, build_side_table
 from .split import (
     temporal_train_test_split, 
     get_feature_vector, 
-    get_target_vector
+    get_target_vector, 
+    to_matrix, 
+    stack_matrices
 )
 from .feature_selection import (
     compute_mutual_info, 
     compute_rf_importances, 
+    compute_mutual_info_screening, 
+    compute_xgb_importances, 
+    screen_features, 
     select_important_features
 )
 from .statistics import summarize_dataset
\ No newline at end of file
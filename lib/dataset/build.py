@@ -24,13 +24,11 @@ from lib.enums import (
 
 from .utils import (
     flatten_list, 
-    float_to_string, 
+    floats_to_strings, 
+    map_unique_values, 
     filter_numeric_var, 
     transform_price, 
-    replace_inf_with_nan, 
     extract_int_from_string, 
-    calc_movav_prices, 
-    add_movav_prices, 
     is_numeric, 
     get_cols_with_one_value, 
     process_window_feature, 
@@ -39,9 +37,25 @@ from .utils import (
     remove_reference_levels, 
     impute_missing_values
 )
+from .external import KEY_VAR, SideTable, read_external_tables
+
+from .trend import TrendPriceStore
 
 from lib.preprocessing.utils import remove_na_cols, get_na_proportion
 
+import pandas as pd
+import numpy as np 
+
+def log_transform(x: Series) -> np.ndarray: 
+    """Description. Columnar log transformation of pandas Series with infinite values replaced by NaN."""
+
+    with np.errstate(divide="ignore", invalid="ignore"): 
+        y = transform_price(x.to_numpy(dtype="float64"), log=True)
+
+    y[np.isinf(y)] = np.nan
+
+    return y
+
 def prepare_dataset(
     df: DataFrame,
     target_var: str,
@@ -53,7 +67,8 @@ def prepare_dataset(
     neighborhood_var: Optional[str]=None, 
     keep_location_vars: bool=False,
     print_summary: bool=True, 
-    return_var_names: bool=True
+    return_var_names: bool=True, 
+    trend_store: Optional[TrendPriceStore]=None
 ) -> Tuple:
     """Description. Dataset preparation from DVF+ raw data using methods from utils.py.
     
@@ -69,6 +84,8 @@ def prepare_dataset(
         keep_location_vars (bool): whether to keep location variables.
         print_summary (bool): whether to print summary of dataset preparation.
         return_var_names (bool): whether to return list of variables from DVF, BNB and other variables.
+        trend_store (Optional[TrendPriceStore]): store of daily prices updated with df's transactions before 
+            computing moving averages, e.g. loaded with previous months. A new store is used if None.
         
     Returns:
         Tuple: 
@@ -139,14 +156,14 @@ def prepare_dataset(
 
     # Apply log transformation to quantitative variables
     if target_var == "l_valeur_fonciere": 
-        df.loc[:, target_var] = df.apply(lambda row: transform_price(row.valeur_fonciere, True), axis=1) 
+        with np.errstate(divide="ignore", invalid="ignore"): 
+            df.loc[:, target_var] = transform_price(df["valeur_fonciere"].to_numpy(dtype="float64"), log=True)
 
         for var in numeric_vars: 
             if var not in DISCRETE_VARS and var in df.columns: 
 
                 var_name = f"l_{var}"
-                df.loc[:, var_name] = df[var].apply(transform_price, log=True)
-                df = replace_inf_with_nan(df, var_name) 
+                df.loc[:, var_name] = log_transform(df[var])
 
                 if var in dvf_vars_updated:
                     dvf_vars_updated.append(var_name)
@@ -160,7 +177,12 @@ def prepare_dataset(
                 summary["created"].append(var_name)
 
     # Create price per square meter variable
-    df.loc[:, "valeur_fonciere_m2"] = df.apply(lambda row: transform_price(row.valeur_fonciere, False, row.surface_reelle_bati), axis=1) 
+    with np.errstate(divide="ignore", invalid="ignore"): 
+        df.loc[:, "valeur_fonciere_m2"] = transform_price(
+            df["valeur_fonciere"].to_numpy(dtype="float64"), 
+            log=False, 
+            area=df["surface_reelle_bati"].to_numpy(dtype="float64")
+        ) 
     
     dvf_vars_updated.append("valeur_fonciere_m2")
     summary["created"].append("valeur_fonciere_m2")
@@ -178,14 +200,14 @@ def prepare_dataset(
     # Convert categorical variables to object type
     for var in CATEGORICAL_VARS: 
         if var in df.columns: 
-            df.loc[:, var] = df[var].apply(float_to_string) 
+            df.loc[:, var] = floats_to_strings(df[var]) 
 
     # Extract neighborhood_var from nom_commune if neighborhood_var is arrondissement
     if neighborhood_var == "arrondissement": 
         if "nom_commune" not in df.columns: 
             raise ValueError("nom_commune not in df.columns")
         
-        df.loc[:, neighborhood_var] = df.nom_commune.apply(extract_int_from_string)
+        df.loc[:, neighborhood_var] = map_unique_values(df.nom_commune, extract_int_from_string)
 
         dvf_vars_updated.append(neighborhood_var)
         summary["created"].append(neighborhood_var)
@@ -197,15 +219,19 @@ def prepare_dataset(
     # Create moving average lagged prices
     if mov_av_windows != None: 
 
-        for window in mov_av_windows: 
-            tmp = calc_movav_prices(df, window, ma_lag, "valeur_fonciere", date_var, neighborhood_var)
-            df = add_movav_prices(df, tmp, date_var, neighborhood_var) 
+        if trend_store is None: 
+            trend_store = TrendPriceStore("valeur_fonciere", date_var, neighborhood_var)
 
+        trend_store.update(df)
+        df = trend_store.add_movav_prices(df, mov_av_windows, ma_lag)
+
+        for window in mov_av_windows: 
             ma_var = f"valeur_fonciere_ma{window}"
 
             if target_var == "l_valeur_fonciere": 
                 l_ma_var = f"l_{ma_var}"
-                df.loc[:, l_ma_var] = df[ma_var].apply(transform_price, log=True)
+                with np.errstate(divide="ignore", invalid="ignore"): 
+                    df.loc[:, l_ma_var] = transform_price(df[ma_var].to_numpy(dtype="float64"), log=True)
 
                 df.drop(labels=[ma_var], axis=1, inplace=True)
 
@@ -216,8 +242,6 @@ def prepare_dataset(
                 dvf_vars_updated.append(ma_var)
                 summary["created"].append(ma_var)
 
-        del tmp 
-
     # Preprocess dummies related to baie_orientation
     baie_orientation_cols = [col for col in df.columns if "baie_orientation" in col]
     if len(baie_orientation_cols) > 0: 
@@ -240,7 +264,8 @@ def prepare_dummies(
     remove_cols_with_one_value: bool=True,
     dvf_vars: Optional[List]=None,    
     bnb_vars: Optional[List]=None, 
-    other_vars: Optional[List]=None
+    other_vars: Optional[List]=None, 
+    dtype: str="uint8"
 ) -> Tuple: 
     """Description. Prepare dummies for categorical variables.
     
@@ -252,6 +277,7 @@ def prepare_dummies(
         dvf_vars (Optional[List]): list of variables from DVF.
         bnb_vars (Optional[List]): list of variables from BNB.
         other_vars (Optional[List]): list of other variables.
+        dtype (str): dtype of dummies. Defaults to "uint8".
         
     Returns:
         Tuple: DVF dataset with dummies, list of variables from DVF, list of variables from BNB, list of other variables."""
@@ -263,7 +289,7 @@ def prepare_dummies(
 
     if len(categorical_vars) > 0: 
 
-        df = to_dummies(df, categorical_vars)
+        df = to_dummies(df, categorical_vars, dtype)
         
         if dvf_vars is not None:
             dummies_added_dvf = [
@@ -379,4 +405,21 @@ def add_public_facilities(df: DataFrame, facilities: DataFrame) -> DataFrame:
         raise ValueError("id_mutation must be in both datasets.")    
 
     new_df = df.merge(facilities, on="id_mutation", how="left")
-    return new_df
\ No newline at end of file
+    return new_df
+
+def add_paris_features(df: DataFrame, data_dir: str) -> DataFrame: 
+    """Description. Add distance to transportation, distance to parks and public facilities read from data_dir.
+    
+    Details: only avaiblable for Paris. If the side table has been built (see lib.dataset.external), only the 
+    rows of df are looked up in the memory-mapped table, ValueError is raised if it is outdated. Otherwise 
+    the rows of df are looked up in each external file and added in one join. As with merges, index is reset."""
+
+    side_table = SideTable.from_data_dir(data_dir)
+
+    if side_table is not None: 
+        return side_table.join(df)
+
+    key = df[KEY_VAR].astype(str).values
+    features = [table.reindex(key).reset_index(drop=True) for table in read_external_tables(data_dir)]
+
+    return pd.concat([df.reset_index(drop=True)] + features, axis=1)
@@ -0,0 +1,166 @@
+"""Description. Content-addressed cache of training and test sets stored as memory-mappable .npy files (.npz for sparse matrices)."""
+
+from .loader import get_store_dir, get_table_dir
+
+from zipfile import ZipFile
+from typing import Callable, Dict, List, Optional, Union
+
+import scipy.sparse as sp
+import numpy as np
+
+import hashlib
+import shutil
+import json
+import os
+
+ARRAY_NAMES = ["X_tr", "y_tr", "X_te", "y_te"]
+
+def save_array(file_path: str, array: Union[np.ndarray, sp.spmatrix]) -> str: 
+    """Description. Save dense array to {file_path}.npy or sparse matrix to {file_path}.npz, return saved file path."""
+
+    if sp.issparse(array): 
+        sp.save_npz(f"{file_path}.npz", array.tocsr(), compressed=False)
+        return f"{file_path}.npz"
+
+    array = np.asarray(array)
+
+    if array.dtype == "object":
+        array = array.astype("float64")
+
+    np.save(f"{file_path}.npy", np.ascontiguousarray(array))
+    return f"{file_path}.npy"
+
+def load_array(file_path: str, mmap_mode: Optional[str]="r") -> Union[np.ndarray, sp.csr_matrix]: 
+    """Description. Load array saved with save_array, dense arrays are memory-mapped with mmap_mode."""
+
+    if os.path.exists(f"{file_path}.npz"): 
+        return sp.load_npz(f"{file_path}.npz").tocsr()
+
+    return np.load(f"{file_path}.npy", mmap_mode=mmap_mode)
+
+def hash_file(file_path: str, chunk_size: int=1 << 20) -> str:
+    """Description. Return sha256 checksum of file."""
+
+    sha256 = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+def hash_table(
+    zip_dir: str,
+    zip_name: str,
+    geo_area: str,
+    property_type: str,
+    backend: str="zip",
+    extra_files: Optional[List[str]]=None
+) -> str:
+    """Description. Return hash of the content of DVF+ table (and of extra source files).
+
+    Details: CRC32 and size stored in zip folder are used for zip backend so that the csv file
+    is not decompressed, parquet files are hashed for parquet backend."""
+
+    sha256 = hashlib.sha256()
+
+    if backend == "zip":
+        info = ZipFile(f"{zip_dir}/{zip_name}.zip").getinfo(f"{zip_name}/{geo_area}_{property_type}.csv")
+        sha256.update(f"{info.CRC}-{info.file_size}".encode())
+
+    elif backend == "parquet":
+        table_dir = get_table_dir(get_store_dir(zip_dir, zip_name), geo_area, property_type)
+
+        for root, _, file_names in sorted(os.walk(table_dir)):
+            for file_name in sorted(file_names):
+                sha256.update(os.path.relpath(f"{root}/{file_name}", table_dir).encode())
+                sha256.update(hash_file(f"{root}/{file_name}").encode())
+
+    else:
+        raise ValueError(f"backend must be 'zip' or 'parquet', got {backend}.")
+
+    for file_path in extra_files or []:
+        sha256.update(hash_file(file_path).encode())
+
+    return sha256.hexdigest()
+
+def get_cache_key(table_hash: str, params: Dict) -> str:
+    """Description. Return cache key of training set built from table with preprocessing params."""
+
+    content = json.dumps({"table": table_hash, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:24]
+
+def save_training_set(cache_dir: str, key: str, training_set: Dict, params: Optional[Dict]=None) -> str:
+    """Description. Save arrays of training set with save_array and feature names as json, return cache entry path.
+
+    Details: files are written in a temporary directory renamed at the end so that an entry is never partially written."""
+
+    entry_dir = f"{cache_dir}/{key}"
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    for name in ARRAY_NAMES:
+        save_array(f"{tmp_dir}/{name}", training_set[name])
+
+    with open(f"{tmp_dir}/features.json", "w") as f:
+        json.dump({"features": list(training_set["features"]), "params": params}, f, indent=2, default=str)
+
+    if os.path.exists(entry_dir):
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, entry_dir)
+
+    return entry_dir
+
+def load_training_set(cache_dir: str, key: str, mmap_mode: Optional[str]="r") -> Optional[Dict]:
+    """Description. Load cached training set (dense arrays memory-mapped by default) or None if key is not cached."""
+
+    entry_dir = f"{cache_dir}/{key}"
+
+    if not os.path.exists(f"{entry_dir}/features.json"):
+        return None
+
+    with open(f"{entry_dir}/features.json", "r") as f:
+        training_set = {"features": json.load(f)["features"]}
+
+    for name in ARRAY_NAMES:
+        training_set[name] = load_array(f"{entry_dir}/{name}", mmap_mode)
+
+    return training_set
+
+def cached_training_set(
+    cache_dir: Optional[str],
+    table_hash: str,
+    params: Dict,
+    build: Callable[[], Dict],
+    mmap_mode: Optional[str]="r"
+) -> Dict:
+    """Description. Return cached training set of (table, params) or build, cache and return it.
+
+    Args:
+        cache_dir (Optional[str]): path to cache directory, cache is not used if None.
+        table_hash (str): hash of source table, e.g. from hash_table.
+        params (Dict): preprocessing arguments used to build training set.
+        build (Callable[[], Dict]): function returning features, X_tr, y_tr, X_te and y_te.
+        mmap_mode (Optional[str]): memory-map mode of cached arrays. Defaults to "r".
+
+    Example:
+
+    >>> from lib.dataset.cache import hash_table, cached_training_set
+    >>> table_hash = hash_table("./data", "dvf+", "Paris", "flats")
+    >>> training_set = cached_training_set("./backup/cache", table_hash, preproc_args, lambda: build_training_set(df, preproc_args))
+    >>> training_set["X_tr"].shape
+    (152648, 87)"""
+
+    if cache_dir is None:
+        return build()
+
+    key = get_cache_key(table_hash, params)
+    training_set = load_training_set(cache_dir, key, mmap_mode)
+
+    if training_set is None:
+        save_training_set(cache_dir, key, build(), params)
+        training_set = load_training_set(cache_dir, key, mmap_mode)
+
+    return training_set
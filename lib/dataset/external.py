@@ -0,0 +1,206 @@
+"""Description. External features of Paris transactions (transportation, parks, facilities) pre-joined in a memory-mapped side table."""
+
+from pandas.core.frame import DataFrame
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+import numpy as np
+
+import json
+import os
+
+KEY_VAR = "id_mutation"
+
+EXTERNAL_FILES = ["transportation", "parks", "facilities"]
+
+def get_side_table_dir(data_dir: str) -> str:
+    """Description. Return path to the side table built from the external files of data_dir."""
+
+    return f"{data_dir}other/paris_features"
+
+def get_source_stats(data_dir: str) -> Dict:
+    """Description. Return size and modification time of each external file, used to detect outdated side tables."""
+
+    stats = {}
+
+    for file_name in EXTERNAL_FILES:
+        file_stat = os.stat(f"{data_dir}other/{file_name}.csv")
+        stats[file_name] = {"size": file_stat.st_size, "mtime": file_stat.st_mtime}
+
+    return stats
+
+def read_external_tables(data_dir: str) -> List[DataFrame]:
+    """Description. Read external files indexed by id_mutation, in the order of EXTERNAL_FILES.
+
+    Details: each file has at most one row per transaction, duplicated ids are dropped (first row kept)."""
+
+    tables = []
+
+    for file_name in EXTERNAL_FILES:
+        table = pd.read_csv(f"{data_dir}other/{file_name}.csv")
+        table[KEY_VAR] = table[KEY_VAR].astype(str)
+
+        tables.append(table.drop_duplicates(subset=KEY_VAR).set_index(KEY_VAR))
+
+    return tables
+
+def build_side_table(data_dir: str, table_dir: Optional[str]=None) -> str:
+    """Description. Pre-join external files into a side table indexed by id_mutation.
+
+    Details: the table directory contains
+        - ids.npy: sorted ids as fixed-width strings, searched by binary search.
+        - values.npy: float64 features stored column by column (Fortran order).
+        - manifest.json: names of features, their dtypes in their own file (the outer join of files turns
+        integer columns into floats) and size and modification time of files.
+
+    Returns:
+        str: path to the side table."""
+
+    if table_dir is None:
+        table_dir = get_side_table_dir(data_dir)
+
+    sources = get_source_stats(data_dir)
+    tables = read_external_tables(data_dir)
+
+    dtypes = {col: str(dtype) for table in tables for col, dtype in table.dtypes.items()}
+    features = tables[0].join(tables[1:], how="outer").sort_index()
+
+    os.makedirs(table_dir, exist_ok=True)
+
+    np.save(f"{table_dir}/ids.npy", features.index.to_numpy(dtype=str))
+    np.save(f"{table_dir}/values.npy", np.asfortranarray(features.to_numpy(dtype="float64")))
+
+    manifest = {
+        "columns": list(features.columns),
+        "dtypes": [dtypes[col] for col in features.columns],
+        "n_rows": len(features),
+        "sources": sources
+    }
+
+    with open(f"{table_dir}/manifest.json", "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    return table_dir
+
+class SideTable:
+    """Description. Read-only side table of features indexed by id_mutation and memory-mapped from disk.
+
+    Details: only the pages containing the ids searched and the rows looked up are read, so that the
+    transactions of one zip code are joined without loading the external files. Side tables opened with
+    from_data_dir are checked against the size and modification time of the external files.
+
+    Args:
+        table_dir (str): path to side table built by build_side_table.
+        mmap_mode (Optional[str]): memory-map mode of arrays, arrays are loaded in memory if None. Defaults to "r".
+
+    Example:
+
+    >>> from lib.dataset.external import SideTable, build_side_table
+    >>> table = SideTable(build_side_table(data_dir="./data/"))
+    >>> table
+    SideTable(n_rows=256113, n_features=24)
+    >>> df = table.join(df)"""
+
+    def __init__(self, table_dir: str, mmap_mode: Optional[str]="r"):
+        self.table_dir = table_dir
+
+        with open(f"{table_dir}/manifest.json", "r") as f:
+            manifest = json.load(f)
+
+        self.columns = manifest["columns"]
+        self.dtypes = dict(zip(manifest["columns"], manifest["dtypes"]))
+        self.sources = manifest.get("sources")
+
+        self.ids = np.load(f"{table_dir}/ids.npy", mmap_mode=mmap_mode)
+        self.values = np.load(f"{table_dir}/values.npy", mmap_mode=mmap_mode)
+
+    def __repr__(self) -> str:
+        return f"SideTable(n_rows={len(self.ids)}, n_features={len(self.columns)})"
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def is_stale(self, data_dir: str) -> bool:
+        """Description. Whether external files of data_dir have changed since the side table was built.
+
+        Details: a side table without external files (e.g. copied alone to a server) is not stale."""
+
+        if not all(os.path.exists(f"{data_dir}other/{file_name}.csv") for file_name in EXTERNAL_FILES):
+            return False
+
+        return self.sources != get_source_stats(data_dir)
+
+    @classmethod
+    def from_data_dir(cls, data_dir: str, rebuild: bool=False) -> Optional["SideTable"]:
+        """Description. Open side table of data_dir or return None if it has not been built.
+
+        Details: if external files have changed since the side table was built, it is rebuilt if rebuild,
+        otherwise ValueError is raised."""
+
+        table_dir = get_side_table_dir(data_dir)
+
+        if not os.path.exists(f"{table_dir}/manifest.json"):
+            return None
+
+        table = cls(table_dir)
+
+        if table.is_stale(data_dir):
+
+            if not rebuild:
+                raise ValueError(f"Side table {table_dir} is outdated, rebuild it with cleaning/paris_features_side_table.py.")
+
+            table = cls(build_side_table(data_dir, table_dir))
+
+        return table
+
+    def find(self, ids: np.ndarray) -> np.ndarray:
+        """Description. Return row of each id in side table, -1 if id is missing."""
+
+        ids = np.asarray(ids, dtype=str)
+
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1)
+
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[rows] == ids
+
+        return np.where(found, rows, -1)
+
+    def lookup(self, ids: np.ndarray, columns: Optional[List[str]]=None) -> DataFrame:
+        """Description. Return features of ids (missing values if id is not in side table).
+
+        Details: integer features are cast back to their dtype in their file when no value is missing, as with a merge."""
+
+        if columns is None:
+            columns = self.columns
+
+        rows = self.find(ids)
+        found = rows >= 0
+
+        col_idxs = [self.columns.index(col) for col in columns]
+        values = np.full((len(rows), len(columns)), np.nan)
+
+        if found.any():
+            values[found] = self.values[rows[found]][:, col_idxs]
+
+        features = {}
+
+        for j, col in enumerate(columns):
+            dtype = self.dtypes[col]
+
+            if dtype.startswith("int") and not np.isnan(values[:, j]).any():
+                features[col] = values[:, j].astype(dtype)
+            else:
+                features[col] = values[:, j]
+
+        return pd.DataFrame(features)
+
+    def join(self, df: DataFrame, columns: Optional[List[str]]=None) -> DataFrame:
+        """Description. Add features of side table to DVF+ transactions in one left join on id_mutation.
+
+        Details: index is reset as with a merge."""
+
+        features = self.lookup(df[KEY_VAR].astype(str).to_numpy(), columns)
+
+        return pd.concat([df.reset_index(drop=True), features], axis=1)
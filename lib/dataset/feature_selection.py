@@ -3,8 +3,13 @@ import pandas as pd
 
 from sklearn.feature_selection import mutual_info_regression
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.inspection import permutation_importance
 from sklearn.metrics import mean_absolute_percentage_error
 
+from joblib import Parallel, delayed
+from scipy import stats
+import scipy.sparse as sp
+
 from typing import (
     Optional, 
     Dict, 
@@ -67,6 +72,264 @@ def compute_rf_importances(
     importances = pd.Series(rf.feature_importances_, index=feature_names).sort_values(ascending=False)
     return importances
 
+def stratified_subsample(
+    y: np.ndarray, 
+    n_samples: int, 
+    n_bins: int=10, 
+    random_state: Optional[int]=None
+) -> np.ndarray: 
+    """Description. Draw indices of a subsample stratified by quantile bins of target.
+    
+    Details: each bin of the target distribution keeps its proportion, all indices are returned if n_samples >= len(y).
+    
+    Args:
+        y (np.ndarray): Target vector.
+        n_samples (int): Size of subsample.
+        n_bins (int): Number of quantile bins of target.
+        random_state (Optional[int]): Seed of random generator.
+        
+    Returns:
+        np.ndarray: Sorted indices of subsample."""
+
+    y = np.asarray(y)
+
+    if n_samples >= len(y): 
+        return np.arange(len(y))
+
+    rng = np.random.default_rng(random_state)
+
+    edges = np.unique(np.quantile(y, np.linspace(0, 1, n_bins + 1)[1:-1]))
+    bins = np.searchsorted(edges, y, side="right")
+
+    idxs = []
+    for b in np.unique(bins): 
+        bin_idxs = np.flatnonzero(bins == b)
+        n_bin = max(1, int(round(n_samples * len(bin_idxs) / len(y))))
+        idxs.append(rng.choice(bin_idxs, size=min(n_bin, len(bin_idxs)), replace=False))
+
+    return np.sort(np.concatenate(idxs))
+
+def get_dense_rows(X: Union[np.ndarray, sp.spmatrix], idxs: np.ndarray) -> np.ndarray: 
+    """Description. Return rows idxs of feature matrix (dense or sparse) as dense float64 array."""
+
+    X = X[idxs]
+
+    if sp.issparse(X): 
+        X = X.toarray()
+
+    return np.asarray(X, dtype="float64")
+
+def summarize_importances(importances: np.ndarray, feature_names: List, alpha: float=.05) -> pd.DataFrame: 
+    """Description. Mean, standard deviation and Student confidence interval of repeated importances.
+    
+    Args:
+        importances (np.ndarray): Importances of shape (n_repeats, n_features).
+        feature_names (List): List of feature names.
+        alpha (float): Confidence interval level is 1 - alpha.
+        
+    Returns:
+        pd.DataFrame: mean, std, lower and upper columns sorted by mean in descending order."""
+
+    n_repeats = importances.shape[0]
+
+    mean = importances.mean(axis=0)
+    std = importances.std(axis=0, ddof=1) if n_repeats > 1 else np.zeros_like(mean)
+    half_width = stats.t.ppf(1 - alpha / 2, max(n_repeats - 1, 1)) * std / np.sqrt(n_repeats)
+
+    summary = pd.DataFrame({
+        "mean": mean, 
+        "std": std, 
+        "lower": mean - half_width, 
+        "upper": mean + half_width
+    }, index=feature_names)
+
+    return summary.sort_values(by="mean", ascending=False)
+
+def compute_mutual_info_screening(
+    X: Union[np.ndarray, sp.spmatrix], 
+    y: np.ndarray, 
+    feature_names: List, 
+    n_samples: int=20000, 
+    n_repeats: int=5, 
+    n_neighbors: int=10, 
+    alpha: float=.05, 
+    n_jobs: int=-1, 
+    random_state: Optional[int]=0
+) -> pd.DataFrame: 
+    """Description. Estimate mutual information of each feature on stratified subsamples, features in parallel.
+    
+    Details: MI of a feature only depends on this feature and the target, so features are estimated in 
+    parallel (joblib). Estimation is repeated on n_repeats subsamples to get a confidence interval.
+    
+    Args:
+        X (Union[np.ndarray, sp.spmatrix]): Feature vector.
+        y (np.ndarray): Target vector.
+        feature_names (List): List of feature names.
+        n_samples (int): Size of each subsample.
+        n_repeats (int): Number of subsamples.
+        n_neighbors (int): Number of neighbors to use for MI estimation.
+        alpha (float): Confidence interval level is 1 - alpha.
+        n_jobs (int): Number of parallel jobs (-1 for all CPUs).
+        random_state (Optional[int]): Seed of subsampling.
+        
+    Returns:
+        pd.DataFrame: Mean, standard deviation and confidence interval bounds of MI of each feature, 
+        sorted by mean in descending order."""
+
+    y = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+
+    mi = np.zeros((n_repeats, len(feature_names)))
+
+    with Parallel(n_jobs=n_jobs) as parallel: 
+        for i in range(n_repeats): 
+            idxs = stratified_subsample(y, n_samples, random_state=rng.integers(2**31))
+            X_sub, y_sub = get_dense_rows(X, idxs), y[idxs]
+
+            mi[i] = np.concatenate(parallel(
+                delayed(mutual_info_regression)(
+                    X_sub[:, [j]], 
+                    y_sub, 
+                    discrete_features=False, 
+                    n_neighbors=n_neighbors, 
+                    random_state=i
+                )
+                for j in range(X_sub.shape[1])
+            ))
+
+    return summarize_importances(mi, feature_names, alpha)
+
+def compute_xgb_importances(
+    X: Union[np.ndarray, sp.spmatrix], 
+    y: np.ndarray, 
+    feature_names: List, 
+    importance_type: str="gain", 
+    n_samples: Optional[int]=200000, 
+    n_repeats: int=5, 
+    alpha: float=.05, 
+    n_jobs: int=-1, 
+    params: Optional[Dict]=None, 
+    random_state: Optional[int]=0
+) -> pd.DataFrame: 
+    """Description. Rank features with a histogram XGBoost booster fitted on a stratified subsample.
+    
+    Details: 
+        - gain: average gain of the splits on each feature.
+        - permutation: decrease of R2 when a feature is shuffled, on a held-out stratified subsample, 
+        repeated n_repeats times.
+    
+    Args:
+        X (Union[np.ndarray, sp.spmatrix]): Feature vector.
+        y (np.ndarray): Target vector.
+        feature_names (List): List of feature names.
+        importance_type (str): "gain" or "permutation".
+        n_samples (Optional[int]): Size of training subsample, all rows if None.
+        n_repeats (int): Number of permutations of each feature.
+        alpha (float): Confidence interval level is 1 - alpha.
+        n_jobs (int): Number of threads of booster and permutation jobs.
+        params (Optional[Dict]): arguments to pass to XGBRegressor.
+        random_state (Optional[int]): Seed of subsampling, booster and permutations.
+        
+    Returns:
+        pd.DataFrame: mean, std, lower and upper columns sorted by mean in descending order 
+        (std is 0 for gain importances)."""
+
+    from xgboost import XGBRegressor
+
+    if importance_type not in ("gain", "permutation"): 
+        raise ValueError(f"importance_type must be 'gain' or 'permutation', got {importance_type}.")
+
+    y = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+
+    idxs = stratified_subsample(y, n_samples or len(y), random_state=rng.integers(2**31))
+
+    booster_params = {
+        "tree_method": "hist", 
+        "n_estimators": 200, 
+        "max_depth": 6, 
+        "learning_rate": .1, 
+        "n_jobs": n_jobs, 
+        "random_state": random_state
+    }
+    booster_params.update(params or {})
+
+    if importance_type == "gain": 
+        booster = XGBRegressor(importance_type="gain", **booster_params)
+        booster.fit(X[idxs], y[idxs])
+        return summarize_importances(booster.feature_importances_[None, :], feature_names, alpha)
+
+    # hold out a stratified part of the subsample to compute permutation importances
+    is_val = np.zeros(len(idxs), dtype=bool)
+    is_val[stratified_subsample(y[idxs], len(idxs) // 5, random_state=rng.integers(2**31))] = True
+    idxs_tr, idxs_val = idxs[~is_val], idxs[is_val]
+
+    booster = XGBRegressor(**booster_params)
+    booster.fit(X[idxs_tr], y[idxs_tr])
+
+    # features are permuted in parallel, each job predicts with one thread
+    if n_jobs != 1: 
+        booster.set_params(n_jobs=1)
+
+    result = permutation_importance(
+        booster, 
+        get_dense_rows(X, idxs_val), 
+        y[idxs_val], 
+        n_repeats=n_repeats, 
+        n_jobs=n_jobs, 
+        random_state=random_state
+    )
+
+    return summarize_importances(result.importances.T, feature_names, alpha)
+
+def screen_features(
+    X: Union[np.ndarray, sp.spmatrix], 
+    y: np.ndarray, 
+    feature_names: List, 
+    threshold: Union[str, float]="75%", 
+    n_samples: int=20000, 
+    importance_type: str="gain", 
+    n_jobs: int=-1, 
+    random_state: Optional[int]=0
+) -> List: 
+    """Description. Scalable feature selection: union of features selected by subsampled MI and XGBoost importances.
+    
+    Details: replaces compute_mutual_info and compute_rf_importances on large tables, MI is estimated on 
+    stratified subsamples of n_samples rows and the booster is fitted on 10 times more rows.
+    
+    Args:
+        X (Union[np.ndarray, sp.spmatrix]): Feature vector.
+        y (np.ndarray): Target vector.
+        feature_names (List): List of feature names.
+        threshold (Union[str, float]): threshold for feature selection, see select_important_features.
+        n_samples (int): Size of MI subsamples.
+        importance_type (str): "gain" or "permutation" importances of XGBoost.
+        n_jobs (int): Number of parallel jobs (-1 for all CPUs).
+        random_state (Optional[int]): Seed of subsampling.
+        
+    Returns:
+        List: List of selected features.
+        
+    Example:
+    
+    >>> from lib.dataset.feature_selection import screen_features
+    >>> features = screen_features(X_tr, y_tr, features, threshold="75%")"""
+
+    mi = compute_mutual_info_screening(X, y, feature_names, n_samples=n_samples, n_jobs=n_jobs, random_state=random_state)
+    xgb = compute_xgb_importances(
+        X, 
+        y, 
+        feature_names, 
+        importance_type=importance_type, 
+        n_samples=10 * n_samples, 
+        n_jobs=n_jobs, 
+        random_state=random_state
+    )
+
+    selected_features = select_important_features(mi["mean"], threshold) + select_important_features(xgb["mean"], threshold)
+
+    return list(set(selected_features))
+
 def select_important_features(importances: pd.Series, threshold: Union[str, float]="mean") -> List: 
     """Description. Select features for which MI is above threshold.
     
@@ -1,26 +1,187 @@
 from zipfile import ZipFile
+import os 
 
 import pandas as pd
 import numpy as np
 import torch
 
+import pyarrow as pa
+import pyarrow.dataset as ds
+
 from pandas.core.frame import DataFrame
+from typing import Dict, List, Optional
 
 from torch.utils.data import TensorDataset, DataLoader
 
+PARTITION_VAR = "code_departement"
+
+def get_store_dir(zip_dir: str, zip_name: str) -> str: 
+    """Description. Return path to the partitioned parquet store built from DVF+ zip folder."""
+
+    return f"{zip_dir}/{zip_name}_parquet"
+
+def get_table_dir(store_dir: str, geo_area: str, property_type: str) -> str: 
+    """Description. Return path to the partitions of one DVF+ table in parquet store."""
+
+    return f"{store_dir}/geo_area={geo_area}/property_type={property_type}"
+
+def list_dvfplus_tables(zip_dir: str, zip_name: str) -> List: 
+    """Description. List (geo_area, property_type) tables contained in DVF+ zip folder."""
+
+    zip_folder = ZipFile(f"{zip_dir}/{zip_name}.zip")
+    tables = []
+
+    for file_name in zip_folder.namelist(): 
+        if not file_name.startswith(f"{zip_name}/") or not file_name.endswith(".csv"): 
+            continue
+
+        table_name = file_name[len(zip_name) + 1:-len(".csv")]
+        geo_area, property_type = table_name.rsplit("_", 1)
+        tables.append((geo_area, property_type))
+
+    return tables
+
+def convert_dvfplus_to_parquet(
+    zip_dir: str, 
+    zip_name: str, 
+    geo_area: str, 
+    property_type: str, 
+    row_group_size: int=50000
+) -> str: 
+    """Description. Convert one DVF+ table from zip folder to parquet partitioned by department.
+    
+    Args:
+        zip_dir (str): path to zip folder containing DVF+.
+        zip_name (str): name of zip folder containing DVF+.
+        geo_area (str): name of geographical area.
+        property_type (str): name of property type.
+        row_group_size (int): maximum number of rows per parquet row group.
+        
+    Returns:
+        str: path to the partitions of the converted table.
+        
+    Details: 
+        rows are sorted by zip code so that row group statistics 
+        allow filters on code_postal to skip most of the row groups."""
+
+    df = load_dvfplus(zip_dir, zip_name, geo_area, property_type)
+
+    # departments such as 2A/2B make the column a mix of integers and strings
+    if df[PARTITION_VAR].dtype == "object": 
+        df[PARTITION_VAR] = df[PARTITION_VAR].astype(str)
+
+    sort_vars = [var for var in ("code_postal", "date_mutation") if var in df.columns]
+    df = df.sort_values(by=sort_vars).reset_index(drop=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    del df 
+
+    table_dir = get_table_dir(get_store_dir(zip_dir, zip_name), geo_area, property_type)
+
+    ds.write_dataset(
+        table, 
+        base_dir=table_dir, 
+        format="parquet", 
+        partitioning=[PARTITION_VAR], 
+        partitioning_flavor="hive", 
+        existing_data_behavior="delete_matching", 
+        max_rows_per_group=row_group_size, 
+        min_rows_per_group=min(row_group_size, 10000)
+    )
+
+    return table_dir
+
+def to_expression(dataset: ds.Dataset, filters: Dict) -> ds.Expression: 
+    """Description. Convert dictionary of filters to pyarrow expression.
+    
+    Details: 
+        - a list (or tuple) of values is converted to an isin filter.
+        - a scalar value is converted to an equality filter."""
+
+    expression = None
+
+    for var_name, value in filters.items(): 
+
+        field_type = dataset.schema.field(var_name).type
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+        if pa.types.is_string(field_type) or pa.types.is_large_string(field_type): 
+            values = [str(val) for val in values]
+        
+        condition = ds.field(var_name).isin(values) if len(values) > 1 else ds.field(var_name) == values[0]
+        expression = condition if expression is None else expression & condition
+
+    return expression
+
+def load_dvfplus_parquet(
+    store_dir: str, 
+    geo_area: str, 
+    property_type: str, 
+    columns: Optional[List]=None, 
+    filters: Optional[Dict]=None
+) -> DataFrame: 
+    """Description. Load DVF+ table from parquet store with column and predicate pushdown.
+    
+    Args:
+        store_dir (str): path to parquet store created with convert_dvfplus_to_parquet.
+        geo_area (str): name of geographical area.
+        property_type (str): name of property type.
+        columns (Optional[List]): columns to read, missing columns are ignored.
+        filters (Optional[Dict]): values to select for some columns.
+        
+    Returns:
+        DataFrame: DVF+ pandas DataFrame."""
+
+    table_dir = get_table_dir(store_dir, geo_area, property_type)
+
+    if not os.path.exists(table_dir): 
+        raise FileNotFoundError(f"{table_dir} does not exist. Run convert_dvfplus_to_parquet first.")
+
+    dataset = ds.dataset(table_dir, format="parquet", partitioning="hive")
+
+    if columns is not None: 
+        columns = [col for col in columns if col in dataset.schema.names]
+
+    expression = None 
+    if filters is not None and len(filters) > 0: 
+        expression = to_expression(dataset, filters)
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    df = table.to_pandas()
+
+    return df
+
+def filter_dvfplus(df: DataFrame, filters: Dict) -> DataFrame: 
+    """Description. Apply dictionary of filters to DVF+ pandas DataFrame."""
+
+    for var_name, value in filters.items(): 
+
+        if isinstance(value, (list, tuple, set)): 
+            df = df.loc[df[var_name].isin(value), :]
+        else: 
+            df = df.loc[df[var_name] == value, :]
+
+    return df.reset_index(drop=True)
+
 def load_dvfplus(
     zip_dir: str, 
     zip_name: str, 
     geo_area: str, 
-    property_type: str
+    property_type: str, 
+    backend: str="zip", 
+    columns: Optional[List]=None, 
+    filters: Optional[Dict]=None
 ) -> DataFrame: 
-    """Description. Load DVF+ table from zip folder.
+    """Description. Load DVF+ table from zip folder or from partitioned parquet store.
 
     Args:
         zip_dir (str): path to zip folder containing DVF+.
         zip_name (str): name of zip folder containing DVF+.
         geo_area (str): name of geographical area.
         property_type (str): name of property type.
+        backend (str): "zip" to parse csv file from zip folder or "parquet" to read parquet store. Defaults to "zip".
+        columns (Optional[List]): columns to read, missing columns are ignored. Defaults to None (all columns).
+        filters (Optional[Dict]): values to select for some columns, e.g. {"code_departement": 77}. Defaults to None.
         
     Returns:
         DataFrame: DVF+ pandas DataFrame.
@@ -44,11 +205,29 @@ def load_dvfplus(
 
         [48188 rows x 74 columns]"""
 
+    if columns is not None and filters is not None: 
+        columns = columns + [var for var in filters.keys() if var not in columns]
+
+    if backend == "parquet": 
+        store_dir = get_store_dir(zip_dir, zip_name)
+        return load_dvfplus_parquet(store_dir, geo_area, property_type, columns, filters)
+
+    elif backend != "zip": 
+        raise ValueError(f"backend must be 'zip' or 'parquet', got {backend}.")
+
     zip_dirpath = f"{zip_dir}/{zip_name}.zip"
     zip_folder = ZipFile(zip_dirpath)
 
     file_name = f"{zip_name}/{geo_area}_{property_type}"
-    df = pd.read_csv(zip_folder.open(file_name + ".csv"))
+
+    usecols = None 
+    if columns is not None: 
+        usecols = lambda col: col in columns 
+
+    df = pd.read_csv(zip_folder.open(file_name + ".csv"), usecols=usecols)
+
+    if filters is not None and len(filters) > 0: 
+        df = filter_dvfplus(df, filters)
 
     return df
 
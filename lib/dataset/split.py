@@ -2,8 +2,11 @@ from pandas.core.frame import DataFrame
 from pandas.core.series import Series 
 from typing import List, Optional, Tuple, Union
 
+import scipy.sparse as sp
 import numpy as np 
 
+MATRIX_FORMATS = ["dense", "compact", "sparse"]
+
 def sort_transaction_dates(df: DataFrame, date_var: str) -> Series: 
     """Description. Store id_mutation and date_mutation."""
 
@@ -48,13 +51,64 @@ def temporal_train_test_split(df: DataFrame, date_var: str, train_prop: float) -
         test_dates 
     )  
 
+def to_sparse_matrix(X: DataFrame, dtype: str="float32") -> sp.csr_matrix: 
+    """Description. Convert DataFrame to CSR matrix column by column, without building a dense float copy.
+    
+    Details: only nonzero values are stored (NaN values are stored explicitly)."""
+
+    rows, cols, values = [], [], []
+
+    for j, col in enumerate(X.columns): 
+        column = X[col].to_numpy()
+        idxs = np.flatnonzero(column != 0)
+
+        rows.append(idxs)
+        cols.append(np.full(len(idxs), j, dtype="int32"))
+        values.append(column[idxs].astype(dtype))
+
+    matrix = sp.coo_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), 
+        shape=X.shape, 
+        dtype=dtype
+    )
+
+    return matrix.tocsr()
+
+def to_matrix(X: DataFrame, matrix_format: str="dense") -> Union[np.ndarray, sp.csr_matrix]: 
+    """Description. Convert DataFrame to feature matrix.
+    
+    Details: 
+        - dense: float64 array, as DataFrame.values.
+        - compact: float32 array, trees of XGBoost and scikit-learn are fitted on float32 values anyway.
+        - sparse: float32 CSR matrix, dummies are mostly zeros."""
+
+    if matrix_format == "dense": 
+        return X.values
+
+    if matrix_format == "compact": 
+        return X.to_numpy(dtype="float32")
+
+    if matrix_format == "sparse": 
+        return to_sparse_matrix(X, dtype="float32")
+
+    raise ValueError(f"matrix_format must be in {MATRIX_FORMATS}, got {matrix_format}.")
+
+def stack_matrices(matrices: List) -> Union[np.ndarray, sp.csr_matrix]: 
+    """Description. Stack feature matrices vertically, dense or sparse."""
+
+    if any(sp.issparse(matrix) for matrix in matrices): 
+        return sp.vstack(matrices, format="csr")
+
+    return np.concatenate(matrices)
+
 def get_feature_vector(
     df: DataFrame, 
     return_features: bool=False, 
     return_df: bool=True, 
     target: Optional[str]=None, 
-    features: Optional[List]=None
-) -> Union[Tuple, DataFrame, np.ndarray]:
+    features: Optional[List]=None, 
+    matrix_format: str="dense"
+) -> Union[Tuple, DataFrame, np.ndarray, sp.csr_matrix]:
     """Description. Get feature vector.
     
     Args:
@@ -63,9 +117,10 @@ def get_feature_vector(
         return_df (bool): Whether to return DataFrame.
         target (Optional[str]): Name of target variable.
         features (Optional[List]): List of features.
+        matrix_format (str): "dense", "compact" or "sparse" format of feature matrix if not return_df, see to_matrix.
     
     Returns: 
-        Union[Tuple, DataFrame, np.ndarray]: Feature vector, features."""
+        Union[Tuple, DataFrame, np.ndarray, sp.csr_matrix]: Feature vector, features."""
 
     if target is not None: 
         X = df.drop([target], axis=1)
@@ -78,7 +133,7 @@ def get_feature_vector(
         raise ValueError("No target or features provided.")
 
     if not return_df:
-        X = X.values
+        X = to_matrix(X, matrix_format)
 
     if return_features:
         return X, features
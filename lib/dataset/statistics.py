@@ -14,9 +14,10 @@ def summarize_dataset(df: DataFrame):
     selected = ["valeur_fonciere", "nombre_pieces_principales", "surface_reelle_bati", "surface_terrain"]
     tmp = df[selected]
 
-    tmp["valeur_fonciere_m2"] = tmp.apply(
-        lambda row: transform_price(row.valeur_fonciere, log=False, area=row.surface_reelle_bati), 
-        axis=1
+    tmp["valeur_fonciere_m2"] = transform_price(
+        tmp["valeur_fonciere"].to_numpy(dtype="float64"), 
+        log=False, 
+        area=tmp["surface_reelle_bati"].to_numpy(dtype="float64")
     )
 
     tmp.drop(columns=["valeur_fonciere"], inplace=True)
@@ -0,0 +1,180 @@
+"""Description. Store of daily prices per neighborhood to compute moving average trend prices."""
+
+from pandas.core.frame import DataFrame
+
+from typing import Dict, List, Optional
+
+from .utils import transform_price
+
+import pandas as pd
+import numpy as np
+
+class TrendPriceStore:
+    """Description. Daily sum and count of prices per neighborhood, updated incrementally.
+
+    Details: moving average prices are the same as calc_movav_prices, i.e. the rolling mean over
+    window_size trading dates of the daily mean prices of each neighborhood, lagged by lag dates.
+    As in calc_movav_prices, the lag is applied before grouping by neighborhood. All windows are
+    computed from one cumulative sum of the daily mean prices.
+
+    Args:
+        price_var (str): name of price column. Defaults to "valeur_fonciere".
+        date_var (str): name of date column. Defaults to "date_mutation".
+        neighborhood_var (Optional[str]): name of neighborhood column, prices are averaged by date only if None.
+
+    Example:
+
+    >>> from lib.dataset.trend import TrendPriceStore
+    >>> store = TrendPriceStore(neighborhood_var="arrondissement")
+    >>> store.update(df_2022)
+    >>> store.update(df_2023_01)
+    >>> df = store.add_movav_prices(df, windows=[7, 30, 90], lag=1)
+    >>> store.last_prices(windows=[7, 30, 90], lag=1)
+    {'valeur_fonciere_ma7': 412500.0, 'valeur_fonciere_ma30': 398211.5, 'valeur_fonciere_ma90': 401870.3}"""
+
+    def __init__(
+        self,
+        price_var: str="valeur_fonciere",
+        date_var: str="date_mutation",
+        neighborhood_var: Optional[str]=None
+    ):
+        self.price_var = price_var
+        self.date_var = date_var
+        self.neighborhood_var = neighborhood_var
+
+        self.aggregates = None
+        self._cache = {}
+
+    def __repr__(self) -> str:
+        n_dates = 0 if self.aggregates is None else len(self.aggregates)
+        return f"TrendPriceStore(price_var={self.price_var}, neighborhood_var={self.neighborhood_var}, n_dates={n_dates})"
+
+    @property
+    def keys(self) -> List:
+        """Description. Columns identifying one day of one neighborhood."""
+
+        if self.neighborhood_var is not None:
+            return [self.neighborhood_var, self.date_var]
+
+        return [self.date_var]
+
+    def update(self, df: DataFrame) -> "TrendPriceStore":
+        """Description. Add daily sum and count of prices of new transactions.
+
+        Details: transactions must not have been added before, e.g. add one new month of DVF at a time."""
+
+        aggregates = df.groupby(self.keys)[self.price_var].agg(["sum", "count"])
+
+        if self.aggregates is not None:
+            aggregates = self.aggregates.add(aggregates, fill_value=0)
+
+        self.aggregates = aggregates.sort_index()
+        self._cache = {}
+
+        return self
+
+    def compute(self, windows: List[int], lag: int=1) -> DataFrame:
+        """Description. Return lagged moving average prices of every window for each day and neighborhood.
+
+        Returns:
+            DataFrame: keys and one {price_var}_ma{window} column per window."""
+
+        cache_key = (tuple(windows), lag)
+
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        counts = self.aggregates["count"].to_numpy(dtype="float64")
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_prices = np.where(counts > 0, self.aggregates["sum"].to_numpy(dtype="float64") / counts, np.nan)
+
+        if lag > 0:
+            avg_prices = np.concatenate([np.full(min(lag, len(avg_prices)), np.nan), avg_prices[:-lag]])
+
+        # position of each day within its neighborhood
+        n_days = len(avg_prices)
+        if self.neighborhood_var is not None:
+            codes = pd.factorize(self.aggregates.index.get_level_values(0))[0]
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            positions = np.arange(n_days) - np.repeat(starts, np.diff(np.r_[starts, n_days]))
+        else:
+            positions = np.arange(n_days)
+
+        is_na = np.isnan(avg_prices)
+        cum_prices = np.r_[0., np.cumsum(np.where(is_na, 0., avg_prices))]
+        cum_na = np.r_[0, np.cumsum(is_na)]
+
+        mov_avg_prices = self.aggregates.index.to_frame(index=False)
+        idxs = np.arange(n_days)
+
+        for window in windows:
+            first = np.maximum(idxs + 1 - window, 0)
+            valid = (positions >= window - 1) & (cum_na[idxs + 1] == cum_na[first])
+
+            mov_avg = np.full(n_days, np.nan)
+            mov_avg[valid] = (cum_prices[idxs + 1] - cum_prices[first])[valid] / window
+
+            mov_avg_prices[f"{self.price_var}_ma{window}"] = mov_avg
+
+        self._cache[cache_key] = mov_avg_prices
+
+        return mov_avg_prices
+
+    def add_movav_prices(self, df: DataFrame, windows: List[int], lag: int=1) -> DataFrame:
+        """Description. Merge moving average prices of every window and DVF dataset at once."""
+
+        return pd.merge(
+            left=df,
+            right=self.compute(windows, lag),
+            how="left",
+            on=self.keys
+        )
+
+    def last_prices(self, windows: List[int], lag: int=1, log: bool=False) -> Dict:
+        """Description. Return moving average prices of the most recent day of the store.
+
+        Details: if log, names and values are those of the log-transformed prices (l_{price_var}_ma{window})."""
+
+        cache_key = ("last", tuple(windows), lag, log)
+
+        if cache_key not in self._cache:
+            mov_avg_prices = self.compute(windows, lag)
+
+            # last occurrence of the most recent date
+            dates = mov_avg_prices[self.date_var].to_numpy()
+            last = mov_avg_prices.iloc[len(dates) - 1 - dates[::-1].argmax()]
+
+            prices = {}
+            for window in windows:
+                var = f"{self.price_var}_ma{window}"
+
+                if log:
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        prices[f"l_{var}"] = transform_price(last[var], log=True)
+                else:
+                    prices[var] = last[var]
+
+            self._cache[cache_key] = prices
+
+        return self._cache[cache_key]
+
+    def save(self, file_path: str):
+        """Description. Save daily aggregates to parquet file."""
+
+        self.aggregates.reset_index().to_parquet(file_path, index=False)
+
+    @classmethod
+    def load(
+        cls,
+        file_path: str,
+        price_var: str="valeur_fonciere",
+        date_var: str="date_mutation",
+        neighborhood_var: Optional[str]=None
+    ) -> "TrendPriceStore":
+        """Description. Load daily aggregates saved with save."""
+
+        store = cls(price_var, date_var, neighborhood_var)
+        store.aggregates = pd.read_parquet(file_path).set_index(store.keys).sort_index()
+
+        return store
@@ -19,6 +19,7 @@ from typing import (
     List, 
     Dict, 
     Union,
+    Callable,
 )
 
 DIGIT = r"[0-9]+"
@@ -35,6 +36,27 @@ def float_to_string(x: float) -> str:
     x = x.split(".")[0]
     return x
 
+def map_unique_values(x: Series, fun: Callable) -> Series: 
+    """Description. Apply fun to each unique value of pandas Series instead of each entry.
+    
+    Details: missing values are converted one by one to keep the output of fun on None and NaN."""
+
+    codes, uniques = pd.factorize(x)
+    labels = np.array([fun(val) for val in uniques] + [None], dtype="object")
+
+    values = labels[codes]
+
+    na_mask = codes == -1
+    if na_mask.any(): 
+        values[na_mask] = [fun(val) for val in x.values[na_mask]]
+
+    return pd.Series(values, index=x.index, name=x.name)
+
+def floats_to_strings(x: Series) -> Series: 
+    """Description. Vectorized version of float_to_string for pandas Series."""
+
+    return map_unique_values(x, float_to_string)
+
 def filter_numeric_var(df: DataFrame, var_name: str, interval: Tuple) -> DataFrame:
         """Description. Select values inside interval for column of pandas DataFrame.
         
@@ -57,12 +79,18 @@ def filter_numeric_var(df: DataFrame, var_name: str, interval: Tuple) -> DataFra
         mask = (df[var_name] >= min_val) & (df[var_name] <= max_val)
         return df[mask]
 
-def transform_price(price: float, log:bool, area: Optional[float]=None) -> float: 
-    """Description. Transforms price by dividing by area and taking log if needed."""
+def transform_price(
+    price: Union[float, np.ndarray], 
+    log:bool, 
+    area: Optional[Union[float, np.ndarray]]=None
+) -> Union[float, np.ndarray]: 
+    """Description. Transforms price by dividing by area and taking log if needed.
+    
+    Details: works on scalars as well as on numpy arrays."""
 
     y = price
 
-    if area != None: 
+    if area is not None: 
         y = y / area
 
     if log: 
@@ -271,14 +299,17 @@ def remove_nan_dummy_entries(df: DataFrame, nan_dummy: str) -> DataFrame:
 
     return df
 
-def to_dummies(df: DataFrame, categorical_vars: List) -> DataFrame: 
-    """Description. Converts categorical variables to dummies in a pandas DataFrame."""
+def to_dummies(df: DataFrame, categorical_vars: List, dtype: str="uint8") -> DataFrame: 
+    """Description. Converts categorical variables to dummies in a pandas DataFrame.
+    
+    Details: dummies are stored with dtype (1 byte per value for uint8 or bool)."""
 
     df = pd.get_dummies(
         df, 
         columns=categorical_vars, 
         dummy_na=True, 
-        drop_first=False) 
+        drop_first=False, 
+        dtype=dtype) 
     
     for var in categorical_vars: 
         nan_dummy = var+"_nan"
@@ -286,6 +317,24 @@ def to_dummies(df: DataFrame, categorical_vars: List) -> DataFrame:
 
     return df
 
+def downcast_indicators(df: DataFrame, cols: Optional[List]=None, dtype: str="uint8") -> DataFrame: 
+    """Description. Convert numeric columns with only 0 and 1 values (e.g. dummies of list variables) to dtype."""
+
+    if cols is None: 
+        cols = df.columns
+
+    to_convert = [
+        col for col in cols
+        if pd.api.types.is_numeric_dtype(df[col]) 
+        and df[col].dtype != dtype
+        and df[col].isin([0, 1]).all()
+    ]
+
+    if len(to_convert) > 0: 
+        df = df.astype({col: dtype for col in to_convert})
+
+    return df
+
 def remove_reference_levels(df: DataFrame, reference_levels: Dict) -> Tuple: 
     """Description. Remove reference columns related to dummy variables."""
 
@@ -1 +1,4 @@
-from .predict import Prediction, activate_gmaps
\ No newline at end of file
+from .predict import Prediction, activate_gmaps
+from .engine import PredictionEngine
+from .geocoding import Geocoder, GoogleGeocoder, CachedGeocoder, OfflineGeocoder, FallbackGeocoder, get_default_geocoder
+from .instrumentation import PredictionHook, CallbackHook, RecordingHook
\ No newline at end of file
@@ -0,0 +1,439 @@
+"""Description. Long-lived prediction service which keeps preprocessed data and models in memory."""
+
+from .predict import (
+    find_geo_area,
+    load_area_data,
+    load_area_model,
+    activate_gmaps,
+)
+
+from .utils import (
+    extract_department_code,
+    preprocess_area_data,
+    fetch_mape,
+    return_close_properties,
+    find_closest,
+    prepare_feature_vector,
+    prepare_feature_matrix,
+    get_predicted_price,
+    get_predicted_prices,
+)
+
+from .spatial import SpatialIndex
+from .imputation import ImputationTable
+from .preprocessor import get_preprocessor
+from .geocoding import Geocoder, OfflineGeocoder, get_default_geocoder
+
+from lib.model.registry import ModelRegistry
+
+from typing import Dict, List, Optional, Tuple, Union
+
+from pandas.core.frame import DataFrame
+from pandas.core.series import Series
+
+import pandas as pd
+import numpy as np
+
+from collections import OrderedDict
+
+import threading
+import googlemaps
+
+def get_area_key(user_args: Dict) -> Optional[Tuple]:
+    """Description. Return key of the data used to predict price of user's property.
+
+    Details: preprocessed data only depends on geographical area, property type and
+    department (zip code for Paris), not on user's address."""
+
+    geo_area = find_geo_area(user_args)
+
+    if geo_area is None:
+        return None
+
+    department_code = extract_department_code(user_args["zip_code"])
+
+    if department_code == 75:
+        area_code = user_args["zip_code"]
+    else:
+        area_code = department_code
+
+    return geo_area, user_args["property_type"], area_code
+
+class PredictionEngine:
+    """Description. Predict real estate prices with warm per-area state.
+
+    Details: for each (geo_area, property_type, department) key, the preprocessed dataframe,
+    the imputed values and the last trend prices are computed once and reused by all subsequent
+    predictions. If the model has been saved with a fitted preprocessor, its statistics are used:
+    transactions are only filtered and comparable properties are preprocessed at each prediction.
+    At most max_areas states are kept, least recently used first evicted. Models are not kept in
+    states but fetched from the registry at each prediction, so that the memory budget of the
+    registry also applies to the engine.
+
+    Args:
+        data_dir (str): path to directory containing DVF+ and other data sources.
+        model_dir (str): path to directory containing trained models.
+        backend (Optional[str]): DVF+ backend, parquet store is used when it exists if None.
+        gmaps (Optional[googlemaps.Client]): Google Maps client, created on first use if None.
+        geocoder (Optional[Geocoder]): geocoder locating users' addresses. If None, addresses are located offline
+            from the transactions of the areas loaded, Google Maps is called for unknown streets and results are
+            cached at data_dir/geocodes.sqlite (see get_default_geocoder).
+        offline_geocoder (Optional[OfflineGeocoder]): offline geocoder completed with the transactions of each area
+            loaded, created if None and geocoder is None.
+        registry (Optional[ModelRegistry]): registry sharing loaded models, an unbounded registry of model_dir is used if None.
+        max_areas (Optional[int]): maximum number of cached states, unbounded if None. Defaults to 32.
+
+    Example:
+
+    >>> from lib.inference import PredictionEngine
+    >>> engine = PredictionEngine(data_dir="./data/", model_dir="./backup/models/")
+    >>> engine.predict(user_args)
+    388950.0"""
+
+    def __init__(
+        self,
+        data_dir: str,
+        model_dir: str,
+        backend: Optional[str]=None,
+        gmaps: Optional[googlemaps.Client]=None,
+        geocoder: Optional[Geocoder]=None,
+        offline_geocoder: Optional[OfflineGeocoder]=None,
+        registry: Optional[ModelRegistry]=None,
+        max_areas: Optional[int]=32
+    ):
+        self.data_dir = data_dir
+        self.model_dir = model_dir
+        self.backend = backend
+        self.max_areas = max_areas
+
+        self._gmaps = gmaps
+        self._geocoder = geocoder
+        self.offline_geocoder = offline_geocoder
+
+        if geocoder is None and offline_geocoder is None:
+            self.offline_geocoder = OfflineGeocoder(zip_code_fallback=False)
+
+        self.registry = registry if registry is not None else ModelRegistry(model_dir=model_dir)
+        self._states = OrderedDict()
+        self._geocoded_areas = set()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"PredictionEngine(data_dir={self.data_dir}, model_dir={self.model_dir}, n_areas={self.n_areas})"
+
+    @property
+    def n_areas(self) -> int:
+        """Description. Number of areas with cached state."""
+
+        return len(self._states)
+
+    @property
+    def gmaps(self) -> googlemaps.Client:
+        """Description. Google Maps client shared by all predictions."""
+
+        if self._gmaps is None:
+            self._gmaps = activate_gmaps()
+
+        return self._gmaps
+
+    @property
+    def geocoder(self) -> Geocoder:
+        """Description. Geocoder shared by all predictions."""
+
+        if self._geocoder is None:
+            self._geocoder = get_default_geocoder(self.data_dir, self.offline_geocoder, self._gmaps)
+
+        return self._geocoder
+
+    def build_state(self, key: Tuple, zip_code: int) -> Optional[Dict]:
+        """Description. Load and preprocess data and model for one area, locations of its transactions are added to the offline geocoder.
+
+        Args:
+            key (Tuple): geographical area, property type and department code (zip code for Paris).
+            zip_code (int): any zip code of the area.
+
+        Returns:
+            Optional[Dict]: preprocessed (or filtered) dataframe, spatial index, model key, fitted preprocessor (None 
+                if not available), imputation table, variables available after preprocessing and last trend prices or 
+                None if no model is available for the area."""
+
+        geo_area, property_type, _ = key
+
+        model_loader = load_area_model(self.model_dir, geo_area, property_type, self.registry)
+
+        if model_loader is None:
+            return None
+
+        df = load_area_data(
+            data_dir=self.data_dir,
+            geo_area=geo_area,
+            property_type=property_type,
+            zip_code=zip_code,
+            backend=self.backend
+        )
+
+        # locations are added once per area, states of evicted areas are rebuilt from the same transactions
+        if self.offline_geocoder is not None and key not in self._geocoded_areas:
+            self.offline_geocoder.add(df)
+            self._geocoded_areas.add(key)
+
+        preprocessor = get_preprocessor(model_loader)
+
+        if preprocessor is not None and zip_code in preprocessor:
+            stats = preprocessor.get_partition(zip_code)
+
+            df = preprocessor.filter(df, zip_code)
+            last_trend_prices = stats["last_trend_prices"]
+            imputed_values = preprocessor.get_imputation_table(zip_code)
+            available_vars = stats["available_vars"]
+
+        else:
+            preprocessor = None
+
+            df, last_trend_prices = preprocess_area_data(df, model_loader, property_type)
+            imputed_values = ImputationTable.from_frame(df, model_loader["feature_names"])
+            available_vars = None
+
+        state = {
+            "key": key,
+            "model_key": (geo_area, property_type),
+            "df": df,
+            "spatial_index": SpatialIndex(df),
+            "preprocessor": preprocessor,
+            "available_vars": available_vars,
+            "imputed_values": imputed_values,
+            "last_trend_prices": last_trend_prices
+        }
+
+        return state
+
+    def get_state(self, user_args: Dict) -> Optional[Dict]:
+        """Description. Return cached state of the area containing user's property, build it if needed.
+
+        Details: each area is built by one thread while the other threads requesting it wait. The states 
+        of other areas can be read or built at the same time."""
+
+        key = get_area_key(user_args)
+
+        if key is None:
+            return None
+
+        with self._lock:
+            if key in self._states:
+                self._states.move_to_end(key)
+                return self._states[key]
+
+            building = self._building.setdefault(key, threading.Lock())
+
+        with building:
+            with self._lock:
+                if key in self._states:
+                    self._states.move_to_end(key)
+                    return self._states[key]
+
+            state = self.build_state(key, user_args["zip_code"])
+
+            with self._lock:
+                self._states[key] = state
+                self.__evict()
+                self._building.pop(key, None)
+
+        return state
+
+    def __evict(self):
+        """Description. Remove least recently used states above max_areas."""
+
+        while self.max_areas is not None and len(self._states) > self.max_areas:
+            self._states.popitem(last=False)
+
+    def get_model_loader(self, state: Dict) -> Optional[Dict]:
+        """Description. Return model loader of the area of state from registry (reloaded if it has been evicted)."""
+
+        geo_area, property_type = state["model_key"]
+        return self.registry.get(geo_area, property_type)
+
+    def warm_up(self, users_args: List[Dict]):
+        """Description. Build state of the areas containing each property of users_args."""
+
+        for user_args in users_args:
+            self.get_state(user_args)
+
+    def clear(self):
+        """Description. Remove all cached states."""
+
+        with self._lock:
+            self._states = OrderedDict()
+
+    def fetch_close_properties(self, state: Dict, user_args: Dict, geocode: bool=True) -> Tuple:
+        """Description. Locate user's property and fetch close properties from cached state.
+
+        Args:
+            state (Dict): cached state of user's area.
+            user_args (Dict): features of user's property, longitude and latitude are used if provided.
+            geocode (bool): whether to call the geocoder when longitude or latitude is missing.
+
+        Returns:
+            Tuple: user's arguments with location, close properties and closest property (None if not found
+                or if user's address cannot be located). Close properties are preprocessed with the fitted 
+                preprocessor of the area if any."""
+
+        user_args = dict(user_args)
+
+        if pd.isna(user_args.get("longitude")) or pd.isna(user_args.get("latitude")):
+
+            if not geocode:
+                return user_args, None, None
+
+            location = self.geocoder.geocode(user_args)
+
+            if location is None:
+                return user_args, None, None
+
+            lng, lat = location
+            user_args["longitude"] = lng
+            user_args["latitude"] = lat
+
+        closest = None
+        close_properties = return_close_properties(state["df"], user_args, state["spatial_index"])
+
+        if close_properties is not None and state["preprocessor"] is not None:
+            close_properties = state["preprocessor"].transform(close_properties, user_args["zip_code"])
+
+        if close_properties is not None:
+            closest = find_closest(close_properties, user_args, state["spatial_index"])
+
+        return user_args, close_properties, closest
+
+    def prepare_features(self, user_args: Dict, geocode: bool=True) -> Optional[Dict]:
+        """Description. Build feature vector of user's property using cached state of user's area.
+
+        Args:
+            user_args (Dict): features of user's property.
+            geocode (bool): whether to call the geocoder when longitude or latitude is missing. Defaults to True.
+
+        Returns:
+            Optional[Dict]: state, model loader, user's arguments with location, close properties, closest property and 
+                feature vector or None if area is not covered."""
+
+        state = self.get_state(user_args)
+
+        if state is None:
+            return None
+
+        model_loader = self.get_model_loader(state)
+
+        user_args, close_properties, closest = self.fetch_close_properties(state, user_args, geocode)
+
+        _, X = prepare_feature_vector(
+            state["df"],
+            model_loader,
+            user_args,
+            state["last_trend_prices"],
+            closest,
+            state["imputed_values"],
+            state["available_vars"]
+        )
+
+        prepared = {
+            "state": state,
+            "model_loader": model_loader,
+            "user_args": user_args,
+            "close_properties": close_properties,
+            "closest": closest,
+            "X": X
+        }
+
+        return prepared
+
+    def predict(self, user_args: Dict, return_details: bool=False) -> Optional[Union[float, Dict]]:
+        """Description. Predict price based on user's attributes using cached state of user's area.
+
+        Args:
+            user_args (Dict): features of user's property.
+            return_details (bool): whether to return close properties, closest property and MAPE with price.
+
+        Returns:
+            Optional[Union[float, Dict]]: predicted price (or details) or None if area is not covered."""
+
+        prepared = self.prepare_features(user_args)
+
+        if prepared is None:
+            return None
+
+        model_loader = prepared["model_loader"]
+        price_pred = get_predicted_price(model_loader["model"], prepared["X"])
+
+        if not return_details:
+            return price_pred
+
+        details = {
+            "price": price_pred,
+            "user_args": prepared["user_args"],
+            "close_properties": prepared["close_properties"],
+            "closest": prepared["closest"],
+            "mape": fetch_mape(model_loader)
+        }
+
+        return details
+
+    def predict_batch(self, users: DataFrame, geocode: bool=True) -> Series:
+        """Description. Predict prices of several properties.
+
+        Args:
+            users (DataFrame): one row per property with the same fields as user_args,
+                longitude and latitude columns are used if provided.
+            geocode (bool): whether to call the geocoder for properties without location. Defaults to True.
+
+        Returns:
+            Series: predicted prices aligned with users' index (NaN if area is not covered).
+
+        Details: properties are grouped by area so that cached state is reused, the feature matrix
+        of each area is built in one pass and the estimator is called once per (geo_area, property_type)."""
+
+        records = users.to_dict("records")
+        prices = np.full(len(records), np.nan)
+
+        groups = {}
+        for i, user_args in enumerate(records):
+            key = get_area_key(user_args)
+
+            if key is not None:
+                groups.setdefault(key[:2], {}).setdefault(key, []).append(i)
+
+        for area_groups in groups.values():
+
+            model, positions, matrices = None, [], []
+
+            for key, idxs in area_groups.items():
+                state = self.get_state(records[idxs[0]])
+
+                if state is None:
+                    continue
+
+                model_loader = self.get_model_loader(state)
+                located, closest = [], []
+
+                for i in idxs:
+                    user_args, _, closest_property = self.fetch_close_properties(state, records[i], geocode)
+                    located.append(user_args)
+                    closest.append(closest_property if closest_property is not None else pd.Series({"distance": np.nan}))
+
+                _, X = prepare_feature_matrix(
+                    state["df"],
+                    model_loader,
+                    pd.DataFrame(located),
+                    state["last_trend_prices"],
+                    pd.DataFrame(closest).reset_index(drop=True),
+                    state["imputed_values"],
+                    state["available_vars"]
+                )
+
+                model = model_loader["model"]
+                positions.extend(idxs)
+                matrices.append(X)
+
+            if model is not None:
+                prices[positions] = get_predicted_prices(model, np.vstack(matrices))
+
+        return pd.Series(prices, index=users.index, name="predicted_price")
@@ -0,0 +1,284 @@
+"""Description. Geocoders returning longitude and latitude of user's address."""
+
+from lib.enums import GOOGLE_API_KEY
+from lib.dataset.loader import load_dvfplus, get_store_dir
+
+from .utils import get_user_location
+
+from pandas.core.frame import DataFrame
+
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import unicodedata
+import threading
+import abc
+import sqlite3
+import re
+import os
+import googlemaps
+
+LOCATION_COLUMNS = ["adresse_numero", "adresse_nom_voie", "code_postal", "longitude", "latitude"]
+
+GEOCODING_CACHE = "geocodes.sqlite"
+
+def normalize_text(text: str) -> str:
+    """Description. Lowercase text, remove accents, punctuation and repeated spaces."""
+
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+
+    return text.strip()
+
+def normalize_address(user_args: Dict) -> str:
+    """Description. Return normalized address of user's property used as cache key."""
+
+    address = f"{user_args['street_number']} {user_args['street_name']} {user_args['zip_code']} {user_args['city']}"
+    return normalize_text(address)
+
+class Geocoder(abc.ABC):
+    """Description. Base class of geocoders.
+
+    Details: geocode returns (longitude, latitude) of user's address or None if address is not found."""
+
+    @abc.abstractmethod
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        pass
+
+    def __call__(self, user_args: Dict) -> Optional[Tuple]:
+        return self.geocode(user_args)
+
+class GoogleGeocoder(Geocoder):
+    """Description. Geocoder calling Google Maps API.
+
+    Args:
+        gmaps (Optional[googlemaps.Client]): Google Maps client, created on first call if None."""
+
+    def __init__(self, gmaps: Optional[googlemaps.Client]=None):
+        self._gmaps = gmaps
+
+    def __repr__(self) -> str:
+        return "GoogleGeocoder()"
+
+    @property
+    def gmaps(self) -> googlemaps.Client:
+        if self._gmaps is None:
+            self._gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
+
+        return self._gmaps
+
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        try:
+            return get_user_location(self.gmaps, user_args)
+        except IndexError:
+            return None
+
+class CachedGeocoder(Geocoder):
+    """Description. Persistent on-disk cache of geocoded addresses keyed by normalized address.
+
+    Args:
+        cache_path (str): path to sqlite file storing geocoded addresses.
+        geocoder (Optional[Geocoder]): geocoder called on cache misses, only the cache is used if None."""
+
+    def __init__(self, cache_path: str, geocoder: Optional[Geocoder]=None):
+        self.cache_path = cache_path
+        self.geocoder = geocoder
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, longitude REAL, latitude REAL)"
+        )
+        self._connection.commit()
+
+    def __repr__(self) -> str:
+        return f"CachedGeocoder(cache_path={self.cache_path}, geocoder={self.geocoder})"
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+    def get(self, address: str) -> Optional[Tuple]:
+        """Description. Return cached location of normalized address or None."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT longitude, latitude FROM geocodes WHERE address = ?", (address,)
+            ).fetchone()
+
+        return row
+
+    def put(self, address: str, location: Tuple):
+        """Description. Store location of normalized address."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?)", (address, float(location[0]), float(location[1]))
+            )
+            self._connection.commit()
+
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        address = normalize_address(user_args)
+        location = self.get(address)
+
+        if location is not None:
+            self.hits += 1
+            return location
+
+        self.misses += 1
+
+        if self.geocoder is None:
+            return None
+
+        location = self.geocoder.geocode(user_args)
+
+        if location is not None:
+            self.put(address, location)
+
+        return location
+
+class FallbackGeocoder(Geocoder):
+    """Description. Call geocoders in order until one of them locates user's address.
+
+    Args:
+        geocoders (List[Geocoder]): geocoders, e.g. offline geocoder first and Google Maps as fallback."""
+
+    def __init__(self, geocoders: List[Geocoder]):
+        self.geocoders = geocoders
+
+    def __repr__(self) -> str:
+        return f"FallbackGeocoder(geocoders={self.geocoders})"
+
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        for geocoder in self.geocoders:
+            location = geocoder.geocode(user_args)
+
+            if location is not None:
+                return location
+
+        return None
+
+class OfflineGeocoder(Geocoder):
+    """Description. Geocoder built from the locations of DVF+ transactions, no outbound call.
+
+    Details: address is located at the mean location of the transactions with same street number,
+    street and zip code, then same street and zip code, then same zip code if zip_code_fallback.
+
+    Args:
+        df (Optional[DataFrame]): transactions with adresse_numero, adresse_nom_voie, code_postal, longitude and latitude.
+        zip_code_fallback (bool): whether to locate unknown streets at the mean location of their zip code. Defaults to True."""
+
+    def __init__(self, df: Optional[DataFrame]=None, zip_code_fallback: bool=True):
+        self.zip_code_fallback = zip_code_fallback
+
+        self._addresses = {}
+        self._streets = {}
+        self._zips = {}
+        self._lock = threading.Lock()
+
+        if df is not None:
+            self.add(df)
+
+    def __repr__(self) -> str:
+        return f"OfflineGeocoder(n_addresses={len(self._addresses)}, n_streets={len(self._streets)}, n_zip_codes={len(self._zips)})"
+
+    @classmethod
+    def from_dvfplus(
+        cls,
+        data_dir: str,
+        tables: List[Tuple],
+        zip_name: str="dvf+",
+        backend: Optional[str]=None,
+        zip_code_fallback: bool=True
+    ) -> "OfflineGeocoder":
+        """Description. Build geocoder from location columns of (geo_area, property_type) DVF+ tables.
+
+        Details: only location columns are read. If backend is None, the parquet store is used when it exists."""
+
+        if backend is None:
+            backend = "parquet" if os.path.exists(get_store_dir(data_dir, zip_name)) else "zip"
+
+        geocoder = cls(zip_code_fallback=zip_code_fallback)
+
+        for geo_area, property_type in tables:
+            df = load_dvfplus(data_dir, zip_name, geo_area, property_type, backend=backend, columns=LOCATION_COLUMNS)
+            geocoder.add(df)
+
+        return geocoder
+
+    def add(self, df: DataFrame):
+        """Description. Add locations of transactions, locations already known are averaged with new ones."""
+
+        df = df.loc[df["longitude"].notna() & df["latitude"].notna(), LOCATION_COLUMNS]
+
+        keys = pd.DataFrame({
+            "code_postal": pd.to_numeric(df["code_postal"]).astype("float64").values,
+            "adresse_nom_voie": df["adresse_nom_voie"].map(normalize_text, na_action="ignore").values,
+            "adresse_numero": pd.to_numeric(df["adresse_numero"]).astype("float64").values,
+            "longitude": df["longitude"].values,
+            "latitude": df["latitude"].values
+        })
+
+        for table, by in (
+            (self._addresses, ["code_postal", "adresse_nom_voie", "adresse_numero"]),
+            (self._streets, ["code_postal", "adresse_nom_voie"]),
+            (self._zips, ["code_postal"])
+        ):
+            sums = keys.groupby(by)[["longitude", "latitude"]].agg(["sum", "count"])
+
+            # areas may be added concurrently by the workers of PredictionEngine
+            with self._lock:
+                for key, row in zip(sums.index, sums.values):
+                    lng_sum, lng_count, lat_sum, _ = row
+                    old = table.get(key, (0., 0., 0))
+                    table[key] = (old[0] + lng_sum, old[1] + lat_sum, old[2] + lng_count)
+
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        zip_code = float(user_args["zip_code"])
+        street_name = normalize_text(user_args["street_name"])
+
+        lookups = [
+            (self._addresses, (zip_code, street_name, float(user_args["street_number"]))),
+            (self._streets, (zip_code, street_name))
+        ]
+
+        if self.zip_code_fallback:
+            lookups.append((self._zips, zip_code))
+
+        for table, key in lookups:
+            if key in table:
+                lng_sum, lat_sum, count = table[key]
+                return lng_sum / count, lat_sum / count
+
+        return None
+
+def get_default_geocoder(
+    data_dir: str,
+    offline: Optional[OfflineGeocoder]=None,
+    gmaps: Optional[googlemaps.Client]=None,
+    cache_path: Optional[str]=None
+) -> CachedGeocoder:
+    """Description. Return default geocoder: addresses are located offline first and Google Maps is only called
+    for unknown streets, results are cached on disk.
+
+    Args:
+        data_dir (str): path to directory containing DVF+, the cache is stored at data_dir/geocodes.sqlite if cache_path is None.
+        offline (Optional[OfflineGeocoder]): offline geocoder, an empty one without zip code fallback is used if None.
+        gmaps (Optional[googlemaps.Client]): Google Maps client, created on first call if None.
+        cache_path (Optional[str]): path to sqlite file storing geocoded addresses.
+
+    Returns:
+        CachedGeocoder: cached offline geocoder with Google Maps as fallback."""
+
+    if offline is None:
+        offline = OfflineGeocoder(zip_code_fallback=False)
+
+    if cache_path is None:
+        cache_path = f"{data_dir}{GEOCODING_CACHE}"
+
+    return CachedGeocoder(cache_path=cache_path, geocoder=FallbackGeocoder([offline, GoogleGeocoder(gmaps)]))
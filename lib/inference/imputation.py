@@ -0,0 +1,114 @@
+"""Description. Imputation tables of the features of one area computed in one vectorized pass and looked up in O(1)."""
+
+from lib.enums import DVF_LOCATION_VARS
+
+from pandas.core.frame import DataFrame
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+NOT_IMPUTED = ["id_mutation", "date_mutation", "valeur_fonciere", "type_local"] + DVF_LOCATION_VARS
+
+def compute_imputed_values(df: DataFrame, columns: List[str]) -> np.ndarray:
+    """Description. Return imputed value of each column: most frequent value for dummies, median otherwise.
+
+    Details: dummies are columns with only 0, 1 and missing values. Ties between 0 and 1 are broken by
+    the first value of the column, as with value_counts. All columns are reduced at once on a float64 array."""
+
+    X = df[columns].to_numpy(dtype="float64")
+    n_rows, n_cols = X.shape
+
+    if n_rows == 0:
+        return np.full(n_cols, np.nan)
+
+    is_na = np.isnan(X)
+    n_ones = (X == 1).sum(axis=0)
+    n_zeros = (X == 0).sum(axis=0)
+
+    n_na = is_na.sum(axis=0)
+    is_dummy = n_ones + n_zeros + n_na == n_rows
+
+    # medians of continuous variables only, nanmedian is much slower than median
+    medians = np.full(n_cols, np.nan)
+    complete = ~is_dummy & (n_na == 0)
+    incomplete = ~is_dummy & (n_na > 0) & (n_na < n_rows)
+
+    if complete.any():
+        medians[complete] = np.median(X[:, complete], axis=0)
+
+    if incomplete.any():
+        medians[incomplete] = np.nanmedian(X[:, incomplete], axis=0)
+
+    first_values = X[np.argmax(~is_na, axis=0), np.arange(n_cols)]
+    most_frequent = np.where(n_ones > n_zeros, 1., np.where(n_ones < n_zeros, 0., first_values))
+
+    return np.where(is_dummy, most_frequent, medians)
+
+class ImputationTable:
+    """Description. Imputed values of the features of one (geo_area, property_type, department) stored as one array.
+
+    Args:
+        feature_names (List[str]): names of imputed features.
+        values (np.ndarray): imputed value of each feature.
+
+    Example:
+
+    >>> from lib.inference.imputation import ImputationTable
+    >>> table = ImputationTable.from_frame(df, model_loader["feature_names"])
+    >>> table
+    ImputationTable(n_features=87)
+    >>> table["l_surface_reelle_bati"]
+    3.871201010907891"""
+
+    def __init__(self, feature_names: List[str], values: np.ndarray):
+        self.feature_names = list(feature_names)
+        self.values = np.asarray(values, dtype="float64")
+        self.index = {var: i for i, var in enumerate(self.feature_names)}
+
+        if len(self.feature_names) != len(self.values):
+            raise ValueError(f"Got {len(self.values)} values for {len(self.feature_names)} features.")
+
+    def __repr__(self) -> str:
+        return f"ImputationTable(n_features={len(self.feature_names)})"
+
+    def __len__(self) -> int:
+        return len(self.feature_names)
+
+    def __contains__(self, var: str) -> bool:
+        return var in self.index
+
+    def __getitem__(self, var: str) -> float:
+        return self.values[self.index[var]]
+
+    def get(self, var: str, default: Optional[float]=None) -> Optional[float]:
+        """Description. Return imputed value of var or default if var is not imputed."""
+
+        if var not in self.index:
+            return default
+
+        return self.values[self.index[var]]
+
+    @classmethod
+    def from_frame(cls, df: DataFrame, feature_names: Optional[List[str]]=None) -> "ImputationTable":
+        """Description. Compute imputed values of the features of preprocessed DVF+ transactions.
+
+        Details: all columns except identifiers, price, type and location variables are imputed if feature_names is None."""
+
+        if feature_names is None:
+            feature_names = df.columns
+
+        columns = [var for var in feature_names if var in df.columns and var not in NOT_IMPUTED]
+
+        return cls(columns, compute_imputed_values(df, columns))
+
+    def to_dict(self) -> Dict:
+        """Description. Return json-compatible dictionary of imputation table."""
+
+        return {"feature_names": self.feature_names, "values": self.values.tolist()}
+
+    @classmethod
+    def from_dict(cls, content: Dict) -> "ImputationTable":
+        """Description. Load imputation table from dictionary returned by to_dict."""
+
+        return cls(content["feature_names"], content["values"])
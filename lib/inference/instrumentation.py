@@ -0,0 +1,252 @@
+"""Description. Opt-in instrumentation of prediction stages (wall time, RSS deltas and row counts)."""
+
+from pandas.core.frame import DataFrame
+
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import numpy as np
+
+import threading
+import time
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+STAGES = ["preprocessing", "geocoding", "comparable_search", "feature_vector", "inference"]
+
+def get_rss() -> Optional[int]:
+    """Description. Return current resident set size of current process in bytes or None if unavailable.
+
+    Details: psutil is used if installed, otherwise /proc/self/statm (Linux only)."""
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+def reset_peak_rss() -> bool:
+    """Description. Reset peak resident set size of current process to its current RSS and return whether it succeeded.
+
+    Details: writes 5 to /proc/self/clear_refs (Linux only)."""
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+def get_peak_rss() -> Optional[int]:
+    """Description. Return peak resident set size of current process since last reset in bytes or None if unavailable.
+
+    Details: reads VmHWM in /proc/self/status (Linux only)."""
+
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+class RSSSampler:
+    """Description. Background thread sampling RSS of current process to find its peak when it cannot be read from the kernel.
+
+    Args:
+        interval (float): time between two samples (s)."""
+
+    def __init__(self, interval: float=.001):
+        self.interval = interval
+        self.peak = get_rss()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __repr__(self) -> str:
+        return f"RSSSampler(interval={self.interval})"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss())
+
+    def start(self) -> "RSSSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> int:
+        """Description. Stop sampling and return peak RSS in bytes."""
+
+        self._stop.set()
+        self._thread.join()
+
+        return max(self.peak, get_rss())
+
+class PredictionHook:
+    """Description. Base class of hooks called at the end of each prediction stage, does nothing by default.
+
+    Details: on_stage receives a record with stage name, wall time (s), peak and net RSS deltas (bytes), number
+    of rows before and after the stage, whether the stage failed and the context of the prediction (geo_area,
+    property_type). peak_rss_delta is the peak RSS during the stage minus RSS at its start: a stage allocating
+    then freeing a large frame reports the size of the frame. rss_delta is the memory kept by the stage (negative
+    if it frees memory). Both are process-wide so they include concurrent stages, and None when RSS cannot be
+    measured. On Linux the peak is reset at the start of each stage, so a stage starting while another one runs
+    also resets the peak of the latter."""
+
+    def on_stage(self, record: Dict):
+        pass
+
+class CallbackHook(PredictionHook):
+    """Description. Hook calling a function with each stage record, e.g. to export latencies to a metrics client.
+
+    Args:
+        callback (Callable): function taking stage record as input."""
+
+    def __init__(self, callback: Callable):
+        self.callback = callback
+
+    def __repr__(self) -> str:
+        return f"CallbackHook(callback={self.callback})"
+
+    def on_stage(self, record: Dict):
+        self.callback(record)
+
+class RecordingHook(PredictionHook):
+    """Description. Hook keeping the last stage records in memory to compute latency statistics.
+
+    Args:
+        max_records (int): maximum number of records kept, oldest records are dropped first.
+
+    Example:
+
+    >>> from lib.inference import Prediction, RecordingHook
+    >>> hook = RecordingHook()
+    >>> prediction = Prediction(user_args, hooks=[hook])
+    >>> ...
+    >>> prediction.predict()
+    >>> hook.summary()
+                       count  mean_time  p50_time  p95_time  p99_time  max_time  mean_peak_rss_delta  max_peak_rss_delta  mean_rss_delta  mean_rows_in  mean_rows_out
+    stage
+    preprocessing          1   0.212...
+    ..."""
+
+    def __init__(self, max_records: int=100000):
+        self.max_records = max_records
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"RecordingHook(n_records={len(self._records)})"
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def on_stage(self, record: Dict):
+        with self._lock:
+            self._records.append(dict(record))
+
+    @property
+    def records(self) -> List[Dict]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """Description. Remove all records."""
+
+        with self._lock:
+            self._records.clear()
+
+    def to_frame(self) -> DataFrame:
+        """Description. Return one row per stage record."""
+
+        return pd.DataFrame(self.records)
+
+    def summary(self, quantiles: Tuple=(.5, .95, .99)) -> DataFrame:
+        """Description. Return number of records, mean, quantiles and max of wall time, mean and max peak RSS delta, mean RSS
+        delta and row counts per stage."""
+
+        df = self.to_frame()
+
+        if df.empty:
+            return df
+
+        grouped = df.groupby("stage", sort=False)
+
+        summary = pd.DataFrame({"count": grouped.size(), "mean_time": grouped.wall_time.mean()})
+
+        for q in quantiles:
+            summary[f"p{int(q * 100)}_time"] = grouped.wall_time.quantile(q)
+
+        summary["max_time"] = grouped.wall_time.max()
+        summary["mean_peak_rss_delta"] = grouped.peak_rss_delta.mean()
+        summary["max_peak_rss_delta"] = grouped.peak_rss_delta.max()
+        summary["mean_rss_delta"] = grouped.rss_delta.mean()
+        summary["mean_rows_in"] = grouped.n_rows_in.mean()
+        summary["mean_rows_out"] = grouped.n_rows_out.mean()
+
+        return summary
+
+    def histogram(self, stage: str, bins: int=20) -> Tuple:
+        """Description. Return histogram (counts, bin edges) of wall times of stage."""
+
+        times = [record["wall_time"] for record in self.records if record["stage"] == stage]
+        return np.histogram(times, bins=bins)
+
+@contextmanager
+def instrument_stage(hooks: List[PredictionHook], stage: str, **context) -> Iterator[Dict]:
+    """Description. Measure stage executed in the with block and send its record to hooks.
+
+    Details: the record yielded is filled with n_rows_in and n_rows_out by the stage. If hooks is empty, nothing
+    is measured so that predictions without hooks have no overhead. The peak RSS is read from VmHWM after resetting
+    it, or sampled by a background thread when it cannot be reset.
+
+    Args:
+        hooks (List[PredictionHook]): hooks called at the end of the stage.
+        stage (str): name of the stage.
+        context: additional fields of the record (e.g. geo_area, property_type)."""
+
+    record = {"stage": stage, "n_rows_in": None, "n_rows_out": None, **context}
+
+    if not hooks:
+        yield record
+        return
+
+    is_reset = reset_peak_rss()
+    rss = get_rss()
+    sampler = RSSSampler().start() if rss is not None and not is_reset else None
+
+    start = time.perf_counter()
+    record["failed"] = True
+
+    try:
+        yield record
+        record["failed"] = False
+    finally:
+        record["wall_time"] = time.perf_counter() - start
+
+        if rss is None:
+            peak_rss = None
+        elif sampler is not None:
+            peak_rss = sampler.stop()
+        else:
+            peak_rss = get_peak_rss()
+
+        record["peak_rss_delta"] = peak_rss - rss if peak_rss is not None else None
+        record["rss_delta"] = get_rss() - rss if rss is not None else None
+
+        for hook in hooks:
+            hook.on_stage(record)
@@ -2,42 +2,38 @@ from lib.enums import (
     CITIES, 
     AVAILABLE_GEO_AREAS, 
     GOOGLE_API_KEY, 
-    ESTIMATORS
+    ESTIMATORS, 
+    DVF_SELECTED_VARS, 
+    DVF_LOCATION_VARS, 
+    BNB_SELECTED_VARS, 
 ) 
 
-from lib.dataset.loader import load_dvfplus
-from lib.model.loader import load_model
+from lib.dataset.loader import load_dvfplus, get_store_dir
+from lib.model.loader import load_model, load_manifest
+from lib.model.registry import ModelRegistry
 
-from lib.dataset.build import (
-    add_distance_to_parks, 
-    add_distance_to_transportation, 
-    add_public_facilities, 
-    prepare_dataset, 
-    prepare_dummies
-)
-
-from lib.dataset.utils import (
-    get_categorical_vars, 
-    get_most_frequent_levels, 
-)
+from lib.dataset.build import add_paris_features
 
 from .utils import (
     find_department, 
     extract_department_code, 
-    get_movav_windows, 
-    get_numeric_filters, 
-    select_features, 
-    fetch_last_trend_prices, 
-    get_user_location, 
+    preprocess_area_data, 
+    fetch_mape, 
     return_close_properties, 
     find_closest, 
     prepare_feature_vector,
     get_predicted_price, 
 )
 
-from typing import Dict 
+from .spatial import SpatialIndex
+from .geocoding import LOCATION_COLUMNS, Geocoder, OfflineGeocoder, get_default_geocoder
+from .instrumentation import PredictionHook, instrument_stage
+from .preprocessor import get_preprocessor
+
+from typing import Dict, List, Optional
 
-import pandas as pd 
+from pandas.core.frame import DataFrame
+import os
 from tqdm import tqdm
 import googlemaps
 
@@ -50,6 +46,108 @@ def activate_gmaps() -> googlemaps.Client:
     gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
     return gmaps
 
+def find_geo_area(user_args: Dict) -> Optional[str]: 
+    """Description. Return geographical area covered by a model for user's property or None."""
+
+    if user_args["city"] in CITIES: 
+        return user_args["city"]
+
+    dpt = find_department(user_args["zip_code"])
+
+    if dpt in AVAILABLE_GEO_AREAS[user_args["property_type"]]:
+        return dpt
+
+    return None
+
+def load_area_data(
+    data_dir: str, 
+    geo_area: str, 
+    property_type: str, 
+    zip_code: int, 
+    backend: Optional[str]=None
+) -> DataFrame: 
+    """Description. Load DVF+ transactions of the department (zip code for Paris) containing zip_code.
+    
+    Args:
+        data_dir (str): path to directory containing DVF+ and other data sources.
+        geo_area (str): geographical area.
+        property_type (str): type of property (flats or houses).
+        zip_code (int): zip code used to select department.
+        backend (Optional[str]): DVF+ backend, parquet store is used when it exists if None.
+        
+    Returns:
+        DataFrame: DVF+ transactions with external features for Paris."""
+
+    if backend is None: 
+        backend = "parquet" if os.path.exists(get_store_dir(data_dir, "dvf+")) else "zip"
+
+    department_code = extract_department_code(zip_code)
+
+    filters = {"code_departement": department_code}
+    if department_code == 75: 
+        filters["code_postal"] = zip_code
+
+    df = load_dvfplus(
+        zip_dir=data_dir, 
+        zip_name="dvf+", 
+        geo_area=geo_area,
+        property_type=property_type, 
+        backend=backend, 
+        columns=DVF_SELECTED_VARS + DVF_LOCATION_VARS + BNB_SELECTED_VARS + ["type_local"], 
+        filters=filters
+    )
+
+    # encode street number and zip code to correct format 
+    df["code_postal"] = df.code_postal.astype("Int32")
+    df["adresse_numero"] = df.adresse_numero.astype("Int32")
+
+    # add external data 
+    if geo_area == "Paris":
+        df = add_paris_features(df, data_dir)
+
+    return df
+
+def load_area_model(
+    model_dir: str, 
+    geo_area: str, 
+    property_type: str, 
+    registry: Optional[ModelRegistry]=None
+) -> Optional[Dict]: 
+    """Description. Load model trained for geographical area and property type from backup directory.
+    
+    Details: if registry is provided, model is fetched from registry's cache (loaded on first request)."""
+
+    if registry is not None: 
+        return registry.get(geo_area, property_type)
+
+    estimator_name = ESTIMATORS[property_type][geo_area.lower()]
+
+    model_loader = load_model(
+        path=model_dir, 
+        estimator_name=estimator_name, 
+        version=0, 
+        property_type=property_type,
+        geo_area=geo_area
+    )
+
+    return model_loader
+
+def load_area_manifest(model_dir: str, geo_area: str, property_type: str) -> Optional[Dict]: 
+    """Description. Load manifest (feature names, metrics) of model trained for geographical area and property type 
+    without loading model, e.g. to fetch MAPE."""
+
+    estimator_name = ESTIMATORS[property_type][geo_area.lower()]
+
+    manifest = load_manifest(
+        path=model_dir, 
+        estimator_name=estimator_name, 
+        version=0, 
+        property_type=property_type,
+        geo_area=geo_area
+    )
+
+    return manifest
+
 class Prediction:
     """Description. Class to predict real estate prices based on user's attributes using trained model.
     
@@ -76,168 +174,200 @@ class Prediction:
     >>> pred_price = prediction.predict()
     100%|███████████████████████████████████████████████████████████████████████████████████████████████████████████████████| 4/4 [00:00<00:00,  5.91it/s] 
     >>> print(f"Predicted price: {pred_price:,}€" )
-    Predicted price: 388,950.0€"""
+    Predicted price: 388,950.0€
+    
+    Stages (preprocessing, geocoding, comparable_search, feature_vector, inference) can be instrumented 
+    with hooks recording wall time, peak RSS delta and row counts (see lib.inference.instrumentation):
+    
+    >>> from lib.inference import RecordingHook
+    >>> hook = RecordingHook()
+    >>> prediction = Prediction(user_args, hooks=[hook])
+    >>> ...
+    >>> hook.summary()"""
 
-    def __init__(self, user_args: Dict):
+    def __init__(self, user_args: Dict, geocoder: Optional[Geocoder]=None, hooks: Optional[List[PredictionHook]]=None):
         self.user_args = user_args
-
-        if user_args["city"] in CITIES: 
-            self.geo_area = user_args["city"]
-
-        else:
-            dpt = find_department(user_args["zip_code"])
-
-            if dpt in AVAILABLE_GEO_AREAS[user_args["property_type"]]:
-                self.geo_area = dpt
-            else: 
-                self.geo_area = None 
+        self.geo_area = find_geo_area(user_args)
+        self.geocoder = geocoder
+        self.hooks = hooks if hooks is not None else []
 
         self._last_trend_prices = None
+        self._imputed_values = None
+        self._available_vars = None
+        self._spatial_index = None
+        self.preprocessor = None
         self.close_properties = None
         self._closest_property = None
 
     def __repr__(self) -> str:
         return f"Prediction(user_args={self.user_args})"
 
-    def load_data(self, data_dir: str): 
-        """Description. Load data from DVF+ dataset based on user's attributes."""
+    def load_data(self, data_dir: str, backend: Optional[str]=None): 
+        """Description. Load data from DVF+ dataset based on user's attributes.
+        
+        Details: only the rows of user's department (zip code for Paris) and the columns used 
+        for preprocessing are read when DVF+ has been converted to parquet. If backend is None, 
+        the parquet store is used when it exists."""
+
+        self.df = load_area_data(
+            data_dir=data_dir, 
+            geo_area=self.geo_area, 
+            property_type=self.user_args["property_type"], 
+            zip_code=self.user_args["zip_code"], 
+            backend=backend
+        )
+
+        self.data_dir = data_dir
 
-        df = load_dvfplus(
-            zip_dir=data_dir, 
-            zip_name="dvf+", 
-            geo_area=self.geo_area,
-            property_type=self.user_args["property_type"]
+    def load_model(self, model_dir: str, registry: Optional[ModelRegistry]=None): 
+        """Description. Load model from backup directory.
+        
+        Details: model contains CustomRegressor, feature names, metrics and the preprocessor fitted at 
+        training time if any. If registry is provided, model is fetched from registry's cache instead of 
+        being loaded from disk on every prediction."""
+
+        self.model_loader = load_area_model(
+            model_dir=model_dir, 
+            geo_area=self.geo_area, 
+            property_type=self.user_args["property_type"], 
+            registry=registry
         )
 
-        # encode street number and zip code to correct format 
-        df["code_postal"] = df.code_postal.astype("Int32")
-        df["adresse_numero"] = df.adresse_numero.astype("Int32")
+        self.preprocessor = get_preprocessor(self.model_loader)
 
-        # add external data 
-        if self.geo_area == "Paris":
+    def __use_preprocessor(self) -> bool: 
+        return self.preprocessor is not None and self.user_args["zip_code"] in self.preprocessor
 
-            transportation = pd.read_csv(f"{data_dir}other/transportation.csv")
-            parks = pd.read_csv(f"{data_dir}other/parks.csv")
-            facilities = pd.read_csv(f"{data_dir}other/facilities.csv") 
+    def __preprocess(self, record: Dict): 
+        """Description. Apply preprocessing steps to loaded dataframe.
+        
+        Details: if the model has been saved with a fitted preprocessor, its statistics are used and 
+        transactions are only filtered, otherwise the whole dataframe is preprocessed."""
 
-            df = add_distance_to_transportation(df, transportation)
-            del transportation
+        record["n_rows_in"] = len(self.df)
 
-            df = add_distance_to_parks(df, parks)
-            del parks 
+        # locations of all loaded transactions are kept for the default offline geocoder
+        self.__locations = self.df[LOCATION_COLUMNS]
 
-            df = add_public_facilities(df, facilities)
-            del facilities
+        if self.__use_preprocessor(): 
+            stats = self.preprocessor.get_partition(self.user_args["zip_code"])
 
-        department_code = extract_department_code(self.user_args["zip_code"])
-    
-        if department_code == 75:
-            self.df = df.loc[df["code_postal"]==self.user_args["zip_code"], :]
-        else: 
-            self.df = df.loc[df["code_departement"]==department_code, :]
+            self.df = self.preprocessor.filter(self.df, self.user_args["zip_code"])
+            self._last_trend_prices = stats["last_trend_prices"]
+            self._imputed_values = self.preprocessor.get_imputation_table(self.user_args["zip_code"])
+            self._available_vars = stats["available_vars"]
 
-    def load_model(self, model_dir: str): 
-        """Description. Load model from backup directory.
-        
-        Details: model contains CustomRegressor, feature names and metrics."""
+        else: 
+            self.df, self._last_trend_prices = preprocess_area_data(
+                self.df, 
+                self.model_loader, 
+                self.user_args["property_type"]
+            )
 
-        estimator_name = ESTIMATORS[self.user_args["property_type"]][self.geo_area.lower()]
+        self._spatial_index = SpatialIndex(self.df)
 
-        self.model_loader = load_model(
-            path=model_dir, 
-            estimator_name=estimator_name, 
-            version=0, 
-            property_type=self.user_args["property_type"],
-            geo_area=self.geo_area
-        )
+        record["n_rows_out"] = len(self.df)
 
-    def __preprocess(self): 
-        """Description. Apply preprocessing steps to loaded dataframe."""
-    
-        mov_av_windows = get_movav_windows(self.model_loader["feature_names"])
+    def __geocode(self, record: Dict): 
+        """Description. Locate user's property. 
+        
+        Details: if no geocoder is provided, user's address is looked up in the cache of data_dir, then in the 
+        locations of the loaded transactions and Google Maps is only called for unknown streets."""
 
-        if len(mov_av_windows) == 0:
-            mov_av_windows = None
+        record["n_rows_in"] = 1
 
-        preproc_args = {
-            "target_var": "l_valeur_fonciere", 
-            "numeric_filters": get_numeric_filters(self.df, self.user_args["property_type"]),  
-            "na_threshold": 0.5,
-            "ma_lag": 0, 
-            "mov_av_windows": mov_av_windows, 
-            "print_summary": False, 
-            "return_var_names": False, 
-            "keep_location_vars": True
-        }
+        if self.geocoder is None: 
+            offline = OfflineGeocoder(self.__locations, zip_code_fallback=False)
+            self.geocoder = get_default_geocoder(self.data_dir, offline)
 
-        df = prepare_dataset(self.df, **preproc_args)
+        location = self.geocoder.geocode(self.user_args)
 
-        categorical_vars = get_categorical_vars(df, n_levels_max=30)   
-        categorical_vars.append("baie_orientation") 
-        dummy_ref_levels = get_most_frequent_levels(df, categorical_vars)
-        df = prepare_dummies(df, categorical_vars, dummy_ref_levels, remove_cols_with_one_value=False)
+        if location is None: 
+            record["n_rows_out"] = 0
+            return
 
-        self.df = select_features(df, self.model_loader)
+        lng, lat = location
 
-        trend_prices_vars = [var for var in self.df.columns if var.startswith("l_valeur_fonciere_ma")]
+        self.user_args["longitude"] = lng
+        self.user_args["latitude"] = lat
 
-        if len(trend_prices_vars) > 0:
-            self._last_trend_prices = fetch_last_trend_prices(self.df, trend_prices_vars)
+        record["n_rows_out"] = 1
 
-    def __fetch_close_properties(self): 
-        """Description. Fetch close properties based on user's location.
+    def __fetch_close_properties(self, record: Dict): 
+        """Description. Fetch close properties and closest property based on user's location.
         
-        Details: only if user's real estate is a flat."""
+        Details: only if user's address has been located."""
 
-        gmaps = activate_gmaps() 
-        lng, lat = get_user_location(gmaps, self.user_args)        
+        record["n_rows_in"] = len(self.df)
+        record["n_rows_out"] = 0
 
-        self.user_args["longitude"] = lng
-        self.user_args["latitude"] = lat
+        if "longitude" not in self.user_args or "latitude" not in self.user_args: 
+            return
+
+        self.close_properties = return_close_properties(self.df, self.user_args, self._spatial_index)
 
-        self.close_properties = return_close_properties(self.df, self.user_args)
+        if self.close_properties is not None and self.__use_preprocessor(): 
+            self.close_properties = self.preprocessor.transform(self.close_properties, self.user_args["zip_code"])
 
         if self.close_properties is not None:
-            self._closest_property = find_closest(self.close_properties, self.user_args)
+            self._closest_property = find_closest(self.close_properties, self.user_args, self._spatial_index)
+            record["n_rows_out"] = len(self.close_properties)
+
+    def __prepare_feature_vector(self, record: Dict): 
+        """Description. Build feature vector of user's property."""
+
+        record["n_rows_in"] = 1
+
+        self._features, self._X = prepare_feature_vector(
+            self.df, 
+            self.model_loader, 
+            self.user_args, 
+            self._last_trend_prices, 
+            self._closest_property, 
+            self._imputed_values, 
+            self._available_vars
+        )
 
-    def predict(self) -> float:
-        """Description. Predict price based on user's attributes."""
+        record["n_rows_out"] = self._X.shape[0]
+
+    def __predict_price(self, record: Dict): 
+        """Description. Predict price from feature vector."""
 
-        funs = [
-            self.__preprocess, 
-            self.__fetch_close_properties, 
-            prepare_feature_vector, 
-            get_predicted_price
+        record["n_rows_in"] = self._X.shape[0]
+        self._price_pred = get_predicted_price(self.model_loader["model"], self._X)
+        record["n_rows_out"] = 1
+
+    def predict(self) -> float:
+        """Description. Predict price based on user's attributes.
+        
+        Details: each stage is reported to hooks if any."""
+
+        stages = [
+            ("preprocessing", self.__preprocess), 
+            ("geocoding", self.__geocode), 
+            ("comparable_search", self.__fetch_close_properties), 
+            ("feature_vector", self.__prepare_feature_vector), 
+            ("inference", self.__predict_price)
         ]
 
-        model = self.model_loader["model"]
-
-        loop = tqdm(funs) 
-
-        for i, fun in enumerate(loop):
-            print(self.df.shape)
-
-            if i == len(funs) - 2: 
-                self._features, self._X = fun(
-                    self.df, 
-                    self.model_loader, 
-                    self.user_args, 
-                    self._last_trend_prices, 
-                    self._closest_property)
-                
-            elif i == len(funs) - 1: 
-                price_pred = get_predicted_price(model, self._X)
-            else: 
-                fun()
+        context = {"geo_area": self.geo_area, "property_type": self.user_args["property_type"]}
+
+        for stage, fun in tqdm(stages):
+            with instrument_stage(self.hooks, stage, **context) as record: 
+                fun(record)
+        
+        return self._price_pred
+
+    def fecth_mape(self, model_dir: Optional[str]=None) -> float:
+        """Description. Fetch MAPE of the model.
         
-        return price_pred
+        Details: if model_dir is provided, only the manifest of the saved model is read."""
 
-    def fecth_mape(self) -> float:
-        """Description. Fetch MAPE of the model."""
+        if model_dir is not None: 
+            manifest = load_area_manifest(model_dir, self.geo_area, self.user_args["property_type"])
 
-        estimator_name = self.model_loader["model"].estimator.__class__.__name__
-        metrics = self.model_loader["metrics"]["all"]
-        mape = metrics[estimator_name]["mean_absolute_percentage_error"]      
+            if manifest is not None: 
+                return fetch_mape(manifest)
 
-        return mape
+        return fetch_mape(self.model_loader)
         
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""Description. Preprocessing statistics of DVF+ transactions fitted once at training time and applied at inference."""
+
+from lib.enums import (
+    DVF_SELECTED_VARS,
+    DVF_LOCATION_VARS,
+    BNB_SELECTED_VARS,
+    OTHER_VARS,
+    DISCRETE_VARS,
+    CATEGORICAL_VARS,
+)
+
+from lib.dataset.build import log_transform
+from lib.dataset.utils import (
+    is_numeric,
+    transform_price,
+    filter_numeric_var,
+    floats_to_strings,
+    process_window_feature
+)
+from lib.preprocessing.utils import get_na_proportion
+
+from .utils import extract_department_code, preprocess_area_data, select_features
+from .imputation import ImputationTable
+
+from pandas.core.frame import DataFrame
+
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import numpy as np
+
+PREPROCESSOR_VERSION = 2
+
+def get_partition_key(zip_code: int) -> str:
+    """Description. Return key of the transactions loaded to predict price of a property (department code, zip code for Paris)."""
+
+    zip_code = int(zip_code)
+    department_code = extract_department_code(zip_code)
+
+    if department_code == 75:
+        return str(zip_code)
+
+    return str(department_code)
+
+def get_partition_keys(df: DataFrame) -> pd.Series:
+    """Description. Return partition key of each DVF+ transaction, None if department or zip code is missing."""
+
+    department_codes = pd.to_numeric(df["code_departement"], errors="coerce")
+    zip_codes = pd.to_numeric(df["code_postal"], errors="coerce")
+
+    keys = department_codes.map(lambda code: None if pd.isna(code) else str(int(code)))
+
+    is_paris = department_codes == 75
+    keys[is_paris] = zip_codes[is_paris].map(lambda code: None if pd.isna(code) else str(int(code)))
+
+    return keys
+
+def get_selected_columns(df: DataFrame) -> List[str]:
+    """Description. Return columns of DVF+ transactions selected by prepare_dataset with keep_location_vars."""
+
+    dvf_vars = [col for col in df.columns if col in DVF_SELECTED_VARS] + DVF_LOCATION_VARS
+    bnb_vars = [col for col in df.columns if col in BNB_SELECTED_VARS]
+    other_vars = [col for col in df.columns if col in OTHER_VARS]
+
+    return dvf_vars + bnb_vars + other_vars
+
+class AreaPreprocessor:
+    """Description. Fitted preprocessing of the DVF+ transactions of one geographical area.
+
+    Details: for each partition loaded at inference (department, zip code for Paris), the statistics
+    computed by preprocess_area_data are stored once: numeric filters, values imputed by prepare_dataset,
+    levels and reference levels of dummies, variables available after preprocessing, values imputed in
+    feature vectors and last trend prices. Predictions then use these statistics instead of preprocessing
+    the whole partition, and only the few comparable properties are transformed. The preprocessor is
+    serialized as a json-compatible dictionary saved next to the model (see lib.model.loader.save_model).
+
+    Args:
+        feature_names (List[str]): names of features used by model.
+        property_type (str): type of property (flats or houses).
+        partitions (Optional[Dict]): fitted statistics per partition key. Defaults to None.
+
+    Example:
+
+    >>> from lib.inference.preprocessor import AreaPreprocessor
+    >>> preprocessor = AreaPreprocessor(feature_names, "flats").fit(df)
+    >>> preprocessor
+    AreaPreprocessor(property_type=flats, n_features=87, n_partitions=20)
+    >>> preprocessor.transform(close_properties, zip_code=75001)"""
+
+    def __init__(self, feature_names: List[str], property_type: str, partitions: Optional[Dict]=None):
+        self.feature_names = list(feature_names)
+        self.property_type = property_type
+        self.partitions = partitions if partitions is not None else {}
+        self._tables = {}
+
+    def __repr__(self) -> str:
+        return f"AreaPreprocessor(property_type={self.property_type}, n_features={len(self.feature_names)}, n_partitions={len(self.partitions)})"
+
+    def __contains__(self, zip_code: int) -> bool:
+        return get_partition_key(zip_code) in self.partitions
+
+    @property
+    def model_loader(self) -> Dict:
+        return {"feature_names": self.feature_names}
+
+    def fit(self, df: DataFrame, min_rows: int=2) -> "AreaPreprocessor":
+        """Description. Fit statistics of each partition of DVF+ transactions with at least min_rows transactions."""
+
+        keys = get_partition_keys(df)
+
+        for key, idxs in df.groupby(keys).indices.items():
+            if len(idxs) >= min_rows:
+                self.partitions[key] = self.fit_partition(df.iloc[idxs])
+
+        return self
+
+    def fit_partition(self, df: DataFrame) -> Dict:
+        """Description. Return statistics of the transactions of one partition."""
+
+        df = df.copy()
+
+        df_prep, last_trend_prices, params = preprocess_area_data(
+            df.copy(),
+            self.model_loader,
+            self.property_type,
+            return_params=True
+        )
+
+        preproc_args = params["preproc_args"]
+
+        # values imputed by prepare_dataset, columns with too many missing values are removed
+        columns = get_selected_columns(df)
+        numeric_vars = [var for var in columns if is_numeric(df[var]) and var not in CATEGORICAL_VARS]
+        fill_values = {}
+
+        for var in columns:
+            if get_na_proportion(df, var) <= preproc_args["na_threshold"]:
+                fill_values[var] = df[var].median() if var in numeric_vars else df[var].mode()[0]
+
+        stats = {
+            "n_rows": len(df_prep),
+            "fill_values": fill_values,
+            "log_vars": [var for var in numeric_vars if var not in DISCRETE_VARS and var in fill_values],
+            "numeric_filters": {var: list(interval) for var, interval in preproc_args["numeric_filters"].items()},
+            "levels": params["levels"],
+            "reference_levels": params["reference_levels"],
+            "available_vars": list(df_prep.columns),
+            "imputed_values": ImputationTable.from_frame(df_prep, self.feature_names).to_dict(),
+            "last_trend_prices": last_trend_prices
+        }
+
+        return stats
+
+    def get_partition(self, zip_code: int) -> Dict:
+        """Description. Return fitted statistics of the partition containing zip code."""
+
+        key = get_partition_key(zip_code)
+
+        if key not in self.partitions:
+            raise KeyError(f"No fitted statistics for partition {key}.")
+
+        return self.partitions[key]
+
+    def get_imputation_table(self, zip_code: int) -> Union[ImputationTable, Dict]:
+        """Description. Return imputation table of the partition containing zip code.
+
+        Details: tables are built once per partition. Preprocessors of format version 1 stored imputed values 
+        as a dictionary, returned as is."""
+
+        key = get_partition_key(zip_code)
+
+        if key not in self._tables:
+            imputed_values = self.get_partition(zip_code)["imputed_values"]
+
+            if "values" in imputed_values and "feature_names" in imputed_values:
+                imputed_values = ImputationTable.from_dict(imputed_values)
+
+            self._tables[key] = imputed_values
+
+        return self._tables[key]
+
+    def filter(self, df: DataFrame, zip_code: int) -> DataFrame:
+        """Description. Return transactions kept by the numeric filters of prepare_dataset without preprocessing them."""
+
+        stats = self.get_partition(zip_code)
+        mask = np.ones(len(df), dtype=bool)
+
+        for var, (min_val, max_val) in stats["numeric_filters"].items():
+
+            if var not in stats["fill_values"]:
+                continue
+
+            x = pd.to_numeric(df[var]).astype("float64").fillna(stats["fill_values"][var]).values
+            mask &= (x >= min_val) & (x <= max_val)
+
+        return df[mask]
+
+    def transform(self, df: DataFrame, zip_code: int) -> DataFrame:
+        """Description. Apply fitted preprocessing to DVF+ transactions of the partition containing zip code.
+
+        Details: same steps as preprocess_area_data with fitted statistics. Moving average prices are not
+        computed, their columns are missing values as feature vectors use the last trend prices."""
+
+        stats = self.get_partition(zip_code)
+
+        df = df[list(stats["fill_values"].keys())].fillna(value=stats["fill_values"])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            df.loc[:, "l_valeur_fonciere"] = transform_price(df["valeur_fonciere"].to_numpy(dtype="float64"), log=True)
+
+            for var in stats["log_vars"]:
+                df.loc[:, f"l_{var}"] = log_transform(df[var])
+
+            df.loc[:, "valeur_fonciere_m2"] = transform_price(
+                df["valeur_fonciere"].to_numpy(dtype="float64"),
+                log=False,
+                area=df["surface_reelle_bati"].to_numpy(dtype="float64")
+            )
+
+        for var, interval in stats["numeric_filters"].items():
+            if var in df.columns:
+                df = filter_numeric_var(df, var, interval)
+
+        for var in CATEGORICAL_VARS:
+            if var in df.columns:
+                df.loc[:, var] = floats_to_strings(df[var])
+
+        for var in (stats["last_trend_prices"] or {}).keys():
+            df.loc[:, var] = np.nan
+
+        df = process_window_feature(df)
+
+        # dummies of fitted levels only, so that one row has the same columns as the whole partition
+        for var, levels in stats["levels"].items():
+            dummies = pd.get_dummies(pd.Categorical(df[var], categories=levels), prefix=var, dtype="uint8")
+            dummies.index = df.index
+
+            df = pd.concat([df.drop(columns=[var]), dummies], axis=1)
+
+        reference_cols = [f"{var}_{lvl}" for var, lvl in stats["reference_levels"].items()]
+        df = df.drop(columns=[col for col in reference_cols if col in df.columns])
+
+        return select_features(df, self.model_loader)
+
+    def to_dict(self) -> Dict:
+        """Description. Return json-compatible dictionary of fitted preprocessor."""
+
+        return {
+            "format_version": PREPROCESSOR_VERSION,
+            "feature_names": self.feature_names,
+            "property_type": self.property_type,
+            "partitions": self.partitions
+        }
+
+    @classmethod
+    def from_dict(cls, content: Dict) -> "AreaPreprocessor":
+        """Description. Load preprocessor from dictionary returned by to_dict."""
+
+        if content["format_version"] > PREPROCESSOR_VERSION:
+            raise ValueError(f"Preprocessor format version {content['format_version']} is not supported (max {PREPROCESSOR_VERSION}).")
+
+        return cls(content["feature_names"], content["property_type"], content["partitions"])
+
+def get_preprocessor(model_loader: Optional[Dict]) -> Optional[AreaPreprocessor]:
+    """Description. Return fitted preprocessor saved with model or None (e.g. models saved before preprocessors)."""
+
+    if model_loader is None or model_loader.get("preprocessor") is None:
+        return None
+
+    preprocessor = model_loader["preprocessor"]
+
+    if isinstance(preprocessor, AreaPreprocessor):
+        return preprocessor
+
+    return AreaPreprocessor.from_dict(preprocessor)
@@ -0,0 +1,390 @@
+"""Description. Asynchronous HTTP prediction service around PredictionEngine with micro-batched model calls."""
+
+from .predict import find_geo_area
+from .engine import PredictionEngine
+from .utils import fetch_mape, get_predicted_prices
+from .instrumentation import PredictionHook, RecordingHook, instrument_stage
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+import numpy as np
+
+import asyncio
+import json
+import time
+
+USER_ARGS = {
+    "property_type": str,
+    "street_number": int,
+    "street_name": str,
+    "zip_code": int,
+    "city": str,
+    "num_rooms": int,
+    "surface": float,
+    "field_surface": float,
+    "dependance": int
+}
+
+LOCATION_ARGS = ["longitude", "latitude"]
+
+PROPERTY_TYPES = ["flats", "houses"]
+
+def parse_user_args(content: Dict) -> Dict:
+    """Description. Return user's arguments cast to their types, raise ValueError if a field is missing or invalid.
+
+    Details: longitude and latitude are optional, user's address is geocoded if they are missing."""
+
+    if not isinstance(content, dict):
+        raise ValueError("Request body must be a json object.")
+
+    user_args = {}
+
+    for var, dtype in USER_ARGS.items():
+
+        if content.get(var) is None:
+            raise ValueError(f"Missing field {var}.")
+
+        try:
+            user_args[var] = dtype(content[var])
+        except (TypeError, ValueError):
+            raise ValueError(f"Field {var} must be of type {dtype.__name__}, got {content[var]!r}.")
+
+    if user_args["property_type"] not in PROPERTY_TYPES:
+        raise ValueError(f"Field property_type must be one of {PROPERTY_TYPES}, got {user_args['property_type']!r}.")
+
+    for var in LOCATION_ARGS:
+
+        if content.get(var) is None:
+            continue
+
+        try:
+            user_args[var] = float(content[var])
+        except (TypeError, ValueError):
+            raise ValueError(f"Field {var} must be of type float, got {content[var]!r}.")
+
+    return user_args
+
+class MicroBatcher:
+    """Description. Coalesce concurrent predictions of the same (geo_area, property_type) into one model call.
+
+    Details: feature vectors are queued per key on the event loop. A queue is flushed when it reaches
+    max_batch_size or max_wait seconds after its first vector, the model is then called once on the
+    stacked vectors in a worker of the executor and each request receives its own price.
+
+    Args:
+        executor (ThreadPoolExecutor): workers running model calls only, so that they never wait for areas being built.
+        max_batch_size (int): maximum number of feature vectors per model call.
+        max_wait (float): maximum time (s) a feature vector waits for other requests.
+        hooks (Optional[List[PredictionHook]]): hooks receiving one inference record per model call."""
+
+    def __init__(
+        self,
+        executor: ThreadPoolExecutor,
+        max_batch_size: int=32,
+        max_wait: float=.005,
+        hooks: Optional[List[PredictionHook]]=None
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be positive, got {max_batch_size}.")
+
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.hooks = hooks if hooks is not None else []
+
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+
+        self.n_batches = 0
+        self.n_vectors = 0
+
+    def __repr__(self) -> str:
+        return f"MicroBatcher(max_batch_size={self.max_batch_size}, max_wait={self.max_wait}, pending={self.pending})"
+
+    @property
+    def pending(self) -> int:
+        """Description. Number of feature vectors waiting for a model call."""
+
+        return sum(len(batch) for batch in self._pending.values())
+
+    async def predict(self, key: Tuple, model, X: np.ndarray) -> float:
+        """Description. Queue feature vector of one property and wait for its predicted price.
+
+        Args:
+            key (Tuple): geographical area and property type.
+            model (CustomRegressor): model of the area.
+            X (np.ndarray): feature vector of shape (1, n_features).
+
+        Returns:
+            float: predicted price."""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((X, model, future))
+
+        if len(batch) >= self.max_batch_size:
+            self.flush(key)
+
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self.flush, key)
+
+        return await future
+
+    def flush(self, key: Tuple):
+        """Description. Send queued feature vectors of key to a worker."""
+
+        timer = self._timers.pop(key, None)
+
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(key, [])
+
+        if not batch:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._run(key, batch))
+
+        # keep a reference to running tasks so that they are not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _predict(self, key: Tuple, model, X: np.ndarray) -> np.ndarray:
+        geo_area, property_type = key
+
+        with instrument_stage(self.hooks, "inference", geo_area=geo_area, property_type=property_type) as record:
+            record["n_rows_in"] = X.shape[0]
+            prices = get_predicted_prices(model, X)
+            record["n_rows_out"] = len(prices)
+
+        return prices
+
+    async def _run(self, key: Tuple, batch: List[Tuple]):
+        loop = asyncio.get_running_loop()
+
+        # one model per key, grouped by model in case it has been reloaded by the registry
+        groups = {}
+        for X, model, future in batch:
+            groups.setdefault(id(model), (model, []))[1].append((X, future))
+
+        for model, items in groups.values():
+            X = np.vstack([X for X, _ in items])
+
+            self.n_batches += 1
+            self.n_vectors += X.shape[0]
+
+            try:
+                prices = await loop.run_in_executor(self.executor, self._predict, key, model, X)
+
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+            else:
+                for (_, future), price in zip(items, prices):
+                    if not future.done():
+                        future.set_result(float(price))
+
+class PredictionService:
+    """Description. HTTP prediction service offloading CPU-bound work to a pool of workers.
+
+    Details: data loading, preprocessing, geocoding and feature vectors are computed by PredictionEngine
+    in the workers, model calls are micro-batched per (geo_area, property_type) by MicroBatcher and run
+    by separate inference workers: requests for warm areas are not queued behind areas being built.
+    Stages request, feature_vector and inference are recorded to compute latencies.
+
+    Endpoints:
+        - POST /predict: json with the fields of user_args (longitude and latitude optional), returns predicted price.
+        - GET /health: status, uptime, number of cached areas, pending feature vectors and request counts.
+        - GET /latency: count, mean, quantiles and max of wall times per stage, histogram of a stage with ?stage=inference&bins=20.
+
+    Args:
+        engine (PredictionEngine): engine keeping preprocessed data and models in memory.
+        n_workers (int): number of workers computing feature vectors.
+        n_model_workers (int): number of workers running model calls.
+        max_batch_size (int): maximum number of properties per model call.
+        max_wait (float): maximum time (s) a request waits for other requests of the same area.
+        hooks (Optional[List[PredictionHook]]): additional hooks receiving stage records.
+
+    Example:
+
+    >>> from lib.inference import PredictionEngine
+    >>> from lib.inference.service import PredictionService
+    >>> from aiohttp import web
+    >>> engine = PredictionEngine(data_dir="./data/", model_dir="./backup/models/")
+    >>> service = PredictionService(engine, n_workers=4)
+    >>> web.run_app(service.make_app(), port=8080)"""
+
+    def __init__(
+        self,
+        engine: PredictionEngine,
+        n_workers: int=4,
+        n_model_workers: int=2,
+        max_batch_size: int=32,
+        max_wait: float=.005,
+        hooks: Optional[List[PredictionHook]]=None
+    ):
+        self.engine = engine
+        self.n_workers = n_workers
+        self.n_model_workers = n_model_workers
+
+        self.recorder = RecordingHook()
+        self.hooks = [self.recorder] + (hooks if hooks is not None else [])
+
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="prediction")
+        self.model_executor = ThreadPoolExecutor(max_workers=n_model_workers, thread_name_prefix="inference")
+        self.batcher = MicroBatcher(self.model_executor, max_batch_size, max_wait, self.hooks)
+
+        self.started_at = time.time()
+        self.n_requests = 0
+        self.n_errors = 0
+
+    def __repr__(self) -> str:
+        return f"PredictionService(engine={self.engine}, n_workers={self.n_workers}, batcher={self.batcher})"
+
+    def _prepare_features(self, user_args: Dict, geo_area: str) -> Optional[Dict]:
+        context = {"geo_area": geo_area, "property_type": user_args["property_type"]}
+
+        with instrument_stage(self.hooks, "feature_vector", **context) as record:
+            record["n_rows_in"] = 1
+            prepared = self.engine.prepare_features(user_args)
+            record["n_rows_out"] = 0 if prepared is None else 1
+
+        return prepared
+
+    async def predict(self, user_args: Dict) -> Optional[Dict]:
+        """Description. Predict price of user's property, None if area is not covered.
+
+        Returns:
+            Optional[Dict]: predicted price, geographical area, location of user's property, distance to
+                closest property (None if not found) and MAPE of the model."""
+
+        geo_area = find_geo_area(user_args)
+
+        if geo_area is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(self.executor, self._prepare_features, user_args, geo_area)
+
+        if prepared is None:
+            return None
+
+        model_loader = prepared["model_loader"]
+        key = prepared["state"]["key"][:2]
+
+        price = await self.batcher.predict(key, model_loader["model"], prepared["X"])
+
+        located = prepared["user_args"]
+        closest = prepared["closest"]
+
+        result = {
+            "price": price,
+            "geo_area": geo_area,
+            "property_type": user_args["property_type"],
+            "longitude": located.get("longitude"),
+            "latitude": located.get("latitude"),
+            "closest_distance": None if closest is None else float(closest["distance"]),
+            "mape": fetch_mape(model_loader)
+        }
+
+        return result
+
+    async def handle_predict(self, request: web.Request) -> web.Response:
+        self.n_requests += 1
+
+        with instrument_stage(self.hooks, "request") as record:
+            record["n_rows_in"] = 1
+            record["n_rows_out"] = 0
+
+            try:
+                user_args = parse_user_args(await request.json())
+            except ValueError as e: # json.JSONDecodeError is a ValueError
+                self.n_errors += 1
+                return web.json_response({"error": str(e)}, status=400)
+
+            record["geo_area"] = find_geo_area(user_args)
+            record["property_type"] = user_args["property_type"]
+
+            try:
+                result = await self.predict(user_args)
+            except Exception as e:
+                self.n_errors += 1
+                return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+
+            if result is None:
+                self.n_errors += 1
+                return web.json_response({"error": "No model available for this property."}, status=404)
+
+            record["n_rows_out"] = 1
+
+        return web.json_response(result)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        health = {
+            "status": "ok",
+            "uptime": time.time() - self.started_at,
+            "n_workers": self.n_workers,
+            "n_model_workers": self.n_model_workers,
+            "n_areas": self.engine.n_areas,
+            "pending": self.batcher.pending,
+            "n_requests": self.n_requests,
+            "n_errors": self.n_errors,
+            "n_batches": self.batcher.n_batches,
+            "mean_batch_size": self.batcher.n_vectors / self.batcher.n_batches if self.batcher.n_batches else None
+        }
+
+        return web.json_response(health)
+
+    async def handle_latency(self, request: web.Request) -> web.Response:
+        if "stage" in request.query:
+            stage = request.query["stage"]
+
+            try:
+                bins = int(request.query.get("bins", 20))
+            except ValueError:
+                return web.json_response({"error": "bins must be an integer."}, status=400)
+
+            if bins < 1:
+                return web.json_response({"error": "bins must be positive."}, status=400)
+
+            if not any(record["stage"] == stage for record in self.recorder.records):
+                return web.json_response({"error": f"No record for stage {stage}."}, status=404)
+
+            counts, edges = self.recorder.histogram(stage, bins)
+
+            return web.json_response({"stage": stage, "counts": counts.tolist(), "edges": edges.tolist()})
+
+        summary = self.recorder.summary()
+
+        if summary.empty:
+            return web.json_response({})
+
+        # to_json converts NaN to null
+        return web.json_response(json.loads(summary.to_json(orient="index")))
+
+    async def _on_cleanup(self, app: web.Application):
+        self.executor.shutdown(wait=False)
+        self.model_executor.shutdown(wait=False)
+
+    def make_app(self) -> web.Application:
+        """Description. Return aiohttp application with predict, health and latency endpoints."""
+
+        app = web.Application()
+
+        app.add_routes([
+            web.post("/predict", self.handle_predict),
+            web.get("/health", self.handle_health),
+            web.get("/latency", self.handle_latency)
+        ])
+
+        app.on_cleanup.append(self._on_cleanup)
+
+        return app
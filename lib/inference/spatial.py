@@ -0,0 +1,155 @@
+"""Description. Spatial and address indexes to search comparable properties of one area."""
+
+from sklearn.neighbors import BallTree
+
+from pandas.core.frame import DataFrame
+from pandas.core.series import Series
+
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import numpy as np
+
+EARTH_RADIUS = 6371008.8
+
+def normalize_street_names(street_names: Series) -> Series:
+    """Description. Normalize street names of DVF+ transactions as in return_close_properties."""
+
+    return street_names.str.lower().replace(",", "")
+
+def normalize_street_name(street_name: str) -> str:
+    """Description. Normalize street name of user's property as in return_close_properties."""
+
+    return street_name.lower().replace(",", "")
+
+class SpatialIndex:
+    """Description. Index of the transactions of one area built once at data load time.
+
+    Details:
+        - a BallTree with haversine metric answers k-nearest and radius queries.
+        - hash tables map (zip code), (zip code, street) and (zip code, street, number) to row positions.
+        - if no transaction has coordinates, no tree is built and spatial queries return no neighbour.
+
+    Args:
+        df (DataFrame): transactions with latitude, longitude, code_postal, adresse_nom_voie and adresse_numero.
+        k (int): number of neighbours fetched by the first k-nearest query of nearest. Defaults to 16.
+        leaf_size (int): leaf size of BallTree. Defaults to 40."""
+
+    def __init__(self, df: DataFrame, k: int=16, leaf_size: int=40):
+        self.k = k
+        self.labels = df.index
+
+        coords = df[["latitude", "longitude"]].to_numpy(dtype="float64")
+        valid = ~np.isnan(coords).any(axis=1)
+
+        self._positions = np.flatnonzero(valid)
+        self._tree = BallTree(np.radians(coords[valid]), metric="haversine", leaf_size=leaf_size) if valid.any() else None
+
+        keys = pd.DataFrame({
+            "code_postal": pd.to_numeric(df["code_postal"]).astype("float64").values,
+            "adresse_nom_voie": normalize_street_names(df["adresse_nom_voie"]).values,
+            "adresse_numero": pd.to_numeric(df["adresse_numero"]).astype("float64").values
+        })
+
+        self._zips = keys.groupby("code_postal").indices
+        self._streets = keys.groupby(["code_postal", "adresse_nom_voie"]).indices
+        self._addresses = keys.groupby(["code_postal", "adresse_nom_voie", "adresse_numero"]).indices
+
+    def __repr__(self) -> str:
+        return f"SpatialIndex(n_properties={len(self.labels)}, n_zip_codes={len(self._zips)})"
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def get_positions(self, labels: pd.Index) -> np.ndarray:
+        """Description. Return positions in index of rows with given labels."""
+
+        positions = self.labels.get_indexer(labels)
+        return positions[positions >= 0]
+
+    def lookup(self, user_args: Dict) -> Optional[np.ndarray]:
+        """Description. Return positions of transactions at user's address, street or zip code.
+
+        Details: same fallback order as return_close_properties, None if no transaction is found."""
+
+        zip_code = float(user_args["zip_code"])
+        street_name = normalize_street_name(user_args["street_name"])
+
+        for table, key in (
+            (self._addresses, (zip_code, street_name, float(user_args["street_number"]))),
+            (self._streets, (zip_code, street_name)),
+            (self._zips, zip_code)
+        ):
+            positions = table.get(key)
+
+            if positions is not None and len(positions) > 0:
+                return positions
+
+        return None
+
+    def query(self, latitude: float, longitude: float, k: int) -> Tuple:
+        """Description. Return positions and distances (meters) of the k nearest transactions."""
+
+        k = min(k, len(self._positions))
+
+        if k == 0:
+            return np.array([], dtype=int), np.array([])
+
+        distances, idxs = self._tree.query(np.radians([[latitude, longitude]]), k=k)
+
+        return self._positions[idxs[0]], distances[0] * EARTH_RADIUS
+
+    def query_radius(self, latitude: float, longitude: float, radius: float) -> Tuple:
+        """Description. Return positions and distances (meters) of transactions within radius (meters), sorted by distance."""
+
+        if self._tree is None:
+            return np.array([], dtype=int), np.array([])
+
+        idxs, distances = self._tree.query_radius(
+            np.radians([[latitude, longitude]]),
+            r=radius / EARTH_RADIUS,
+            return_distance=True,
+            sort_results=True
+        )
+
+        return self._positions[idxs[0]], distances[0] * EARTH_RADIUS
+
+    def nearest(self, latitude: float, longitude: float, positions: Optional[np.ndarray]=None) -> Tuple:
+        """Description. Return positions of the closest transactions (ties included) and their distance.
+
+        Args:
+            latitude (float): latitude of user's property.
+            longitude (float): longitude of user's property.
+            positions (Optional[np.ndarray]): positions of candidate transactions, all transactions if None.
+
+        Returns:
+            Tuple: sorted positions of closest transactions and distance in meters (NaN if no candidate).
+
+        Details: k-nearest query is repeated with twice as many neighbours until a candidate is found
+        and no tie can be left out."""
+
+        n_valid = len(self._positions)
+
+        is_candidate = None
+        if positions is not None:
+            is_candidate = np.zeros(len(self.labels), dtype=bool)
+            is_candidate[positions] = True
+
+        k = min(self.k, n_valid)
+
+        while k > 0:
+            idxs, distances = self.query(latitude, longitude, k)
+            keep = np.ones(k, dtype=bool) if is_candidate is None else is_candidate[idxs]
+
+            if keep.any():
+                d_min = distances[keep].min()
+
+                if d_min < distances[-1] or k == n_valid:
+                    return np.sort(idxs[keep & (distances == d_min)]), d_min
+
+            if k == n_valid:
+                break
+
+            k = min(2 * k, n_valid)
+
+        return np.array([], dtype=int), np.nan
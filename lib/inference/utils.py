@@ -5,12 +5,19 @@ from lib.enums import (
 
 from lib.dataset.utils import (
     extract_int_from_string, 
-    is_dummy, 
-    get_most_frequent_levels    
+    get_categorical_vars, 
+    get_most_frequent_levels, 
+    get_unique_values
 )
 
+from lib.dataset.build import prepare_dataset, prepare_dummies
+from lib.dataset.trend import TrendPriceStore
+
 from lib.model.estimator import CustomRegressor
 
+from .spatial import SpatialIndex
+from .imputation import ImputationTable
+
 from typing import (
     Tuple, 
     List, 
@@ -133,23 +140,109 @@ def select_features(df: DataFrame, model_loader: Dict) -> DataFrame:
     
     return df.loc[:, to_select]
 
-def fetch_last_trend_prices(df: DataFrame, trend_price_vars: List[str]) -> Dict: 
-    """Description. Return last trend prices from dataframe using moving averages."""
+def fetch_last_trend_prices(trend_store: TrendPriceStore, mov_av_windows: List[int], trend_price_vars: List[str]) -> Dict: 
+    """Description. Return last trend prices of the most recent day from trend price store."""
     
-    result = df[trend_price_vars].iloc[-1]
-    return dict(result)
+    last_prices = trend_store.last_prices(mov_av_windows, lag=0, log=True)
+    return {var: last_prices[var] for var in trend_price_vars}
+
+def get_area_preproc_args(df: DataFrame, model_loader: Dict, property_type: str) -> Dict: 
+    """Description. Return arguments of prepare_dataset used to preprocess DVF+ transactions of one area before prediction."""
+
+    mov_av_windows = get_movav_windows(model_loader["feature_names"])
+
+    if len(mov_av_windows) == 0:
+        mov_av_windows = None
+
+    preproc_args = {
+        "target_var": "l_valeur_fonciere", 
+        "numeric_filters": get_numeric_filters(df, property_type),  
+        "na_threshold": 0.5,
+        "ma_lag": 0, 
+        "mov_av_windows": mov_av_windows, 
+        "print_summary": False, 
+        "return_var_names": False, 
+        "keep_location_vars": True
+    }
+
+    return preproc_args
+
+def preprocess_area_data(df: DataFrame, model_loader: Dict, property_type: str, return_params: bool=False) -> Tuple: 
+    """Description. Apply preprocessing steps to DVF+ transactions of one area before prediction.
+    
+    Args:
+        df (DataFrame): DVF+ transactions of the area.
+        model_loader (Dict): Model loader with feature names.
+        property_type (str): Type of property (flats or houses).
+        return_params (bool): whether to return arguments of prepare_dataset, levels and reference levels of dummies.
+        
+    Returns:
+        Tuple: preprocessed dataframe with features used in model, last trend prices (None if model does not use them)
+            and parameters if return_params."""
+
+    preproc_args = get_area_preproc_args(df, model_loader, property_type)
+    mov_av_windows = preproc_args["mov_av_windows"]
+
+    trend_store = TrendPriceStore()
+    df = prepare_dataset(df, trend_store=trend_store, **preproc_args)
+
+    categorical_vars = get_categorical_vars(df, n_levels_max=30)   
+    categorical_vars.append("baie_orientation") 
+    dummy_ref_levels = get_most_frequent_levels(df, categorical_vars)
+    levels = {var: get_unique_values(df, var) for var in categorical_vars}
+    df = prepare_dummies(df, categorical_vars, dummy_ref_levels, remove_cols_with_one_value=False)
+
+    df = select_features(df, model_loader)
+
+    last_trend_prices = None
+    trend_prices_vars = [var for var in df.columns if var.startswith("l_valeur_fonciere_ma")]
+
+    if len(trend_prices_vars) > 0:
+        last_trend_prices = fetch_last_trend_prices(trend_store, mov_av_windows, trend_prices_vars)
+
+    if return_params: 
+        params = {"preproc_args": preproc_args, "levels": levels, "reference_levels": dummy_ref_levels}
+        return df, last_trend_prices, params
+
+    return df, last_trend_prices
+
+def fetch_mape(model_loader: Dict) -> float:
+    """Description. Fetch MAPE of the model from model loader or from artifact manifest."""
+
+    if "estimator" in model_loader: 
+        estimator_name = model_loader["estimator"]
+    else: 
+        estimator_name = model_loader["model"].estimator.__class__.__name__
+
+    metrics = model_loader["metrics"]["all"]
+    mape = metrics[estimator_name]["mean_absolute_percentage_error"]      
 
+    return mape
 
-def return_close_properties(df: DataFrame, user_args: Dict) -> Optional[Union[Series, DataFrame]]:
+
+def return_close_properties(
+    df: DataFrame, 
+    user_args: Dict, 
+    spatial_index: Optional[SpatialIndex]=None
+) -> Optional[Union[Series, DataFrame]]:
     """Description. Return properties (flats or houses) close to user's property.
     
     Args:
         df (DataFrame): Dataframe with all properties.
         user_args (Dict): features of user's property.
+        spatial_index (Optional[SpatialIndex]): index built on df to look addresses up without scanning df. Defaults to None.
         
     Returns:
         Optional[Union[Series, DataFrame]]: close properties or None if no properties found."""
 
+    if spatial_index is not None: 
+        positions = spatial_index.lookup(user_args)
+
+        if positions is None: 
+            return None
+        
+        return df.loc[spatial_index.labels[positions], :]
+
     mask_street_name = (
         df.adresse_nom_voie.str.lower().replace(",", "") == 
         user_args["street_name"].lower().replace(",", "")
@@ -200,15 +293,38 @@ def get_row_with_less_na(df: DataFrame) -> Series:
 
     return df.loc[df.isna().sum(axis=1) == df.isna().sum(axis=1).min(), :]
 
-def find_closest(df: DataFrame, user_args: Dict) -> Series:
+def find_closest(df: DataFrame, user_args: Dict, spatial_index: Optional[SpatialIndex]=None) -> Optional[Series]:
     """Description. Find closest property from user's property.
     
     Args:
         df (DataFrame): Dataframe with all properties.
         user_args (Dict): features of user's property.
+        spatial_index (Optional[SpatialIndex]): index built on a dataframe containing df to query nearest neighbours. Defaults to None.
         
     Returns:
-        Series: Closest property."""
+        Optional[Series]: Closest property (None if no property with location is found using spatial index).
+        
+    Details: with spatial_index, distance is the haversine distance instead of the geodesic distance."""
+
+    if spatial_index is not None: 
+        positions, distance = spatial_index.nearest(
+            user_args["latitude"], 
+            user_args["longitude"], 
+            spatial_index.get_positions(df.index)
+        )
+
+        if len(positions) == 0: 
+            return None
+
+        closest = df.loc[spatial_index.labels[positions], :]
+
+        if len(closest) > 1: 
+            closest = get_row_with_less_na(closest)
+
+        closest = closest.iloc[0, :].copy()
+        closest["distance"] = distance
+
+        return closest
 
     user_coords = (user_args["latitude"], user_args["longitude"])
 
@@ -228,43 +344,24 @@ def remove_l_prefix(string: str) -> str:
 
     return string
 
-def get_imputed_values(df: DataFrame, model_loader: Dict) -> DataFrame:
+def get_imputed_values(df: DataFrame, model_loader: Dict) -> Dict:
     """Description. Get imputed values for missing values in dataframe.
     
     Args:
-        df (DataFrame): Dataframe to impute.
+        df (DataFrame): Dataframe to impute, not modified.
         model_loader (Dict): Model loader with feature names to impute.
         
     Returns:
-        DataFrame: Dataframe with imputed values.
+        Dict: imputed value of each column except identifiers, price, type and location variables.
         
     Details:
         - If variable is a dummy variable, impute with most frequent level.
-        - If variable is a continuous variable, impute with median."""
-    
-    to_impute = []
+        - If variable is a continuous variable, impute with median.
+        - All columns are computed at once, see ImputationTable for the compact version used at inference."""
 
-    to_remove = ["id_mutation", "date_mutation", "valeur_fonciere", "type_local"]
-    to_remove.extend(DVF_LOCATION_VARS)
+    table = ImputationTable.from_frame(df)
 
-    to_remove = [var for var in to_remove if var in df.columns]
-
-    df.drop(columns=to_remove, inplace=True)
-       
-    imputed_values = {}
-    
-    for var in df.columns:
-        x = df[var]
-
-        if is_dummy(x):
-            val = get_most_frequent_levels(df, [var])[var]
-
-        else: 
-            val = x.median()
-
-        imputed_values[var] = val
-
-    return imputed_values
+    return dict(zip(table.feature_names, table.values))
 
 def check_num_rooms(num_rooms: int, var: str) -> float: 
     """Description. Return 1 if number of rooms is in variable name, 0 otherwise."""
@@ -292,7 +389,9 @@ def prepare_feature_vector(
     model_loader: Dict, 
     user_args: Dict, 
     last_trend_prices: Optional[Dict]=None, 
-    closest: Optional[Series]=None 
+    closest: Optional[Series]=None, 
+    imputed_values: Optional[Union[Dict, ImputationTable]]=None, 
+    available_vars: Optional[List]=None
 ) -> Tuple: 
     """Description. Prepare feature vector for prediction.
     
@@ -302,6 +401,9 @@ def prepare_feature_vector(
         user_args (Dict): Features of user's property.
         last_trend_prices (Dict): Last trend prices.
         closest (Optional[Series], optional): Closest property to user's. Defaults to None.
+        imputed_values (Optional[Union[Dict, ImputationTable]], optional): Precomputed imputed values, computed from df if None. 
+            Defaults to None.
+        available_vars (Optional[List], optional): Variables of preprocessed data, columns of df if None. Defaults to None.
         
     Returns:
         Tuple: Feature vector and selected features."""
@@ -310,8 +412,11 @@ def prepare_feature_vector(
     X = pd.Series(index=selected_features, dtype="float64")
 
     if closest is None or closest.distance > 0:
-        available_vars = list(df.columns)
-        imputed_values = get_imputed_values(df, model_loader) 
+        if available_vars is None: 
+            available_vars = list(df.columns)
+
+        if imputed_values is None:
+            imputed_values = ImputationTable.from_frame(df, selected_features) 
     else: 
         available_vars = list(closest.index)
         imputed_values = closest 
@@ -357,6 +462,109 @@ def prepare_feature_vector(
 
     return features, X
 
+def check_num_rooms_batch(num_rooms: Series, var: str) -> np.ndarray: 
+    """Description. Vectorized version of check_num_rooms for a pandas Series of number of rooms.
+    
+    Details: number of rooms is cast to integer first, float columns (e.g. read from parquet or from csv with 
+    missing values) would otherwise be converted to "3.0" and match no dummy variable."""
+
+    num_rooms = pd.to_numeric(num_rooms).astype("Int64").astype(str)
+    uniques, inverse = np.unique(num_rooms.values, return_inverse=True)
+    values = np.array([check_num_rooms(num_rooms, var) for num_rooms in uniques])
+
+    return values[inverse]
+
+def prepare_feature_matrix(
+    df: DataFrame, 
+    model_loader: Dict, 
+    users: DataFrame, 
+    last_trend_prices: Optional[Dict]=None, 
+    closest: Optional[DataFrame]=None, 
+    imputed_values: Optional[Union[Dict, ImputationTable]]=None, 
+    available_vars: Optional[List]=None
+) -> Tuple: 
+    """Description. Prepare feature matrix for the prediction of several properties in one pass.
+    
+    Args:
+        df (DataFrame): Dataframe used for data imputation. 
+        model_loader (Dict): Model loader with feature names used for prediction.
+        users (DataFrame): Features of users' properties, one row per property.
+        last_trend_prices (Dict): Last trend prices.
+        closest (Optional[DataFrame], optional): Closest property of each user's property (aligned with users) with distance. Defaults to None.
+        imputed_values (Optional[Union[Dict, ImputationTable]], optional): Precomputed imputed values, computed from df if None. 
+            Defaults to None.
+        available_vars (Optional[List], optional): Variables of preprocessed data, columns of df if None. Defaults to None.
+        
+    Returns:
+        Tuple: selected features and feature matrix.
+        
+    Details: same rules as prepare_feature_vector applied column by column."""
+
+    selected_features = model_loader["feature_names"]
+    n_rows = users.shape[0]
+
+    X = np.zeros((n_rows, len(selected_features)), dtype="float64")
+
+    if available_vars is None: 
+        available_vars = list(df.columns)
+
+    if imputed_values is None: 
+        imputed_values = ImputationTable.from_frame(df, selected_features)
+
+    if closest is not None: 
+        exact = (closest["distance"] == 0).values
+    else: 
+        exact = np.zeros(n_rows, dtype=bool)
+
+    quarter, month = get_quarter(TODAY), get_month(TODAY)
+
+    for j, var in enumerate(selected_features): 
+
+        if var not in available_vars: 
+            X[:, j] = 0
+
+        elif "nombre_pieces_principales" in var:
+            X[:, j] = check_num_rooms_batch(users["num_rooms"], var)
+
+        elif var == "surface_reelle_bati":
+            X[:, j] = users["surface"].values
+
+        elif var == "l_surface_reelle_bati":
+            X[:, j] = np.log(users["surface"].values.astype("float64"))
+
+        elif var == "surface_terrain":
+            X[:, j] = users["field_surface"].values
+
+        elif var == "l_surface_terrain":
+            X[:, j] = np.log(users["field_surface"].values.astype("float64"))
+
+        elif var == "dependance": 
+            X[:, j] = users["dependance"].values
+
+        elif last_trend_prices is not None and var in last_trend_prices.keys():
+            X[:, j] = last_trend_prices[var]
+
+        elif "trimestre" in var:
+            X[:, j] = 1 if quarter in var else 0
+
+        elif "mois" in var:
+            X[:, j] = 1 if month in var else 0
+
+        else: 
+            X[:, j] = imputed_values[var]
+
+            if exact.any(): 
+                X[exact, j] = closest.loc[exact, var].values
+
+    return selected_features, X
+
+def get_predicted_prices(model: CustomRegressor, X: np.ndarray) -> np.ndarray: 
+    """Description. Predict prices of several real estates from model in one call."""
+
+    y_pred = model.predict(X)
+    prices_pred = np.round(np.exp(y_pred)) 
+    return prices_pred
+
 def get_predicted_price(model: CustomRegressor, X: np.ndarray) -> float: 
     """Description. Predict real estate's price from model.
     
@@ -32,7 +32,7 @@ class CustomRegressor(BaseEstimator):
             y (np.ndarray): The target. Defaults to None.
             **kwargs (Dict): Additional arguments to pass to the estimator."""
         
-        self.estimator.fit(X, y)
+        self.estimator.fit(X, y, **kwargs)
         return self
 
     def predict(self, X: np.ndarray, y: Optional[np.ndarray]=None) -> np.ndarray:
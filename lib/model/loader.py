@@ -1,9 +1,39 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 import pickle as pkl
+import numpy as np
+import joblib
+import json
 import os
 
+from lib.dataset.cache import hash_file
+
 from .estimator import CustomRegressor
 
+ARTIFACT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+PREPROCESSOR_NAME = "preprocessor.json"
+
+def get_model_name(estimator_name: str, version: int, geo_area: str, property_type: str) -> str: 
+    """Description. Return name of saved model (without extension)."""
+
+    return f"{estimator_name}-{geo_area}-{property_type}-v{version}".lower()
+
+def is_xgboost(estimator) -> bool: 
+    """Description. Check if estimator comes from xgboost library."""
+
+    return estimator.__class__.__module__.split(".")[0] == "xgboost"
+
+def to_builtin(x): 
+    """Description. Convert numpy scalars and arrays to python objects for json serialization."""
+
+    if isinstance(x, np.generic): 
+        return x.item()
+    
+    if isinstance(x, np.ndarray): 
+        return x.tolist()
+
+    raise TypeError(f"Object of type {x.__class__.__name__} is not JSON serializable")
+
 def save_model(
     path: str,
     model: CustomRegressor, 
@@ -11,7 +41,9 @@ def save_model(
     metrics: Dict, 
     version: int, 
     geo_area: str, 
-    property_type: str
+    property_type: str, 
+    artifact: bool=True, 
+    preprocessor: Optional[Dict]=None
 ) -> None:
     """Description. 
     Save CustomRegressor model and names of features used to train model.
@@ -23,11 +55,24 @@ def save_model(
         metrics (Dict): dictionary of metrics.
         version (int): model version.
         geo_area (str): geo area on which model was trained.
-        property_type (str): property type for which model was trained."""
+        property_type (str): property type for which model was trained.
+        artifact (bool): whether to save model as artifact directory or as legacy pickle file. Defaults to True.
+        preprocessor (Optional[Dict]): fitted preprocessor (see lib.inference.preprocessor.AreaPreprocessor.to_dict). 
+            Defaults to None.
+        
+    Details: artifact directory contains the estimator (native xgboost booster model.ubj or 
+    uncompressed joblib dump model.joblib), manifest.json with feature names, metrics and checksum 
+    and preprocessor.json if a fitted preprocessor is provided."""
 
     estimator = model.estimator.__class__.__name__
-    file_name = f"{estimator}-{geo_area}-{property_type}-v{version}.pkl".lower()
-    file_path = f"{path}/{file_name}"
+    model_name = get_model_name(estimator, version, geo_area, property_type)
+
+    if artifact: 
+        file_path = save_artifact(f"{path}/{model_name}", model, feature_names, metrics, preprocessor)
+        print(f"{estimator} and feature names saved at {file_path}")
+        return 
+
+    file_path = f"{path}/{model_name}.pkl"
 
     to_save = {
         "model": model,
@@ -35,17 +80,130 @@ def save_model(
         "metrics": metrics, 
     }
 
+    if preprocessor is not None: 
+        to_save["preprocessor"] = preprocessor
+
     with open(file_path, "wb") as f: 
         pkl.dump(to_save, f)
 
     print(f"{estimator} and feature names saved at {file_path}")
 
-def load_model(
+def save_artifact(
+    artifact_dir: str, 
+    model: CustomRegressor, 
+    feature_names: List[str], 
+    metrics: Dict, 
+    preprocessor: Optional[Dict]=None
+) -> str: 
+    """Description. Save estimator, manifest and fitted preprocessor (if any) in artifact directory and return its path."""
+
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    if is_xgboost(model.estimator): 
+        model_file = "model.ubj"
+        model.estimator.save_model(f"{artifact_dir}/{model_file}")
+    else: 
+        model_file = "model.joblib"
+        joblib.dump(model, f"{artifact_dir}/{model_file}")
+
+    manifest = {
+        "format_version": ARTIFACT_VERSION, 
+        "estimator": model.estimator.__class__.__name__, 
+        "model_file": model_file, 
+        "sha256": hash_file(f"{artifact_dir}/{model_file}"), 
+        "feature_names": list(feature_names), 
+        "metrics": metrics
+    }
+
+    if preprocessor is not None: 
+        with open(f"{artifact_dir}/{PREPROCESSOR_NAME}", "w") as f: 
+            json.dump(preprocessor, f, default=to_builtin)
+
+        manifest["preprocessor_file"] = PREPROCESSOR_NAME
+        manifest["preprocessor_sha256"] = hash_file(f"{artifact_dir}/{PREPROCESSOR_NAME}")
+
+    with open(f"{artifact_dir}/{MANIFEST_NAME}", "w") as f: 
+        json.dump(manifest, f, default=to_builtin, indent=2)
+
+    return artifact_dir
+
+def load_manifest(
     path: str,
     estimator_name: str, 
     version: int, 
     geo_area: str, 
     property_type: str
+) -> Optional[Dict]:
+    """Description. Load manifest of artifact (estimator name, feature names, metrics, checksum) without loading model.
+    
+    Returns:
+        Optional[Dict]: manifest or None if no artifact has been saved."""
+
+    manifest_path = f"{path}/{get_model_name(estimator_name, version, geo_area, property_type)}/{MANIFEST_NAME}"
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r") as f: 
+        manifest = json.load(f)
+
+    if manifest["format_version"] > ARTIFACT_VERSION: 
+        raise ValueError(f"Artifact format version {manifest['format_version']} is not supported (max {ARTIFACT_VERSION}).")
+
+    return manifest
+
+def load_preprocessor(artifact_dir: str, manifest: Dict, verify: bool=True) -> Optional[Dict]: 
+    """Description. Load fitted preprocessor of artifact directory or None if model has been saved without preprocessor.
+    
+    Details: if verify, preprocessor file is checked against manifest checksum (manifests written before 
+    preprocessor checksums have none)."""
+
+    if "preprocessor_file" not in manifest: 
+        return None
+
+    file_path = f"{artifact_dir}/{manifest['preprocessor_file']}"
+
+    if verify and "preprocessor_sha256" in manifest and hash_file(file_path) != manifest["preprocessor_sha256"]: 
+        raise ValueError(f"Checksum of {file_path} does not match manifest.")
+
+    with open(file_path, "r") as f: 
+        return json.load(f)
+
+def load_artifact(artifact_dir: str, manifest: Dict, mmap_mode: Optional[str]="r", verify: bool=True) -> CustomRegressor: 
+    """Description. Load estimator of artifact directory.
+    
+    Args:
+        artifact_dir (str): path to artifact directory.
+        manifest (Dict): manifest of artifact.
+        mmap_mode (Optional[str]): memory-map mode of numpy arrays of joblib dumps. Defaults to "r".
+        verify (bool): whether to check model file against manifest checksum. Defaults to True.
+        
+    Returns:
+        CustomRegressor: loaded model."""
+
+    file_path = f"{artifact_dir}/{manifest['model_file']}"
+
+    if verify and hash_file(file_path) != manifest["sha256"]: 
+        raise ValueError(f"Checksum of {file_path} does not match manifest.")
+
+    if file_path.endswith(".ubj") or file_path.endswith(".json"): 
+        import xgboost
+
+        estimator = getattr(xgboost, manifest["estimator"])()
+        estimator.load_model(file_path)
+
+        return CustomRegressor(estimator)
+
+    return joblib.load(file_path, mmap_mode=mmap_mode)
+
+def load_model(
+    path: str,
+    estimator_name: str, 
+    version: int, 
+    geo_area: str, 
+    property_type: str, 
+    mmap_mode: Optional[str]="r", 
+    verify: bool=True
 ) -> Dict:
     """Description. Load CustomRegressor model and names of features used to train model.
     
@@ -55,12 +213,33 @@ def load_model(
         version (int): model version.
         geo_area (str): geo area on which model was trained.
         property_type (str): property type for which model was trained.
+        mmap_mode (Optional[str]): memory-map mode of numpy arrays of joblib dumps. Defaults to "r".
+        verify (bool): whether to check model and preprocessor files against manifest checksums. Defaults to True.
         
     Returns:
-        Dict: loaded model, feature names and metrics."""
+        Dict: loaded model, feature names, metrics and fitted preprocessor (None if not saved).
+        
+    Details: artifact directory is used if it exists, legacy pickle file otherwise."""
+
+    model_name = get_model_name(estimator_name, version, geo_area, property_type)
+    manifest = load_manifest(path, estimator_name, version, geo_area, property_type)
+
+    if manifest is not None: 
+        artifact_dir = f"{path}/{model_name}"
+
+        to_load = {
+            "model": load_artifact(artifact_dir, manifest, mmap_mode, verify),
+            "feature_names": manifest["feature_names"], 
+            "metrics": manifest["metrics"], 
+            "estimator": manifest["estimator"], 
+            "preprocessor": load_preprocessor(artifact_dir, manifest, verify)
+        }
 
-    file_name = f"{estimator_name}-{geo_area}-{property_type}-v{version}.pkl".lower()
-    file_path = f"{path}{file_name}"
+        print(f"Succesfully loaded {estimator_name}, feature names and metrics from {artifact_dir}.")
+
+        return to_load
+
+    file_path = f"{path}{model_name}.pkl"
 
     if not os.path.exists(file_path):
         to_load = None
@@ -71,4 +250,30 @@ def load_model(
 
         print(f"Succesfully loaded {estimator_name}, feature names and metrics from {file_path}.")
 
-    return to_load
\ No newline at end of file
+    return to_load
+
+def convert_to_artifact(
+    path: str,
+    estimator_name: str, 
+    version: int, 
+    geo_area: str, 
+    property_type: str
+) -> Optional[str]:
+    """Description. Convert legacy pickle file to artifact directory and return its path (None if no pickle file)."""
+
+    model_name = get_model_name(estimator_name, version, geo_area, property_type)
+    file_path = f"{path}/{model_name}.pkl"
+
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, "rb") as f: 
+        to_load = pkl.load(f)
+
+    return save_artifact(
+        f"{path}/{model_name}", 
+        to_load["model"], 
+        to_load["feature_names"], 
+        to_load["metrics"], 
+        to_load.get("preprocessor")
+    )
@@ -1,19 +1,31 @@
 import sqlalchemy
+import optuna
 from optuna import Trial
 from optuna.pruners import BasePruner
 from optuna.study.study import Study
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 
 import numpy as np 
 from tqdm import tqdm
 
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+import time
+import os
+
+from lib.dataset.cache import save_array, load_array
+
 from .estimator import CustomRegressor
+from sklearn.base import clone
 from sklearn.metrics import mean_absolute_percentage_error
 
 from torch.utils.data import DataLoader
 import torch 
 from torch.optim.lr_scheduler import ExponentialLR
 
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, Callable
 
 from .estimator import MLP
 
@@ -68,6 +80,134 @@ def median_absolute_percentage_error(y_true: np.ndarray, y_pred: np.ndarray) ->
     mdape = np.median(np.abs((y_true - y_pred) / y_true))
     return mdape
 
+def get_metric_fun(metric: str, to_prices: bool) -> Callable: 
+    """Description. Return metric function comparing true and predicted values (converted to prices if to_prices)."""
+
+    if metric not in ["mdape", "mape"]:
+        raise ValueError(f"metric must be 'mdape' or 'mape', got {metric}.")
+
+    elif metric == "mape":
+        fun = mean_absolute_percentage_error
+    
+    else: 
+        fun = median_absolute_percentage_error
+
+    def metric_fun(y_true: np.ndarray, y_pred: np.ndarray) -> float: 
+        if to_prices:
+            y_true = np.exp(y_true)
+            y_pred = np.exp(y_pred)
+
+        return fun(y_true, y_pred)
+
+    metric_fun.__name__ = metric
+
+    return metric_fun
+
+def make_xgb_pruning_callback(trial: Trial, metric_name: str, report_every: int=10): 
+    """Description. Return xgboost callback reporting validation metric to optuna every report_every rounds.
+    
+    Details: trial is pruned (optuna.TrialPruned is raised) as soon as the pruner of the study decides so."""
+
+    from xgboost.callback import TrainingCallback
+
+    class XGBPruningCallback(TrainingCallback): 
+
+        def after_iteration(self, model, epoch: int, evals_log: Dict) -> bool: 
+            if (epoch + 1) % report_every != 0: 
+                return False
+
+            value = evals_log["validation_0"][metric_name][-1]
+            if isinstance(value, tuple): 
+                value = value[0]
+
+            trial.report(float(value), step=epoch + 1)
+
+            if trial.should_prune(): 
+                raise optuna.TrialPruned(f"Trial pruned at boosting round {epoch + 1}.")
+
+            return False
+
+    return XGBPruningCallback()
+
+def split_validation_tail(X_tr: np.ndarray, y_tr: np.ndarray, validation_prop: float=.2) -> Tuple: 
+    """Description. Split training set sorted by date into older rows and most recent rows used as validation set.
+    
+    Returns:
+        Tuple: training features, training target, validation features and validation target."""
+
+    n_valid = max(1, int(X_tr.shape[0] * validation_prop))
+
+    return X_tr[:-n_valid], y_tr[:-n_valid], X_tr[-n_valid:], y_tr[-n_valid:]
+
+def fit_xgb_with_pruning(
+    trial: Trial, 
+    regressor: CustomRegressor, 
+    X_tr: np.ndarray, 
+    y_tr: np.ndarray, 
+    metric_fun: Callable, 
+    early_stopping_rounds: Optional[int]=50, 
+    report_every: int=10, 
+    validation_prop: float=.2
+) -> CustomRegressor: 
+    """Description. Fit XGBRegressor evaluating metric_fun on validation set after each boosting round.
+    
+    Details: validation set is the most recent validation_prop of the training set (sorted by date), test set 
+    is never seen before scoring. Learning curve is reported to optuna and training stops after 
+    early_stopping_rounds rounds without improvement. Number of rounds of best iteration is stored in 
+    "n_estimators" user attribute."""
+
+    X_tr, y_tr, X_val, y_val = split_validation_tail(X_tr, y_tr, validation_prop)
+
+    regressor.estimator.set_params(
+        eval_metric=metric_fun, 
+        early_stopping_rounds=early_stopping_rounds, 
+        callbacks=[make_xgb_pruning_callback(trial, metric_fun.__name__, report_every)]
+    )
+
+    regressor.fit(X_tr, y_tr, eval_set=[(X_val, y_val)], verbose=False)
+
+    if early_stopping_rounds is not None: 
+        trial.set_user_attr("n_estimators", int(regressor.estimator.best_iteration) + 1)
+
+    return regressor
+
+def fit_rf_with_pruning(
+    trial: Trial, 
+    regressor: CustomRegressor, 
+    X_tr: np.ndarray, 
+    y_tr: np.ndarray, 
+    metric_fun: Callable, 
+    batch_size: int=50, 
+    validation_prop: float=.2
+) -> CustomRegressor: 
+    """Description. Grow RandomForestRegressor by batches of batch_size trees using warm start.
+    
+    Details: metric_fun is evaluated on validation set (most recent validation_prop of the training set) and 
+    reported to optuna after each batch. Out-of-bag score, recomputed on all trees at each batch, is disabled."""
+
+    X_tr, y_tr, X_val, y_val = split_validation_tail(X_tr, y_tr, validation_prop)
+
+    n_estimators = regressor.estimator.n_estimators
+    regressor.estimator.set_params(warm_start=True, oob_score=False)
+
+    for n_trees in range(min(batch_size, n_estimators), n_estimators + batch_size, batch_size): 
+        n_trees = min(n_trees, n_estimators)
+
+        regressor.estimator.set_params(n_estimators=n_trees)
+        regressor.fit(X_tr, y_tr)
+
+        trial.report(metric_fun(y_val, regressor.predict(X_val)), step=n_trees)
+
+        if trial.should_prune(): 
+            raise optuna.TrialPruned(f"Trial pruned at {n_trees} trees.")
+
+        if n_trees == n_estimators: 
+            break
+
+    regressor.estimator.set_params(warm_start=False)
+
+    return regressor
+
 def optuna_objective(
     trial: Trial,
     regressor: CustomRegressor, 
@@ -76,85 +216,301 @@ def optuna_objective(
     X_te: np.ndarray, 
     y_te: np.ndarray,
     metric: str="mdape", 
-    to_prices: bool = True
+    to_prices: bool = True, 
+    early_stopping_rounds: Optional[int]=50, 
+    report_every: int=10, 
+    batch_size: int=50, 
+    validation_prop: float=.2
 ) -> float:
     """Description.
     Objective function to optimize hyperparams of CustomRegressor model using optuna.
 
     Args:
         trial (Trial): optuna trial
+        regressor (CustomRegressor): CustomRegressor model, cloned for each trial
         X_tr (np.ndarray): training features
         y_tr (np.ndarray): training target
         X_te (np.ndarray): test features
         y_te (np.ndarray): test target
         metric (str): metric to optimize (default: "mdape")
         to_prices (bool): convert target to prices (default: True)
+        early_stopping_rounds (Optional[int]): XGBRegressor rounds without improvement before stopping (default: 50)
+        report_every (int): number of XGBRegressor rounds between two reports to optuna (default: 10)
+        batch_size (int): number of RandomForestRegressor trees between two reports to optuna (default: 50)
+        validation_prop (float): proportion of most recent training rows used for early stopping and pruning (default: .2)
 
     Returns:
         float: median absolute percentage error between true and predicted values 
-            ('valeur_fonciere' or 'l_valeur_fonciere') depending on to_prices."""
-
-    if metric not in ["mdape", "mape"]:
-        raise ValueError(f"metric must be 'mdape' or 'mape', got {metric}.")
-
-    elif metric == "mape":
-        metric_fun = mean_absolute_percentage_error
-    
-    else: 
-        metric_fun = median_absolute_percentage_error
+            ('valeur_fonciere' or 'l_valeur_fonciere') depending on to_prices.
+            
+    Details: learning curve (metric on validation set per boosting round or per batch of trees) is reported 
+    to optuna so that the pruner of the study can stop hopeless trials. Validation set is the most recent 
+    part of the training set, so that test set is only used to score the trial."""
 
+    metric_fun = get_metric_fun(metric, to_prices)
 
     params = generate_param_grid(trial, regressor)
 
+    regressor = CustomRegressor(clone(regressor.estimator))
     regressor.estimator.set_params(**params)
-    regressor.fit(X_tr, y_tr)
 
-    y_pred = regressor.predict(X_te)
+    estimator_name = regressor.estimator.__class__.__name__
+
+    if estimator_name == "XGBRegressor": 
+        fit_xgb_with_pruning(trial, regressor, X_tr, y_tr, metric_fun, early_stopping_rounds, report_every, validation_prop)
+
+    elif estimator_name == "RandomForestRegressor": 
+        fit_rf_with_pruning(trial, regressor, X_tr, y_tr, metric_fun, batch_size, validation_prop)
+
+    else: 
+        regressor.fit(X_tr, y_tr)
 
-    if to_prices:
-        y_te = np.exp(y_te)
-        y_pred = np.exp(y_pred)
+    y_pred = regressor.predict(X_te)
 
     result = metric_fun(y_te, y_pred)
     return result
 
+def get_value_at_step(intermediate_values: Dict, step: int) -> Optional[float]: 
+    """Description. Return intermediate value reported at step or at closest previous step (None if no value)."""
+
+    steps = [s for s in intermediate_values.keys() if s <= step]
+
+    if len(steps) == 0: 
+        return None
+
+    return intermediate_values[max(steps)]
+
 class OptimPruner(BasePruner):
-    """Description. Stop optuna optimisation process if no improvement after n trials.
+    """Description. Prune trials worse than best trial at the same step.
     
     Args:
         n_warmup_trials (int): number of trials to warm up the process
-        n_trials_to_prune (int): number of trials to stop the process if no improvement"""
+        n_trials_to_prune (Optional[int]): if provided, trials are only pruned when best trial is older than 
+            n_trials_to_prune trials (no improvement since). Defaults to None: once warm-up is over, every trial 
+            is compared to the learning curve of best trial.
+        n_warmup_steps (int): number of steps (boosting rounds or trees) before a trial can be pruned"""
 
-    def __init__(self, n_warmup_trials: int, n_trials_to_prune: int):
+    def __init__(self, n_warmup_trials: int, n_trials_to_prune: Optional[int]=None, n_warmup_steps: int=0):
         self.n_warmup_trials = n_warmup_trials
         self.n_trials_to_prune = n_trials_to_prune
+        self.n_warmup_steps = n_warmup_steps
 
     def __repr__(self) -> str:
-        return f"OptimPruner(n_warmup_trials={self.n_warmup_trials}, n_trials_to_prune={self.n_trials_to_prune})"
+        return f"OptimPruner(n_warmup_trials={self.n_warmup_trials}, n_trials_to_prune={self.n_trials_to_prune}, n_warmup_steps={self.n_warmup_steps})"
 
     def prune(self, study: Study, trial: Trial) -> bool:
-        """Description. Stop optuna optimisation process if no improvement after n trials.
+        """Description. Prune trial if its last reported value is worse than the value of best trial at the same step 
+        (and best trial is older than n_trials_to_prune trials if provided).
         
         Args:
             study (Study): optuna study with history of all trials
             trial (Trial): optuna trial."""
-        
-        if study.best_trial.number > trial.number - self.n_trials_to_prune:
+
+        step = trial.last_step
+        if step is None or step < self.n_warmup_steps: 
             return False
 
         if trial.number < self.n_warmup_trials:
             return False
 
-        best_value = study.best_trial.intermediate_values.get("mape")
-        if best_value is None:
+        try: 
+            best_trial = study.best_trial
+        except ValueError: 
+            # no completed trial yet
+            return False
+        
+        if self.n_trials_to_prune is not None and best_trial.number > trial.number - self.n_trials_to_prune:
             return False
 
-        value = trial.intermediate_values.get("mape")
-        if value is None:
+        best_value = get_value_at_step(best_trial.intermediate_values, step)
+        if best_value is None:
             return False
 
+        value = trial.intermediate_values[step]
+
         return value >= best_value
 
+def get_storage(
+    storage_path: str, 
+    heartbeat_interval: int=60, 
+    grace_period: Optional[int]=None, 
+    max_retry: int=3
+) -> RDBStorage: 
+    """Description. Return optuna storage in a local SQLite file shared by several worker processes.
+    
+    Args:
+        storage_path (str): path to SQLite file, e.g. backup/__optuna/db.sqlite3.
+        heartbeat_interval (int): interval (s) between heartbeats of running trials. Defaults to 60.
+        grace_period (Optional[int]): delay (s) after which a running trial without heartbeat is failed. 
+            Defaults to 2 * heartbeat_interval.
+        max_retry (int): number of times parameters of a failed trial are retried. Defaults to 3.
+        
+    Details: trials of killed workers are detected by their missing heartbeat and retried when the study is resumed."""
+
+    storage = RDBStorage(
+        url=f"sqlite:///{storage_path}", 
+        engine_kwargs={"connect_args": {"timeout": 300}}, 
+        heartbeat_interval=heartbeat_interval, 
+        grace_period=grace_period, 
+        failed_trial_callback=RetryFailedTrialCallback(max_retry=max_retry)
+    )
+
+    return storage
+
+def timed_objective(objective: Callable) -> Callable: 
+    """Description. Wrap objective function to store wall time (s) and process id of each trial as user attributes."""
+
+    def wrapper(trial: Trial) -> float: 
+        start = time.perf_counter()
+
+        try: 
+            return objective(trial)
+        finally: 
+            trial.set_user_attr("wall_time", time.perf_counter() - start)
+            trial.set_user_attr("pid", os.getpid())
+
+    return wrapper
+
+def run_study_worker(
+    storage_path: str, 
+    study_name: str, 
+    regressor: CustomRegressor, 
+    data_dir: str, 
+    n_trials: int, 
+    timeout: Optional[float]=None, 
+    metric: str="mdape", 
+    to_prices: bool=True, 
+    heartbeat_interval: int=60, 
+    pruner: Optional[BasePruner]=None, 
+    n_jobs: Optional[int]=None
+) -> int: 
+    """Description. Run trials of a shared study in current process until the study has n_trials finished trials.
+    
+    Details: training and test sets are memory-mapped from .npy files of data_dir (sparse matrices are loaded from .npz files). 
+    Pruners are not stored by optuna, so the pruner is passed to each worker when the study is loaded. If n_jobs is provided, 
+    the number of threads of the estimator is limited to n_jobs.
+    
+    Returns:
+        int: number of trials run by the worker."""
+
+    regressor = CustomRegressor(clone(regressor.estimator))
+
+    if n_jobs is not None and "n_jobs" in regressor.estimator.get_params(): 
+        regressor.estimator.set_params(n_jobs=n_jobs)
+
+    X_tr, y_tr, X_te, y_te = [
+        load_array(f"{data_dir}/{name}", mmap_mode="r")
+        for name in ("X_tr", "y_tr", "X_te", "y_te")
+    ]
+
+    storage = get_storage(storage_path, heartbeat_interval)
+    study = optuna.load_study(study_name=study_name, storage=storage, pruner=pruner)
+
+    objective = timed_objective(
+        lambda trial: optuna_objective(trial, regressor, X_tr, y_tr, X_te, y_te, metric, to_prices)
+    )
+
+    n_before = len(study.trials)
+
+    study.optimize(
+        func=objective, 
+        timeout=timeout, 
+        callbacks=[MaxTrialsCallback(n_trials, states=(TrialState.COMPLETE, TrialState.PRUNED))]
+    )
+
+    return len(study.trials) - n_before
+
+def run_parallel_study(
+    study_name: str, 
+    storage_path: str, 
+    regressor: CustomRegressor, 
+    X_tr: np.ndarray, 
+    y_tr: np.ndarray, 
+    X_te: np.ndarray, 
+    y_te: np.ndarray,
+    n_trials: int, 
+    n_workers: Optional[int]=None, 
+    timeout: Optional[float]=None, 
+    metric: str="mdape", 
+    to_prices: bool=True, 
+    pruner: Optional[BasePruner]=None, 
+    heartbeat_interval: int=60
+) -> Study: 
+    """Description. Optimize hyperparams of CustomRegressor with several worker processes sharing one SQLite storage.
+    
+    Args:
+        study_name (str): name of optuna study, an existing study with the same name is resumed.
+        storage_path (str): path to SQLite file shared by workers.
+        regressor (CustomRegressor): CustomRegressor model, copied in each worker.
+        X_tr (np.ndarray): training features
+        y_tr (np.ndarray): training target
+        X_te (np.ndarray): test features
+        y_te (np.ndarray): test target
+        n_trials (int): total number of finished trials of the study, including trials of previous runs.
+        n_workers (Optional[int]): number of worker processes. Defaults to cpu count. Estimators of the workers 
+            share the cores: each one runs with cpu count // n_workers threads.
+        timeout (Optional[float]): maximum duration (s) of each worker. Defaults to None.
+        metric (str): metric to optimize (default: "mdape")
+        to_prices (bool): convert target to prices (default: True)
+        pruner (Optional[BasePruner]): optuna pruner used by every worker. Defaults to None (MedianPruner).
+        heartbeat_interval (int): interval (s) between heartbeats of running trials. Defaults to 60.
+        
+    Returns:
+        Study: optuna study, wall time of each trial is stored in its "wall_time" user attribute.
+        
+    Example:
+    
+    >>> study = run_parallel_study("optim-paris-flats-xgb-v0", "../backup/__optuna/db.sqlite3", regressor, X_tr, y_tr, X_te, y_te, n_trials=200, n_workers=16)
+    >>> study.trials_dataframe()[["number", "value", "user_attrs_wall_time"]]"""
+
+    n_cpus = os.cpu_count() or 1
+
+    if n_workers is None: 
+        n_workers = n_cpus
+
+    n_jobs = max(1, n_cpus // n_workers)
+
+    storage = get_storage(storage_path, heartbeat_interval)
+    study = optuna.create_study(
+        direction="minimize", 
+        storage=storage, 
+        study_name=study_name, 
+        pruner=pruner, 
+        load_if_exists=True
+    )
+
+    # trials of workers killed during a previous run are failed and retried
+    optuna.storages.fail_stale_trials(study)
+
+    with tempfile.TemporaryDirectory() as data_dir: 
+
+        for name, array in (("X_tr", X_tr), ("y_tr", y_tr), ("X_te", X_te), ("y_te", y_te)): 
+            save_array(f"{data_dir}/{name}", array)
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor: 
+            futures = [
+                executor.submit(
+                    run_study_worker, 
+                    storage_path, 
+                    study_name, 
+                    regressor, 
+                    data_dir, 
+                    n_trials, 
+                    timeout, 
+                    metric, 
+                    to_prices, 
+                    heartbeat_interval, 
+                    pruner, 
+                    n_jobs
+                )
+                for _ in range(n_workers)
+            ]
+
+            for future in futures: 
+                future.result()
+
+    return optuna.load_study(study_name=study_name, storage=storage)
+
 def optimize_mlp(
     model: MLP, 
     train_loader: DataLoader, 
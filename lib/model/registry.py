@@ -0,0 +1,252 @@
+"""Description. Registry of trained models kept in memory with LRU eviction."""
+
+from lib.enums import ESTIMATORS
+
+from .loader import load_model, get_model_name
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import threading
+import time
+import os
+
+def get_model_size(path: str, estimator_name: str, version: int, geo_area: str, property_type: str) -> int:
+    """Description. Return size in bytes of saved model (artifact directory or legacy pickle file)."""
+
+    model_name = get_model_name(estimator_name, version, geo_area, property_type)
+    artifact_dir = f"{path}/{model_name}"
+
+    if os.path.isdir(artifact_dir):
+        return sum(entry.stat().st_size for entry in os.scandir(artifact_dir) if entry.is_file())
+
+    file_path = f"{path}/{model_name}.pkl"
+
+    if os.path.exists(file_path):
+        return os.path.getsize(file_path)
+
+    return 0
+
+class ModelRegistry:
+    """Description. Load models of (geo_area, property_type) couples once and keep them in a bounded LRU cache.
+
+    Details:
+        - preloaded models are pinned and never evicted.
+        - other models are loaded on first request and evicted (least recently used first) when
+        the size of cached models exceeds the memory budget. Size of a model is estimated by its size on disk.
+        - a model larger than the memory budget is still loaded and cached alone.
+
+    Args:
+        model_dir (str): path to directory containing trained models.
+        max_bytes (Optional[int]): memory budget in bytes, unbounded if None.
+        max_models (Optional[int]): maximum number of cached models, unbounded if None.
+        version (int): version of models. Defaults to 0.
+        estimators (Optional[Dict]): estimator name per property type and geographical area. Defaults to ESTIMATORS.
+
+    Example:
+
+    >>> from lib.model.registry import ModelRegistry
+    >>> registry = ModelRegistry(model_dir="./backup/models/", max_bytes=2 * 1024 ** 3)
+    >>> registry.preload([("Paris", "flats"), ("Lyon", "flats")])
+    >>> model_loader = registry.get("Bordeaux", "flats")
+    >>> registry.stats()
+    {'hits': 0, 'misses': 1, 'loads': 3, 'evictions': 0, 'load_time': 1.84, 'n_models': 3, 'n_bytes': 452983811}"""
+
+    def __init__(
+        self,
+        model_dir: str,
+        max_bytes: Optional[int]=None,
+        max_models: Optional[int]=None,
+        version: int=0,
+        estimators: Optional[Dict]=None
+    ):
+        self.model_dir = model_dir
+        self.max_bytes = max_bytes
+        self.max_models = max_models
+        self.version = version
+        self.estimators = ESTIMATORS if estimators is None else estimators
+
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._pinned = set()
+
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_time = 0.
+
+    def __repr__(self) -> str:
+        return f"ModelRegistry(model_dir={self.model_dir}, n_models={len(self._models)}, n_bytes={self.n_bytes})"
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def __contains__(self, key: Tuple) -> bool:
+        return self.get_key(*key) in self._models
+
+    @property
+    def n_bytes(self) -> int:
+        """Description. Estimated size of cached models."""
+
+        return sum(self._sizes.values())
+
+    def get_key(self, geo_area: str, property_type: str) -> Tuple:
+        """Description. Return cache key of (geo_area, property_type) couple."""
+
+        return geo_area.lower(), property_type
+
+    def list_models(self) -> List[Tuple]:
+        """Description. List (geo_area, property_type) couples with an estimator."""
+
+        return [
+            (geo_area, property_type)
+            for property_type, geo_areas in self.estimators.items()
+            for geo_area in geo_areas
+        ]
+
+    def get_estimator_name(self, geo_area: str, property_type: str) -> Optional[str]:
+        """Description. Return name of estimator trained for (geo_area, property_type) or None."""
+
+        return self.estimators.get(property_type, {}).get(geo_area.lower())
+
+    def load(self, geo_area: str, property_type: str) -> Tuple:
+        """Description. Load model from disk without caching it and return model loader and size."""
+
+        estimator_name = self.get_estimator_name(geo_area, property_type)
+
+        if estimator_name is None:
+            return None, 0
+
+        start = time.perf_counter()
+
+        model_loader = load_model(
+            path=self.model_dir,
+            estimator_name=estimator_name,
+            version=self.version,
+            geo_area=geo_area,
+            property_type=property_type
+        )
+
+        size = get_model_size(self.model_dir, estimator_name, self.version, geo_area, property_type)
+
+        with self._lock:
+            self.loads += 1
+            self.load_time += time.perf_counter() - start
+
+        return model_loader, size
+
+    def get(self, geo_area: str, property_type: str) -> Optional[Dict]:
+        """Description. Return model loader of (geo_area, property_type), load it if needed.
+
+        Returns:
+            Optional[Dict]: loaded model, feature names and metrics or None if no model is available."""
+
+        key = self.get_key(geo_area, property_type)
+
+        with self._lock:
+            if key in self._models:
+                self.hits += 1
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            self.misses += 1
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # one thread loads the model, the others wait for it
+        with loading:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+
+            model_loader, size = self.load(geo_area, property_type)
+
+            if model_loader is not None:
+                self.put(key, model_loader, size)
+
+        with self._lock:
+            self._loading.pop(key, None)
+
+        return model_loader
+
+    def put(self, key: Tuple, model_loader: Dict, size: int, pin: bool=False):
+        """Description. Add model loader to cache and evict least recently used models above budget."""
+
+        with self._lock:
+            self._models[key] = model_loader
+            self._sizes[key] = size
+
+            if pin:
+                self._pinned.add(key)
+
+            self.__evict(keep=key)
+
+    def __evict(self, keep: Tuple):
+        """Description. Evict least recently used unpinned models until cache fits in budget."""
+
+        for key in list(self._models.keys()):
+
+            over_bytes = self.max_bytes is not None and self.n_bytes > self.max_bytes
+            over_models = self.max_models is not None and len(self._models) > self.max_models
+
+            if not over_bytes and not over_models:
+                break
+
+            if key == keep or key in self._pinned:
+                continue
+
+            del self._models[key]
+            del self._sizes[key]
+            self.evictions += 1
+
+    def preload(self, keys: Optional[List[Tuple]]=None, pin: bool=True):
+        """Description. Eagerly load models of (geo_area, property_type) couples, all models if None.
+
+        Details: preloaded models are pinned by default."""
+
+        if keys is None:
+            keys = self.list_models()
+
+        for geo_area, property_type in keys:
+            model_loader, size = self.load(geo_area, property_type)
+
+            if model_loader is not None:
+                self.put(self.get_key(geo_area, property_type), model_loader, size, pin)
+
+    def evict(self, geo_area: str, property_type: str):
+        """Description. Remove model of (geo_area, property_type) from cache, even if pinned."""
+
+        key = self.get_key(geo_area, property_type)
+
+        with self._lock:
+            self._models.pop(key, None)
+            self._sizes.pop(key, None)
+            self._pinned.discard(key)
+
+    def clear(self):
+        """Description. Remove all models from cache."""
+
+        with self._lock:
+            self._models = OrderedDict()
+            self._sizes = {}
+            self._pinned = set()
+
+    def stats(self) -> Dict:
+        """Description. Return hit, miss, load and eviction counters, total load time (s) and cache size."""
+
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "load_time": self.load_time,
+                "n_models": len(self._models),
+                "n_bytes": self.n_bytes
+            }
+
+        return stats
@@ -0,0 +1,479 @@
+"""Description. Train the models of all (geo_area, property_type) couples in parallel with resumable checkpoints."""
+
+from lib.enums import ESTIMATORS, CITIES
+
+from lib.dataset.loader import load_dvfplus, get_store_dir
+from lib.dataset.build import prepare_dataset, prepare_dummies, add_paris_features
+from lib.dataset.split import temporal_train_test_split, get_feature_vector, get_target_vector, stack_matrices
+from lib.dataset.feature_selection import compute_mutual_info, compute_rf_importances, select_important_features, screen_features
+from lib.dataset.utils import get_categorical_vars, get_most_frequent_levels, downcast_indicators
+from lib.dataset.cache import hash_table, cached_training_set
+
+from .estimator import CustomRegressor
+from .optimize import optuna_objective, OptimPruner
+from .results import compute_metrics
+from .loader import save_model, is_xgboost
+
+from lib.inference.preprocessor import AreaPreprocessor
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from pandas.core.frame import DataFrame
+from threadpoolctl import threadpool_limits
+
+import scipy.sparse as sp
+import numpy as np
+
+import traceback
+import optuna
+import json
+import time
+import os
+
+PREPROC_ARGS = {
+    "numeric_filters": {
+        "nombre_pieces_principales": (1, 6),
+        "surface_reelle_bati": (18, 120),
+        "valeur_fonciere_m2": (1000, 7000)
+    },
+    "na_threshold": 0.5,
+    "mov_av_windows": [7, 14, 30, 90],
+    "neighborhood_var": "nom_commune"
+}
+
+# continuous variables which have a counterpart expressed in log scale
+TO_REMOVE = [
+    "valeur_fonciere",
+    "valeur_fonciere_m2",
+    "surface_reelle_bati",
+    "surface_terrain",
+    "hauteur_mean",
+    "altitude_sol_mean",
+    "conso_ener_mean",
+    "estim_ges_mean",
+    "conso_ener_std",
+    "estim_ges_std",
+    "conso_ener_min",
+    "estim_ges_min",
+    "conso_ener_max",
+    "estim_ges_max",
+    "ratio_ges_conso",
+    "distance_transport",
+    "distance_park",
+    "distance_batiment_historique_plus_proche",
+    "nom_commune",
+]
+
+def get_table_name(geo_area: str) -> str:
+    """Description. Return name of DVF+ table of geographical area of ESTIMATORS (city name or department)."""
+
+    for city in CITIES:
+        if city.lower() == geo_area.lower():
+            return city
+
+    return geo_area
+
+def list_training_jobs(
+    property_types: Optional[List[str]]=None,
+    geo_areas: Optional[List[str]]=None,
+    estimators: Optional[Dict]=None
+) -> List[Dict]:
+    """Description. List training jobs of ESTIMATORS, optionally restricted to some property types and areas."""
+
+    if estimators is None:
+        estimators = ESTIMATORS
+
+    jobs = []
+
+    for property_type, areas in estimators.items():
+
+        if property_types is not None and property_type not in property_types:
+            continue
+
+        for geo_area, estimator_name in areas.items():
+
+            if geo_areas is not None and geo_area not in [area.lower() for area in geo_areas]:
+                continue
+
+            jobs.append({
+                "geo_area": get_table_name(geo_area),
+                "property_type": property_type,
+                "estimator_name": estimator_name
+            })
+
+    return jobs
+
+def get_job_name(job: Dict, version: int) -> str:
+    """Description. Return name of training job used for checkpoint and optuna study."""
+
+    return f"{job['estimator_name']}-{job['geo_area']}-{job['property_type']}-v{version}".lower()
+
+def get_estimator(estimator_name: str, n_threads: int):
+    """Description. Instantiate estimator from its name."""
+
+    if estimator_name == "XGBRegressor":
+        from xgboost import XGBRegressor
+        return XGBRegressor(n_jobs=n_threads)
+
+    elif estimator_name == "RandomForestRegressor":
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(n_jobs=n_threads)
+
+    raise NotImplementedError(f"{estimator_name} not implemented.")
+
+def get_matrix_format(estimator, matrix_format: str) -> str:
+    """Description. Return feature matrix format used to train estimator.
+
+    Details: XGBoost treats entries absent from a sparse matrix as missing values, not as zeros, so a
+    model trained on a CSR matrix would predict differently on the dense vectors used at inference. 
+    Compact float32 arrays are used instead for XGBoost."""
+
+    if matrix_format == "sparse" and is_xgboost(estimator):
+        return "compact"
+
+    return matrix_format
+
+def set_resource_limits(max_memory: Optional[int]=None, n_threads: Optional[int]=None):
+    """Description. Limit address space (bytes) and number of BLAS/OpenMP threads of current process.
+
+    Details: memory limit is only applied on platforms providing the resource module."""
+
+    if n_threads is not None:
+        threadpool_limits(limits=n_threads)
+
+    if max_memory is not None:
+        try:
+            import resource
+        except ImportError:
+            return
+
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+def read_checkpoint(checkpoint_dir: str, job_name: str) -> Optional[Dict]:
+    """Description. Read checkpoint of training job or None if job has never run."""
+
+    file_path = f"{checkpoint_dir}/{job_name}.json"
+
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+def write_checkpoint(checkpoint_dir: str, job_name: str, checkpoint: Dict):
+    """Description. Atomically write checkpoint of training job."""
+
+    file_path = f"{checkpoint_dir}/{job_name}.json"
+
+    with open(f"{file_path}.tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2, default=float)
+
+    os.replace(f"{file_path}.tmp", file_path)
+
+def get_backend(data_dir: str) -> str:
+    """Description. Return DVF+ backend, parquet store is used when it exists."""
+
+    return "parquet" if os.path.exists(get_store_dir(data_dir, "dvf+")) else "zip"
+
+def get_external_files(data_dir: str, geo_area: str) -> List[str]:
+    """Description. Return paths of external data sources added to DVF+ table of geographical area."""
+
+    if geo_area == "Paris":
+        return [f"{data_dir}other/{name}.csv" for name in ("transportation", "parks", "facilities")]
+
+    return []
+
+def load_training_data(data_dir: str, geo_area: str, property_type: str) -> DataFrame:
+    """Description. Load DVF+ table of geographical area with external features for Paris."""
+
+    df = load_dvfplus(
+        zip_dir=data_dir,
+        zip_name="dvf+",
+        geo_area=geo_area,
+        property_type=property_type,
+        backend=get_backend(data_dir)
+    )
+
+    if geo_area == "Paris":
+        df = add_paris_features(df, data_dir)
+
+    return df
+
+def build_training_set(
+    df: DataFrame, 
+    preproc_args: Dict, 
+    select_features: bool=True, 
+    matrix_format: str="dense", 
+    screening: Optional[bool]=None, 
+    n_jobs: int=-1
+) -> Dict:
+    """Description. Preprocess DVF+ table, split it temporally and select features as in sk_regressors notebook.
+
+    Details: in "compact" and "sparse" formats, 0/1 indicators are stored as uint8 columns until the feature 
+    matrices are built as float32 arrays or CSR matrices (see lib.dataset.split.to_matrix).
+    If screening, features are selected with screen_features (subsampled MI and XGBoost gains) instead of
+    random forest importances and MI on the full training set. If None, screening is used above 150000 rows.
+    Screening runs with n_jobs parallel jobs (-1 for all CPUs), set it to the threads of the job in worker processes.
+
+    Returns:
+        Dict: train and test feature matrices and targets, feature names."""
+
+    target = "l_valeur_fonciere"
+
+    df = prepare_dataset(df, target_var=target, print_summary=False, return_var_names=False, **preproc_args)
+
+    categorical_vars = get_categorical_vars(df, n_levels_max=30)
+    categorical_vars.append("baie_orientation")
+    dummy_ref_levels = get_most_frequent_levels(df, categorical_vars)
+    df = prepare_dummies(df, categorical_vars, dummy_ref_levels)
+
+    if matrix_format != "dense":
+        df = downcast_indicators(df, [col for col in df.columns if col != target])
+
+    df.set_index("id_mutation", inplace=True)
+    df.drop(labels=[col for col in TO_REMOVE if col in df.columns], axis=1, inplace=True)
+
+    df_train, df_test, _, _ = temporal_train_test_split(df, date_var="date_mutation", train_prop=.8)
+
+    X_tr, features = get_feature_vector(df_train, return_features=True, target=target, return_df=False, matrix_format=matrix_format)
+    y_tr = get_target_vector(df_train, target=target, return_series=False)
+
+    if screening is None:
+        screening = X_tr.shape[0] > 150000
+
+    if select_features and screening:
+        features = screen_features(X_tr, y_tr, features, threshold="75%", n_jobs=n_jobs)
+
+    elif select_features:
+        importances = [compute_rf_importances(X_tr, y_tr, features)]
+
+        if X_tr.shape[0] <= 150000:
+            importances.append(compute_mutual_info(X_tr.toarray() if sp.issparse(X_tr) else X_tr, y_tr, features))
+
+        features = list(set(sum([select_important_features(values, threshold="75%") for values in importances], [])))
+
+    training_set = {
+        "features": features,
+        "X_tr": get_feature_vector(df_train, features=features, return_df=False, matrix_format=matrix_format),
+        "y_tr": y_tr,
+        "X_te": get_feature_vector(df_test, features=features, return_df=False, matrix_format=matrix_format),
+        "y_te": get_target_vector(df_test, target=target, return_series=False)
+    }
+
+    return training_set
+
+def train_area_model(
+    job: Dict,
+    data_dir: str,
+    model_dir: str,
+    checkpoint_dir: str,
+    version: int=0,
+    n_trials: int=20,
+    timeout: Optional[float]=None,
+    n_threads: int=1,
+    max_memory: Optional[int]=None,
+    preproc_args: Optional[Dict]=None,
+    select_features: bool=True,
+    cache_dir: Optional[str]=None,
+    matrix_format: str="dense",
+    screening: Optional[bool]=None
+) -> Dict:
+    """Description. Train, optimize with optuna and save model of one (geo_area, property_type) couple.
+
+    Details: the model is saved with a preprocessor fitted on the whole DVF+ table (see lib.inference.preprocessor).
+
+    Args:
+        job (Dict): geo_area, property_type and estimator_name.
+        data_dir (str): path to directory containing DVF+ and other data sources.
+        model_dir (str): path to directory where model is saved.
+        checkpoint_dir (str): path to directory containing checkpoints and optuna studies.
+        version (int): model version. Defaults to 0.
+        n_trials (int): total number of optuna trials, trials of a previous run are kept. Defaults to 20.
+        timeout (Optional[float]): maximum duration (s) of optuna optimization. Defaults to None.
+        n_threads (int): number of threads used by estimator. Defaults to 1.
+        max_memory (Optional[int]): maximum memory (bytes) of the process. Defaults to None.
+        preproc_args (Optional[Dict]): arguments of prepare_dataset. Defaults to PREPROC_ARGS.
+        select_features (bool): whether to select features with MI and random forest importances. Defaults to True.
+        cache_dir (Optional[str]): path to cache of training sets keyed by table content and preprocessing arguments. 
+            Defaults to None (no cache).
+        matrix_format (str): "dense", "compact" (float32) or "sparse" (CSR) feature matrices, "sparse" falls back 
+            to "compact" for XGBoost. Defaults to "dense".
+        screening (Optional[bool]): whether to select features with screen_features, used above 150000 training 
+            rows if None. Defaults to None.
+
+    Returns:
+        Dict: checkpoint of the job with status "done" or "failed"."""
+
+    job_name = get_job_name(job, version)
+    checkpoint = {**job, "version": version, "status": "running", "started_at": time.time()}
+    write_checkpoint(checkpoint_dir, job_name, checkpoint)
+
+    try:
+        set_resource_limits(max_memory, n_threads)
+
+        if preproc_args is None:
+            preproc_args = PREPROC_ARGS
+
+        matrix_format = get_matrix_format(get_estimator(job["estimator_name"], n_threads), matrix_format)
+
+        table_hash = None
+        if cache_dir is not None:
+            table_hash = hash_table(
+                data_dir, 
+                "dvf+", 
+                job["geo_area"], 
+                job["property_type"], 
+                get_backend(data_dir), 
+                get_external_files(data_dir, job["geo_area"])
+            )
+
+        training_set = cached_training_set(
+            cache_dir, 
+            table_hash, 
+            {"preproc_args": preproc_args, "select_features": select_features, "matrix_format": matrix_format, "screening": screening}, 
+            lambda: build_training_set(
+                load_training_data(data_dir, job["geo_area"], job["property_type"]), 
+                preproc_args, 
+                select_features, 
+                matrix_format, 
+                screening, 
+                n_jobs=n_threads
+            )
+        )
+
+        X_tr, y_tr = training_set["X_tr"], training_set["y_tr"]
+        X_te, y_te = training_set["X_te"], training_set["y_te"]
+
+        # optuna study is stored on disk so that an interrupted job resumes its trials
+        study = optuna.create_study(
+            direction="minimize",
+            storage=f"sqlite:///{checkpoint_dir}/{job_name}.sqlite3",
+            study_name=job_name,
+            pruner=OptimPruner(n_warmup_trials=5, n_warmup_steps=30),
+            load_if_exists=True
+        )
+
+        n_done = len([trial for trial in study.trials if trial.state == optuna.trial.TrialState.COMPLETE])
+
+        if n_done < n_trials:
+            regressor = CustomRegressor(estimator=get_estimator(job["estimator_name"], n_threads))
+
+            study.optimize(
+                func=lambda trial: optuna_objective(trial, regressor, X_tr, y_tr, X_te, y_te, metric="mdape", to_prices=False),
+                n_trials=n_trials - n_done,
+                timeout=timeout
+            )
+
+        # number of boosting rounds found by early stopping replaces suggested n_estimators
+        params = {**study.best_params, **study.best_trial.user_attrs}
+        params = {key: value for key, value in params.items() if key in study.best_params}
+
+        model = CustomRegressor(estimator=get_estimator(job["estimator_name"], n_threads))
+        model.estimator.set_params(**params)
+        model.fit(X_tr, y_tr)
+
+        metrics = {
+            "train": {job["estimator_name"]: compute_metrics(model, X_tr, y_tr)},
+            "test": {job["estimator_name"]: compute_metrics(model, X_te, y_te)}
+        }
+
+        # retrain on complete dataset
+        model.fit(stack_matrices([X_tr, X_te]), np.concatenate([y_tr, y_te]))
+        metrics["all"] = {job["estimator_name"]: compute_metrics(model, X_te, y_te)}
+
+        # preprocessing statistics used at inference are fitted once per department
+        preprocessor = AreaPreprocessor(training_set["features"], job["property_type"])
+        preprocessor.fit(load_training_data(data_dir, job["geo_area"], job["property_type"]))
+
+        save_model(
+            path=model_dir,
+            model=model,
+            feature_names=training_set["features"],
+            metrics=metrics,
+            version=version,
+            geo_area=job["geo_area"],
+            property_type=job["property_type"],
+            preprocessor=preprocessor.to_dict()
+        )
+
+        checkpoint.update({
+            "status": "done",
+            "n_trials": len(study.trials),
+            "best_params": study.best_params,
+            "metrics": metrics["test"][job["estimator_name"]]
+        })
+
+    except Exception:
+        checkpoint.update({"status": "failed", "error": traceback.format_exc()})
+
+    checkpoint["duration"] = time.time() - checkpoint["started_at"]
+    write_checkpoint(checkpoint_dir, job_name, checkpoint)
+
+    return checkpoint
+
+def train_all(
+    data_dir: str,
+    model_dir: str,
+    checkpoint_dir: str,
+    jobs: Optional[List[Dict]]=None,
+    n_workers: Optional[int]=None,
+    n_threads: int=1,
+    resume: bool=True,
+    **kwargs
+) -> List[Dict]:
+    """Description. Train models of several (geo_area, property_type) couples in a process pool.
+
+    Args:
+        data_dir (str): path to directory containing DVF+ and other data sources.
+        model_dir (str): path to directory where models are saved.
+        checkpoint_dir (str): path to directory containing checkpoints and optuna studies.
+        jobs (Optional[List[Dict]]): training jobs, all ESTIMATORS entries if None.
+        n_workers (Optional[int]): number of processes, cpu count divided by n_threads if None.
+        n_threads (int): number of threads of each job. Defaults to 1.
+        resume (bool): whether to skip jobs already done. Defaults to True.
+        **kwargs: arguments passed to train_area_model (version, n_trials, timeout, max_memory, ...).
+
+    Returns:
+        List[Dict]: checkpoints of all jobs."""
+
+    if jobs is None:
+        jobs = list_training_jobs()
+
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // n_threads)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    os.makedirs(model_dir, exist_ok=True)
+
+    version = kwargs.get("version", 0)
+    checkpoints, to_run = [], []
+
+    for job in jobs:
+        checkpoint = read_checkpoint(checkpoint_dir, get_job_name(job, version))
+
+        if resume and checkpoint is not None and checkpoint["status"] == "done":
+            checkpoints.append(checkpoint)
+        else:
+            to_run.append(job)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(train_area_model, job, data_dir, model_dir, checkpoint_dir, n_threads=n_threads, **kwargs): job
+            for job in to_run
+        }
+
+        for future in as_completed(futures):
+            job = futures[future]
+
+            try:
+                checkpoint = future.result()
+            except Exception:
+                # worker process died, e.g. killed by the system
+                checkpoint = {**job, "version": version, "status": "failed", "error": traceback.format_exc()}
+                write_checkpoint(checkpoint_dir, get_job_name(job, version), checkpoint)
+
+            print(f"{get_job_name(job, version)}: {checkpoint['status']} ({checkpoint.get('duration', 0):.0f}s)")
+            checkpoints.append(checkpoint)
+
+    return checkpoints
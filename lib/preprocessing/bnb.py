@@ -5,10 +5,12 @@ import numpy as np
 
 import ast
 from tqdm import tqdm 
+import hashlib
+import glob
 import os 
 
 from pandas.core.frame import DataFrame
-from typing import List, Tuple 
+from typing import Callable, List, Optional, Tuple 
 
 from lib.enums import (
     REL_BATIMENT_GROUPE_PARCELLE, 
@@ -52,9 +54,21 @@ def object_to_string(df: pd.DataFrame) -> pd.DataFrame:
 
     return df 
 
-def make_dataset(root: str, fnames: List[str], backup_fname: str): 
+def make_dataset(
+    root: str, 
+    fnames: List[str], 
+    backup_fname: str, 
+    single_pass: bool=False, 
+    checkpoint_dir: Optional[str]=None
+): 
     """Description. 
-    Build Base Nationale des Batiments dataset from selected file names.""" 
+    Build Base Nationale des Batiments dataset from selected file names.
+    
+    Details: if single_pass, the dataset is built with assemble_dataset and the backup parquet file 
+    is written once instead of after each table.""" 
+
+    if single_pass: 
+        return assemble_dataset(root, fnames, backup_fname, checkpoint_dir)
 
     if backup_fname.split(".")[-1] != "parquet": 
         raise ValueError("backup_fname must have .parquet extension.")
@@ -93,6 +107,141 @@ def make_dataset(root: str, fnames: List[str], backup_fname: str):
         print(f"Save updated {backup_fpath}...")
         df.to_parquet(backup_fpath, index=False) 
 
+def read_table(
+    root: str, 
+    fname: str, 
+    chunk_size: int=100000, 
+    keys: Optional[pd.Index]=None
+) -> DataFrame: 
+    """Description. Stream selected columns of one BNB table, only rows whose key is in keys are kept if provided."""
+
+    vars_ = VARS[fname]
+    dfs_list = []
+
+    for chunk in pd.read_csv(f"{root}{fname}.csv", chunksize=chunk_size, usecols=vars_): 
+        if keys is not None: 
+            chunk = chunk.loc[chunk[KEY].isin(keys), :]
+
+        dfs_list.append(chunk)
+
+    df = pd.concat(dfs_list)[vars_].reset_index(drop=True)
+
+    if fname == "batiment_groupe_radon":
+        df = df.rename(columns={"alea": "alea_radon"})
+
+    return df
+
+def join_on_key(df: DataFrame, right: DataFrame) -> DataFrame: 
+    """Description. Left join of right table on batiment_groupe_id.
+    
+    Details: when keys of right table are unique, rows are aligned with a hashed index of the keys 
+    instead of a merge, otherwise pd.merge is used (rows of df are repeated as in make_dataset)."""
+
+    if not right[KEY].is_unique: 
+        return pd.merge(left=df, right=right, how="left", on=KEY)
+
+    right = right.set_index(KEY).reindex(df[KEY].values)
+    right.index = df.index
+
+    return pd.concat([df, right], axis=1)
+
+def get_checkpoint_key(root: str, fname: str, first_fname: str, rows_fpath: str) -> str: 
+    """Description. Return digest of the inputs of a processed table, used in the name of its checkpoint.
+    
+    Details: the digest depends on the table name, the name of the first table and the size and modification 
+    time of the table csv file and of the file giving the rows kept (backup parquet file or first table csv file)."""
+
+    parts = [fname, first_fname]
+
+    for fpath in [f"{root}{fname}.csv", rows_fpath]: 
+        stat = os.stat(fpath)
+        parts.append(f"{stat.st_size}-{stat.st_mtime_ns}")
+
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+def assemble_dataset(
+    root: str, 
+    fnames: List[str], 
+    backup_fname: str, 
+    checkpoint_dir: Optional[str]=None, 
+    chunk_size: int=100000
+) -> str: 
+    """Description. Build Base Nationale des Batiments dataset in a single pass and write parquet file once.
+    
+    Details: 
+        - same output as make_dataset without rewriting the backup parquet file after each table.
+        - selected columns of each table are streamed and rows whose key is not in the first table are dropped.
+        - if checkpoint_dir is provided, each processed table is saved as {checkpoint_dir}/{fname}-{key}.parquet and 
+        read from there when the function is run again, e.g. after an interruption. The key (see get_checkpoint_key) 
+        changes with the table csv file, the first table and the backup parquet file, so that outdated checkpoints 
+        are never read and are removed when the table is processed again.
+        
+    Args:
+        root (str): path to directory containing BNB csv files.
+        fnames (List[str]): names of BNB tables, the first one gives the rows of the dataset.
+        backup_fname (str): name of output parquet file, tables are joined to it if it exists.
+        checkpoint_dir (Optional[str]): path to directory of restart points. Defaults to None.
+        chunk_size (int): number of csv rows per chunk.
+        
+    Returns:
+        str: path to output parquet file."""
+
+    if backup_fname.split(".")[-1] != "parquet": 
+        raise ValueError("backup_fname must have .parquet extension.")
+
+    for f in fnames: 
+        if f not in list(VARS.keys()): 
+            raise ValueError(f"{f} is not in {list(VARS.keys())}.")
+
+    if checkpoint_dir is not None: 
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    backup_fpath = f"{root}{backup_fname}"
+
+    df = pd.read_parquet(backup_fpath) if os.path.exists(backup_fpath) else None
+    keys = None if df is None else pd.Index(df[KEY].unique())
+
+    # file giving the rows kept in each table
+    rows_fpath = f"{root}{fnames[0]}.csv" if df is None else backup_fpath
+
+    loop = tqdm(fnames)
+    for f in loop: 
+        loop.set_description(f"Process {f}...")
+
+        checkpoint_fpath = None
+
+        if checkpoint_dir is not None: 
+            checkpoint_key = get_checkpoint_key(root, f, fnames[0], rows_fpath)
+            checkpoint_fpath = f"{checkpoint_dir}/{f}-{checkpoint_key}.parquet"
+
+        if checkpoint_fpath is not None and os.path.exists(checkpoint_fpath): 
+            tmp = pd.read_parquet(checkpoint_fpath)
+        else: 
+            tmp = object_to_string(read_table(root, f, chunk_size, keys))
+
+            if checkpoint_fpath is not None: 
+                for outdated_fpath in glob.glob(f"{checkpoint_dir}/{f}-*.parquet"): 
+                    os.remove(outdated_fpath)
+
+                tmp.to_parquet(checkpoint_fpath, index=False)
+
+        # missing values of joined tables are converted to "" at the end, as in make_dataset
+        stringcols = tmp.select_dtypes(include="string").columns
+        tmp[stringcols] = tmp[stringcols].astype(object)
+
+        if df is None: 
+            df = tmp
+            keys = pd.Index(df[KEY].unique())
+        else: 
+            df = join_on_key(df, tmp)
+
+    df = object_to_string(df)
+
+    print(f"Save {backup_fpath}...")
+    df.to_parquet(backup_fpath, index=False) 
+
+    return backup_fpath
+
 def load_bnb(data_dir: str, file_name: str) -> DataFrame: 
 
     file_path = data_dir + file_name
@@ -164,12 +313,51 @@ def fill_dummy_vars(df: DataFrame, var_name: str) -> DataFrame:
 
     return df 
 
-def preprocess(df: DataFrame, parcelle_ids: List[str]) -> DataFrame:
+LIST_PARSERS = {
+    "l_etat": string_tolist, 
+    "baie_orientation": string_tolist, 
+    "enr": recode_enr
+}
+
+def list_to_dummies(values: pd.Series, var_name: str, parser: Optional[Callable]=None) -> DataFrame: 
+    """Description. Vectorized dummies of variable with list as values, same columns as add_empty_dummies and fill_dummy_vars.
+    
+    Details: raw values only take a few distinct strings, so each distinct string is parsed once and 
+    the dummies of all rows are gathered from the dummies of the distinct strings. Missing values give 0."""
+
+    if var_name not in list(VARS_WITH_LIST_VALUES.keys()):
+        raise ValueError(f"{var_name} cannot be encoded.")
+
+    if parser is None: 
+        parser = LIST_PARSERS[var_name]
+
+    levels = VARS_WITH_LIST_VALUES[var_name]
+    codes, uniques = pd.factorize(values)
+
+    # last row is used for missing values (code -1)
+    table = np.zeros((len(uniques) + 1, len(levels)), dtype="int64")
+
+    for i, value in enumerate(uniques): 
+        items = parser(value)
+
+        if items is not None: 
+            table[i] = [1 if level in items else 0 for level in levels]
+
+    dummies = pd.DataFrame(
+        table[codes], 
+        columns=[var_name + "_" + format_var_name(level) for level in levels], 
+        index=values.index
+    )
+
+    return dummies
+
+def preprocess(df: DataFrame, parcelle_ids: List[str], vectorized: bool=True) -> DataFrame:
     """Description. Preprocess Base Nationale des Batiments dataset.
     
     Args:
         df (DataFrame): Base Nationale des Batiments dataset.
         parcelle_ids (List[str]): List of parcelle ids from DVF dataset.
+        vectorized (bool): Whether to build dummies of list variables with list_to_dummies.
         
     Returns:
         DataFrame: Preprocessed Base Nationale des Batiments dataset."""
@@ -180,18 +368,24 @@ def preprocess(df: DataFrame, parcelle_ids: List[str]) -> DataFrame:
     
     if "enr" not in list(bnb.columns):
         raise ValueError("enr column is missing.")
-    
-    bnb["enr"] = bnb.enr.apply(recode_enr) 
 
     for var in ["l_etat", "baie_orientation"]: 
         if var not in list(bnb.columns): 
             raise ValueError(f"{var} column is missing.")
-        
-        bnb[var] = bnb[var].apply(string_tolist)
 
-    for var in list(VARS_WITH_LIST_VALUES.keys()): 
-        bnb = add_empty_dummies(bnb, var)
-        bnb = fill_dummy_vars(bnb, var)
+    if vectorized: 
+        dummies = [list_to_dummies(bnb[var], var) for var in list(VARS_WITH_LIST_VALUES.keys())]
+        bnb = pd.concat([bnb] + dummies, axis=1)
+
+    else: 
+        bnb["enr"] = bnb.enr.apply(recode_enr) 
+
+        for var in ["l_etat", "baie_orientation"]: 
+            bnb[var] = bnb[var].apply(string_tolist)
+
+        for var in list(VARS_WITH_LIST_VALUES.keys()): 
+            bnb = add_empty_dummies(bnb, var)
+            bnb = fill_dummy_vars(bnb, var)
 
     if "nom_quartier" not in list(bnb.columns): 
         raise ValueError("nom_quartier column is missing.")
@@ -5,12 +5,18 @@ from tqdm import tqdm
 
 from zipfile import ZipFile
 import pickle as pkl
+import shutil
+import glob
+import os
 
 from pandas.core.frame import DataFrame 
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from lib.enums import CITIES, YEARS 
 
+from .utils import add_date_components
+from . import geo
+
 def load_zip_csv(zip_dir: str, year: int, chunk_size: int=10000) -> DataFrame: 
     """Description. Load zip DVF dataset in chunks."""
 
@@ -25,6 +31,19 @@ def load_zip_csv(zip_dir: str, year: int, chunk_size: int=10000) -> DataFrame:
 
     return df 
 
+def iter_zip_csv(zip_dir: str, year: int, chunk_size: int=100000, usecols: Optional[List]=None) -> Iterator[DataFrame]: 
+    """Description. Iterate over chunks of zip DVF dataset without loading the whole year."""
+
+    if zip_dir.split(".")[-1] != "zip": 
+        raise ValueError("Extension of zip_dir must be .zip.")
+    
+    zip_folder = ZipFile(zip_dir)
+    file_name = f"dvf/{year}.csv"
+
+    with zip_folder.open(file_name) as file: 
+        for chunk in pd.read_csv(file, chunksize=chunk_size, usecols=usecols): 
+            yield chunk
+
 def load_zip_pkl(zip_dir: str, year: int) -> Dict: 
     """Description. Load serialized (Dict) object from zip folder."""
 
@@ -94,8 +113,14 @@ def add_dependency_dummy(df: DataFrame, dependency_df: DataFrame) -> DataFrame:
 
     return df 
 
-def concat_datasets_per_year(zip_dir: str, geo_area: str , property_type: str) -> DataFrame: 
-    """Description. Concatenate datasets for given geographical area over years."""
+def concat_datasets_per_year(zip_dir: str, geo_area: str , property_type: str, store_dir: Optional[str]=None) -> DataFrame: 
+    """Description. Concatenate datasets for given geographical area over years.
+    
+    Details: if store_dir is provided, only the partitions of the area are read from the parquet store 
+    built with stream_year_to_parquet, otherwise the pickled dict of every year is loaded from zip_dir."""
+
+    if store_dir is not None: 
+        return load_dvf_partitions(store_dir, geo_area, property_type)
 
     dfs_list = []
     loop = tqdm(YEARS)
@@ -113,4 +138,172 @@ def concat_datasets_per_year(zip_dir: str, geo_area: str , property_type: str) -
 
     df = pd.concat(dfs_list, axis=0).reset_index(drop=True)
 
-    return df  
\ No newline at end of file
+    return df
+
+def get_partition_dir(store_dir: str, geo_area: str, property_type: str, year: Optional[int]=None) -> str: 
+    """Description. Return path to the partitions of one (geo_area, property_type) slice of the DVF store, of one year if provided."""
+
+    partition_dir = f"{store_dir}/geo_area={geo_area}/property_type={property_type}"
+
+    if year is not None: 
+        partition_dir = f"{partition_dir}/year={year}"
+
+    return partition_dir
+
+def split_by_geo_area(df: DataFrame) -> Iterator[Tuple]: 
+    """Description. Iterate over (geo_area, transactions) of the 10 biggest cities, urban areas and rural areas."""
+
+    for city, df_city in geo.split_by_city(df).items(): 
+        yield city, df_city
+
+    yield "urban_areas", geo.get_urban_areas(df)
+    yield "rural_areas", geo.get_rural_areas(df)
+
+def scan_transactions(zip_dir: str, year: int, chunk_size: int=100000) -> Tuple: 
+    """Description. First pass over DVF year: ids of unique house/flat transactions and ids with dependencies.
+    
+    Details: only id_mutation, nature_mutation and code_type_local columns are read.
+    
+    Returns:
+        Tuple: set of id_mutation related to one house or flat row, set of id_mutation with a dependency."""
+
+    counts, dependency_ids = [], set()
+
+    for chunk in iter_zip_csv(zip_dir, year, chunk_size, usecols=["id_mutation", "nature_mutation", "code_type_local"]): 
+        chunk = remove_industrial_facilities(select_sales(chunk))
+
+        is_dependency = chunk.code_type_local == 3
+        counts.append(chunk.loc[~is_dependency, "id_mutation"].value_counts())
+        dependency_ids.update(chunk.loc[is_dependency, "id_mutation"].unique())
+
+    counts = pd.concat(counts).groupby(level=0).sum()
+    unique_ids = set(counts.index[counts == 1])
+
+    return unique_ids, dependency_ids
+
+def prepare_chunk(
+    chunk: DataFrame, 
+    unique_ids: set, 
+    dependency_ids: set, 
+    regions_dpts: DataFrame, 
+    density: DataFrame
+) -> Dict: 
+    """Description. Select unique house and flat sales of chunk and add dependency dummy, region, density and date components.
+    
+    Returns:
+        Dict: transactions per property type ("houses", "flats")."""
+
+    chunk = remove_industrial_facilities(select_sales(chunk))
+    chunk = chunk.loc[(chunk.code_type_local != 3) & chunk.id_mutation.isin(unique_ids), :]
+
+    sales = {}
+
+    for property_type, code in (("houses", 1), ("flats", 2)): 
+        df = chunk.loc[chunk.code_type_local == code, :].copy()
+
+        df["dependance"] = df.id_mutation.isin(dependency_ids).astype(int)
+        df["code_departement"] = df["code_departement"].astype(str)
+        df = pd.merge(left=df, right=regions_dpts, how="left", on="code_departement")
+
+        df["code_commune"] = df["code_commune"].astype(str)
+        df = pd.merge(left=df, right=density, how="left", on="code_commune")
+
+        sales[property_type] = add_date_components(df, date_var="date_mutation")
+
+    return sales
+
+def stream_year_to_parquet(
+    zip_dir: str, 
+    year: int, 
+    store_dir: str, 
+    regions_dpts: DataFrame, 
+    density: DataFrame, 
+    chunk_size: int=100000
+) -> DataFrame: 
+    """Description. Preprocess DVF year in chunks and append each (geo_area, property_type) slice to parquet partitions.
+    
+    Details: 
+        - same steps as the former dvf_splitted_{year}.pkl pipeline (unique sales, dependency dummy, regions, 
+        density, date components, split by geographical area) with peak memory bounded by chunk_size.
+        - two passes are made over the csv file: the first one only reads ids to find unique transactions and dependencies.
+        - partitions of the year are replaced, so the function can be run again on the same year.
+    
+    Args:
+        zip_dir (str): path to zip folder containing DVF.
+        year (int): year of DVF dataset.
+        store_dir (str): path to partitioned parquet store.
+        regions_dpts (DataFrame): regions of departments.
+        density (DataFrame): density level and population of municipalities.
+        chunk_size (int): number of csv rows per chunk.
+        
+    Returns:
+        DataFrame: number of transactions per geographical area (rows) and property type (columns).
+        
+    Example:
+    
+    >>> from lib.preprocessing.dvf import stream_year_to_parquet, load_dvf_partitions
+    >>> counts = stream_year_to_parquet("./data/dvf.zip", 2017, "./data/dvf_parquet", regions_dpts, density)
+    >>> df = load_dvf_partitions("./data/dvf_parquet", "Paris", "flats", years=[2017])"""
+
+    for partition_dir in glob.glob(f"{store_dir}/geo_area=*/property_type=*/year={year}"): 
+        shutil.rmtree(partition_dir)
+
+    unique_ids, dependency_ids = scan_transactions(zip_dir, year, chunk_size)
+
+    counts = {}
+
+    for part, chunk in enumerate(iter_zip_csv(zip_dir, year, chunk_size)): 
+        sales = prepare_chunk(chunk, unique_ids, dependency_ids, regions_dpts, density)
+
+        for property_type, df in sales.items(): 
+            n_splitted = 0
+
+            for geo_area, df_area in split_by_geo_area(df): 
+                counts[(geo_area, property_type)] = counts.get((geo_area, property_type), 0) + df_area.shape[0]
+                n_splitted += df_area.shape[0]
+
+                if df_area.shape[0] == 0: 
+                    continue
+
+                partition_dir = get_partition_dir(store_dir, geo_area, property_type, year)
+                os.makedirs(partition_dir, exist_ok=True)
+                df_area.to_parquet(f"{partition_dir}/part-{part:05d}.parquet", index=False)
+
+            # check coherence of transactions number per property type
+            assert n_splitted == df.shape[0] - df.degre_densite.isna().sum()
+
+    geo_areas = CITIES + ["urban_areas", "rural_areas"]
+    counts = pd.DataFrame({
+        property_type: [counts.get((geo_area, property_type), 0) for geo_area in geo_areas]
+        for property_type in ("houses", "flats")
+    }, index=geo_areas)
+
+    return counts
+
+def load_dvf_partitions(
+    store_dir: str, 
+    geo_area: str, 
+    property_type: str, 
+    years: Optional[List]=None, 
+    columns: Optional[List]=None
+) -> DataFrame: 
+    """Description. Load transactions of one (geo_area, property_type) slice from parquet store, only its partitions are read.
+    
+    Details: partitions are concatenated with pandas so that columns inferred with different types in 
+    different chunks (e.g. integer and string codes) are merged as in a single csv file."""
+
+    if years is None: 
+        years = YEARS
+
+    dfs_list = []
+
+    for year in years: 
+        file_paths = sorted(glob.glob(f"{get_partition_dir(store_dir, geo_area, property_type, year)}/*.parquet"))
+        dfs_list.extend(pd.read_parquet(file_path, columns=columns) for file_path in file_paths)
+
+    if len(dfs_list) == 0: 
+        raise FileNotFoundError(f"No partition for {geo_area} and {property_type} in {store_dir}.")
+
+    df = pd.concat(dfs_list, axis=0).reset_index(drop=True)
+
+    return df
@@ -0,0 +1,77 @@
+"""Description. Command-line tool to serve price predictions over HTTP.
+
+Endpoints:
+    - POST /predict: json with the fields property_type, street_number, street_name, zip_code, city,
+      num_rooms, surface, field_surface, dependance and optionally longitude and latitude.
+    - GET /health: status, uptime, number of cached areas and pending requests.
+    - GET /latency: latency quantiles per stage (request, feature_vector, inference).
+
+Example:
+~\mon-predicteur-immo> python prediction_service.py -port 8080
+~\mon-predicteur-immo> python prediction_service.py -port 8080 -n_workers 8 -n_model_workers 2 -max_batch_size 64 -max_wait_ms 10
+~\mon-predicteur-immo> python prediction_service.py -offline_geocoding -geocoding_cache geocodes.sqlite
+======== Running on http://0.0.0.0:8080 ========
+"""
+
+# required libraries
+from lib.inference import PredictionEngine, OfflineGeocoder, CachedGeocoder, get_default_geocoder
+from lib.inference.service import PredictionService
+from lib.model.registry import ModelRegistry
+from lib.dataset.loader import list_dvfplus_tables
+
+from aiohttp import web
+
+import sys
+
+# enums
+DATA_DIR = "./data/"
+MODEL_DIR = "./backup/models/"
+HOST = "0.0.0.0"
+PORT = 8080
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+data_dir = extract_info(flag="-data_dir") if "-data_dir" in sys.argv else DATA_DIR
+model_dir = extract_info(flag="-model_dir") if "-model_dir" in sys.argv else MODEL_DIR
+host = extract_info(flag="-host") if "-host" in sys.argv else HOST
+port = int(extract_info(flag="-port")) if "-port" in sys.argv else PORT
+
+n_workers = int(extract_info(flag="-n_workers")) if "-n_workers" in sys.argv else 4
+n_model_workers = int(extract_info(flag="-n_model_workers")) if "-n_model_workers" in sys.argv else 2
+max_batch_size = int(extract_info(flag="-max_batch_size")) if "-max_batch_size" in sys.argv else 32
+max_wait = float(extract_info(flag="-max_wait_ms")) / 1000 if "-max_wait_ms" in sys.argv else .005
+
+cache_path = extract_info(flag="-geocoding_cache") if "-geocoding_cache" in sys.argv else None
+
+if "-offline_geocoding" in sys.argv:
+    tables = list_dvfplus_tables(zip_dir=data_dir, zip_name="dvf+")
+    offline_geocoder = None
+    geocoder = OfflineGeocoder.from_dvfplus(data_dir=data_dir, tables=tables)
+
+    if cache_path is not None:
+        geocoder = CachedGeocoder(cache_path=cache_path, geocoder=geocoder)
+else:
+    # offline geocoder completed with each area loaded by the engine, Google Maps for unknown streets
+    offline_geocoder = OfflineGeocoder(zip_code_fallback=False)
+    geocoder = get_default_geocoder(data_dir, offline_geocoder, cache_path=cache_path)
+
+engine = PredictionEngine(
+    data_dir=data_dir,
+    model_dir=model_dir,
+    geocoder=geocoder,
+    offline_geocoder=offline_geocoder,
+    registry=ModelRegistry(model_dir=model_dir)
+)
+
+service = PredictionService(
+    engine, 
+    n_workers=n_workers, 
+    n_model_workers=n_model_workers, 
+    max_batch_size=max_batch_size, 
+    max_wait=max_wait
+)
+
+web.run_app(service.make_app(), host=host, port=port)
@@ -8,11 +8,31 @@ import streamlit as st
 from streamlit_folium import folium_static
 
 import numpy as np 
-from typing import Union, Tuple
+from typing import Dict, List, Union, Tuple
 
-from lib.inference import Prediction
+import threading
+
+from lib.inference import PredictionEngine, CachedGeocoder, OfflineGeocoder, get_default_geocoder
+from lib.inference.engine import get_area_key
+from lib.model.registry import ModelRegistry
 from lib.enums import AVAILABLE_GEO_AREAS, AVAILABLE_GEO_AREAS_COORDS
 
+# Resources -----------------------------------------------------------------------------------------
+
+DATA_DIR = "./data/"
+MODEL_DIR = "./backup/models/"
+
+# maximum number of areas (geo_area, property_type, department) and models kept in memory
+MAX_AREAS = 8
+MAX_MODELS = 8
+
+# areas loaded in background at startup, default property of the sidebar first
+WARM_UP_PROPERTIES = [
+    {"property_type": "flats", "zip_code": 75001, "city": "Paris"},
+    {"property_type": "houses", "zip_code": 69001, "city": "Lyon"},
+    {"property_type": "flats", "zip_code": 69001, "city": "Lyon"},
+]
+
 # Functions -----------------------------------------------------------------------------------------
 
 def format_zip_code(zip_code: str) -> int: 
@@ -57,18 +77,79 @@ def generate_geo_areas_map():
 
     folium_static(map, width=725, height=600)
 
-def generate_closest_properties_map(prediction: Prediction, property_type: str) -> Tuple:
+@st.cache_resource(show_spinner=False)
+def get_model_registry() -> ModelRegistry: 
+    """Description. Registry sharing at most MAX_MODELS models between all sessions."""
+
+    return ModelRegistry(model_dir=MODEL_DIR, max_models=MAX_MODELS)
+
+@st.cache_resource(show_spinner=False)
+def get_offline_geocoder() -> OfflineGeocoder: 
+    """Description. Offline geocoder completed with the transactions of each area loaded by the engines."""
+
+    return OfflineGeocoder(zip_code_fallback=False)
+
+@st.cache_resource(show_spinner=False)
+def get_geocoder() -> CachedGeocoder: 
+    """Description. Geocoder shared between all sessions: cache of data/geocodes.sqlite, then offline geocoder 
+    and Google Maps for unknown streets only."""
+
+    return get_default_geocoder(DATA_DIR, get_offline_geocoder())
+
+@st.cache_resource(max_entries=MAX_AREAS, show_spinner=False)
+def get_area_engine(area_key: Tuple, _zip_code: int) -> PredictionEngine: 
+    """Description. Engine keeping preprocessed data, spatial index and model of one area in memory.
+    
+    Details: cached by area key (geo_area, property_type, department code or zip code for Paris) so that 
+    all users of an area share the same engine. The least recently used engines are dropped beyond MAX_AREAS. 
+    The zip code only selects the transactions to load and is not part of the cache key."""
+
+    engine = PredictionEngine(
+        data_dir=DATA_DIR, 
+        model_dir=MODEL_DIR, 
+        geocoder=get_geocoder(), 
+        offline_geocoder=get_offline_geocoder(), 
+        registry=get_model_registry()
+    )
+
+    geo_area, property_type, _ = area_key
+    engine.warm_up([{"property_type": property_type, "zip_code": _zip_code, "city": geo_area}])
+
+    return engine
+
+def warm_up(properties: List[Dict]): 
+    """Description. Load engines of the areas containing properties, areas without model are skipped."""
+
+    for user_args in properties: 
+        area_key = get_area_key(user_args)
+
+        if area_key is not None: 
+            get_area_engine(area_key, user_args["zip_code"])
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up() -> threading.Thread: 
+    """Description. Warm up cache in a background thread, started once per server."""
+
+    thread = threading.Thread(target=warm_up, args=(WARM_UP_PROPERTIES, ), daemon=True)
+    thread.start()
+
+    return thread
+
+def generate_closest_properties_map(details: Dict, property_type: str) -> Tuple:
     """"Description. Make a map with closest properties and user property.
     
     Args:
-        prediction (Prediction): Prediction object.
+        details (Dict): predicted price, user's arguments and close properties returned by PredictionEngine.
         property_type (str): Type of property.
         
     Returns:
         Tuple: Map and caption."""
 
+    pred_price = details["price"]
+    close_properties = details["close_properties"]
+
     user_location = [
-        prediction.user_args["latitude"], prediction.user_args["longitude"]
+        details["user_args"]["latitude"], details["user_args"]["longitude"]
     ]
 
     map = folium.Map(
@@ -82,17 +163,17 @@ def generate_closest_properties_map(prediction: Prediction, property_type: str)
         icon=folium.Icon(color="black", icon="home")
     ).add_to(map)
 
-    if prediction.close_properties is None: 
+    if close_properties is None: 
         caption = "Aucun bien similaire n'a été trouvé dans notre base de données."
 
     else: 
-        median_price = prediction.close_properties.valeur_fonciere.median()
+        median_price = close_properties.valeur_fonciere.median()
         caption = f"Les {property_type.lower()}s les plus proches de votre bien présents dans notre base de données. **Le prix médian est de {format_number(median_price)}€**."
 
-        if len(prediction.close_properties) > 20: 
-            prediction.close_properties = prediction.close_properties.sample(20)
+        if len(close_properties) > 20: 
+            close_properties = close_properties.sample(20)
 
-        for _, row in prediction.close_properties.iterrows():
+        for _, row in close_properties.iterrows():
             surface = np.exp(row["l_surface_reelle_bati"])
             year = row.date_mutation.split("-")[0]
             label = f"{int(surface):,} m² à {format_number(row.valeur_fonciere)}€ ({year})"
@@ -122,6 +203,8 @@ st.set_page_config(page_title=APP_TITLE, page_icon=ICON)
 st.title(f"{ICON} {APP_TITLE}")
 st.caption(APP_CAPTION)
 
+start_warm_up()
+
 # Sidebar with user input widgets & contact information -----------------------------------------------------------------------------------------
 
 st.sidebar.title("Pouvez-vous décrire votre bien ?")
@@ -178,27 +261,29 @@ if check_prediction_widget:
         "dependance": 1. if dependance == "Oui" else 0.
     }
 
-    # Create a Prediction object with user input
-    prediction = Prediction(user_args)
+    # Find the area of user's property
+    area_key = get_area_key(user_args)
 
-    if prediction.geo_area is None:
+    if area_key is None:
         st.warning(f"L'outil de prédiction ne couvre pas encore cette zone pour les {property_type.lower()}s.")
 
     else: 
 
-        # Load data and model
-        prediction.load_data(data_dir="./data/")
-        prediction.load_model(model_dir="./backup/models/")
+        # Load data and model once per area
+        with st.spinner("Chargement des données de votre zone..."): 
+            engine = get_area_engine(area_key, user_args["zip_code"])
+
+        details = engine.predict(user_args, return_details=True)
 
-        if prediction.model_loader is None:
+        if details is None:
             st.warning(f"L'outil de prédiction ne couvre pas encore cette zone pour les {property_type.lower()}s.")
 
         else:
             # Predict the price
-            pred_price = prediction.predict()
+            pred_price = details["price"]
 
             # Compute model error
-            mape = prediction.fecth_mape()  
+            mape = details["mape"]
 
              # Build confidence interval
             price_up = pred_price / (1 - mape)
@@ -223,7 +308,7 @@ if check_prediction_widget:
                 generate_price_metric(price_up, "Prix haut")
             
             # Display map with close properties and user property
-            map, caption = generate_closest_properties_map(prediction, property_type)
+            map, caption = generate_closest_properties_map(details, property_type)
 
             st.subheader("Près de chez vous")
             st.caption(caption) 
@@ -0,0 +1,143 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from lib.enums import BNB_SELECTED_VARS
+
+from pandas.core.frame import DataFrame
+from typing import Dict
+
+import pandas as pd
+import numpy as np
+
+import zipfile
+import pytest
+
+GEO_AREA = "essonne"
+PROPERTY_TYPE = "flats"
+ZIP_CODES = [91000, 91300, 91120]
+
+NON_FEATURES = [
+    "id_mutation",
+    "date_mutation",
+    "valeur_fonciere",
+    "nom_commune",
+    "nom_departement",
+    "type_local",
+    "adresse_numero",
+    "adresse_nom_voie",
+    "code_postal",
+    "longitude",
+    "latitude",
+    "l_valeur_fonciere",
+    "valeur_fonciere_m2",
+]
+
+def make_area_table(n_rows: int=3000, seed: int=0) -> DataFrame:
+    """Description. DVF+ transactions of flats in Essonne with the columns read at inference."""
+
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({
+        "id_mutation": [f"2020-{i}" for i in range(n_rows)],
+        "date_mutation": pd.to_datetime("2018-01-01") + pd.to_timedelta(rng.integers(0, 1500, n_rows), unit="D"),
+        "valeur_fonciere": rng.lognormal(12, .4, n_rows).round(),
+        "nom_commune": rng.choice(["Evry", "Massy", "Palaiseau"], n_rows),
+        "nom_departement": "Essonne",
+        "surface_reelle_bati": rng.integers(15, 150, n_rows).astype(float),
+        "nombre_pieces_principales": rng.integers(1, 6, n_rows).astype(float),
+        "surface_terrain": np.nan,
+        "dependance": rng.integers(0, 2, n_rows),
+        "adresse_numero": rng.integers(1, 60, n_rows).astype(float),
+        "adresse_nom_voie": rng.choice([f"Rue {i}" for i in range(40)], n_rows),
+        "code_postal": rng.choice(ZIP_CODES, n_rows).astype(float),
+        "longitude": 2.2 + rng.random(n_rows) * .1,
+        "latitude": 48.6 + rng.random(n_rows) * .1,
+        "code_departement": 91,
+        "type_local": "Appartement",
+    })
+
+    dates = df["date_mutation"]
+    df["trimestre"] = dates.dt.quarter.astype(float)
+    df["mois"] = dates.dt.month.astype(float)
+    df["date_mutation"] = dates.dt.strftime("%Y-%m-%d")
+
+    for var in BNB_SELECTED_VARS:
+        if var.startswith(("baie_orientation", "enr")) or var in ("presence_balcon", "presence_climatisation", "qpv"):
+            df[var] = rng.integers(0, 2, n_rows).astype(float)
+        elif var.startswith("alea"):
+            df[var] = rng.choice(["Faible", "Moyen", "Fort"], n_rows)
+        elif var.startswith("periode"):
+            df[var] = rng.choice(["1948-1974", "1975-1988", "2001-2012"], n_rows)
+        else:
+            df[var] = rng.random(n_rows) * 100
+
+    df.loc[rng.random(n_rows) < .1, "hauteur_mean"] = np.nan
+
+    return df.sort_values("date_mutation").reset_index(drop=True)
+
+@pytest.fixture(scope="session")
+def area(tmp_path_factory) -> Dict:
+    """Description. Data directory with a synthetic DVF+ table and model directory with a small XGBRegressor
+    trained on it (without fitted preprocessor)."""
+
+    from xgboost import XGBRegressor
+
+    from lib.inference.predict import load_area_data
+    from lib.inference.utils import preprocess_area_data
+    from lib.model import CustomRegressor
+    from lib.model.loader import save_model
+
+    root = tmp_path_factory.mktemp("area")
+    data_dir, model_dir = f"{root}/data/", f"{root}/models/"
+    os.makedirs(data_dir)
+    os.makedirs(model_dir)
+
+    with zipfile.ZipFile(f"{data_dir}dvf+.zip", "w") as f:
+        f.writestr(f"dvf+/{GEO_AREA}_{PROPERTY_TYPE}.csv", make_area_table().to_csv(index=False))
+
+    raw = load_area_data(data_dir, GEO_AREA, PROPERTY_TYPE, ZIP_CODES[0], backend="zip")
+
+    # every candidate feature is requested so that preprocessing keeps all of them
+    candidates = list(raw.columns) + [
+        "l_valeur_fonciere_ma7",
+        "l_valeur_fonciere_ma30",
+        "l_surface_reelle_bati",
+        "mois_3",
+        "trimestre_2"
+    ] + [f"nombre_pieces_principales_{i}" for i in range(6)]
+
+    df, _ = preprocess_area_data(raw.copy(), {"feature_names": candidates}, PROPERTY_TYPE)
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    feature_names = [col for col in df.columns if col not in NON_FEATURES and df[col].dtype != object]
+
+    model = CustomRegressor(XGBRegressor(n_estimators=20, n_jobs=1))
+    model.fit(df[feature_names].values.astype("float64"), np.log(df["valeur_fonciere"].values))
+
+    metrics = {"all": {"XGBRegressor": {"mean_absolute_percentage_error": .2}}}
+    save_model(model_dir, model, feature_names, metrics, 0, GEO_AREA, PROPERTY_TYPE)
+
+    return {"data_dir": data_dir, "model_dir": model_dir, "raw": raw, "feature_names": feature_names, "metrics": metrics}
+
+def make_user_args(row, num_rooms: int=3, surface: float=60., located: bool=False) -> Dict:
+    """Description. Return user's arguments of a flat at the address of a transaction, at its location if located."""
+
+    user_args = {
+        "property_type": PROPERTY_TYPE,
+        "street_number": int(row["adresse_numero"]),
+        "street_name": row["adresse_nom_voie"],
+        "zip_code": int(row["code_postal"]),
+        "city": row["nom_commune"],
+        "num_rooms": num_rooms,
+        "surface": surface,
+        "field_surface": 0,
+        "dependance": 0
+    }
+
+    if located:
+        user_args["longitude"] = float(row["longitude"])
+        user_args["latitude"] = float(row["latitude"])
+
+    return user_args
@@ -0,0 +1,95 @@
+"""Description. Parity of the vectorized dummies of list variables of BNB with their row-wise version."""
+
+from lib.enums import BNB_SELECTED_VARS, VARS_WITH_LIST_VALUES
+from lib.preprocessing.bnb import (
+    add_empty_dummies,
+    fill_dummy_vars,
+    list_to_dummies,
+    preprocess,
+    recode_enr,
+    string_tolist,
+)
+
+from pandas.core.frame import DataFrame
+from pandas.testing import assert_series_equal
+
+import pandas as pd
+import numpy as np
+
+import pytest
+
+LIST_VALUES = [
+    "['En service']",
+    "['En projet', 'En service']",
+    "['nord', 'sud', 'est ou ouest']",
+    "['horizontale']",
+    "[]",
+    "",
+    "['nord'",
+    "nord, sud",
+    "{'nord': 1}",
+    None,
+]
+
+ENR_VALUES = [
+    "solaire photovoltaique",
+    "solaire photovoltaique + solaire thermique (ecs+chauffage)",
+    "solaire thermique (ecs+chauffage)",
+    "solaire thermique (chauffage)solaire thermique (ecs)",
+    "eolien",
+    "",
+    "+",
+]
+
+def make_bnb_frame(n_rows: int=300, seed: int=0) -> DataFrame:
+    """Description. BNB buildings with well-formed, malformed, empty and missing list values."""
+
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({
+        "parcelle_id": [f"p{i}" for i in range(n_rows)],
+        "l_etat": rng.choice(np.array(LIST_VALUES, dtype=object), n_rows),
+        "baie_orientation": rng.choice(np.array(LIST_VALUES, dtype=object), n_rows),
+        "enr": rng.choice(ENR_VALUES, n_rows),
+        "nom_quartier": rng.choice(["", "Les Pyramides"], n_rows),
+        "alea": rng.choice(["Faible", "Moyen", "Fort"], n_rows),
+    })
+
+    for var in BNB_SELECTED_VARS:
+        if var not in df.columns and not var.startswith(("baie_orientation_", "enr_")) and var not in ("qpv", "alea_argiles"):
+            df[var] = rng.random(n_rows)
+
+    return df
+
+def rowwise_dummies(df: DataFrame, var_name: str) -> DataFrame:
+    df = df[[var_name]].copy()
+    parser = recode_enr if var_name == "enr" else string_tolist
+
+    df[var_name] = df[var_name].apply(parser)
+    df = fill_dummy_vars(add_empty_dummies(df, var_name), var_name)
+
+    return df.drop(columns=var_name)
+
+@pytest.mark.parametrize("var_name", list(VARS_WITH_LIST_VALUES.keys()))
+def test_list_to_dummies_parity(var_name):
+    df = make_bnb_frame()
+
+    expected = rowwise_dummies(df, var_name)
+    dummies = list_to_dummies(df[var_name], var_name)
+
+    assert list(dummies.columns) == list(expected.columns)
+
+    for col in expected.columns:
+        assert_series_equal(dummies[col], expected[col], check_exact=True)
+
+def test_preprocess_parity():
+    df = make_bnb_frame()
+    parcelle_ids = df["parcelle_id"].iloc[::2].tolist()
+
+    expected = preprocess(df.copy(), parcelle_ids, vectorized=False)
+    bnb = preprocess(df.copy(), parcelle_ids, vectorized=True)
+
+    assert list(bnb.columns) == list(expected.columns)
+
+    for col in expected.columns:
+        assert_series_equal(bnb[col], expected[col], check_exact=True)
@@ -0,0 +1,111 @@
+"""Description. Parity of the columnar prepare_dataset and transform_price with their former row-wise versions."""
+
+import lib.dataset.build as build
+from lib.dataset.build import prepare_dataset
+from lib.dataset.utils import transform_price, float_to_string, replace_inf_with_nan
+
+from pandas.core.frame import DataFrame
+from pandas.testing import assert_frame_equal
+
+import pandas as pd
+import numpy as np
+
+import pytest
+
+def transform_price_scalar(price: float, log: bool, area=None) -> float:
+    """Description. Former scalar version of transform_price applied row by row."""
+
+    y = price
+
+    if area != None:
+        y = y / area
+
+    if log:
+        y = np.log(y)
+
+    return y
+
+def transform_price_rowwise(price, log: bool, area=None) -> np.ndarray:
+    if area is None:
+        return np.array([transform_price_scalar(p, log) for p in price], dtype="float64")
+
+    return np.array([transform_price_scalar(p, log, a) for p, a in zip(price, area)], dtype="float64")
+
+def log_transform_rowwise(x: pd.Series) -> pd.Series:
+    df = x.apply(transform_price_scalar, log=True).to_frame()
+    return replace_inf_with_nan(df, x.name)[x.name]
+
+def make_dvf_frame(n_rows: int=600, seed: int=0) -> DataFrame:
+    """Description. DVF+ transactions with missing values, zero surfaces and zero prices."""
+
+    rng = np.random.default_rng(seed)
+
+    surface = rng.uniform(10, 150, n_rows).round()
+    surface[rng.choice(n_rows, 20, replace=False)] = 0.
+    surface[rng.choice(n_rows, 20, replace=False)] = np.nan
+
+    price = (surface * rng.uniform(5000, 12000, n_rows)).round()
+    price[rng.choice(n_rows, 5, replace=False)] = 0.
+
+    field_surface = rng.uniform(0, 500, n_rows).round()
+    field_surface[rng.choice(n_rows, 50, replace=False)] = np.nan
+
+    n_rooms = rng.integers(1, 6, n_rows).astype("float64")
+    n_rooms[rng.choice(n_rows, 10, replace=False)] = np.nan
+
+    dates = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 400, n_rows), unit="D")
+
+    df = pd.DataFrame({
+        "id_mutation": [f"2020-{i}" for i in range(n_rows)],
+        "date_mutation": dates.strftime("%Y-%m-%d"),
+        "valeur_fonciere": price,
+        "nom_commune": [f"Paris {i}e Arrondissement" for i in rng.integers(1, 21, n_rows)],
+        "nom_departement": "Paris",
+        "surface_reelle_bati": surface,
+        "nombre_pieces_principales": n_rooms,
+        "surface_terrain": field_surface,
+        "dependance": rng.integers(0, 2, n_rows).astype("float64"),
+        "trimestre": dates.quarter.astype("float64"),
+        "mois": dates.month.astype("float64")
+    })
+
+    return df
+
+@pytest.fixture
+def rowwise(monkeypatch):
+    """Description. Replace the columnar helpers of prepare_dataset with the former row-wise ones."""
+
+    monkeypatch.setattr(build, "transform_price", transform_price_rowwise)
+    monkeypatch.setattr(build, "log_transform", log_transform_rowwise)
+    monkeypatch.setattr(build, "floats_to_strings", lambda x: x.apply(float_to_string))
+    monkeypatch.setattr(build, "map_unique_values", lambda x, fun: x.apply(fun))
+
+PREPARE_ARGS = [
+    dict(target_var="l_valeur_fonciere"),
+    dict(target_var="valeur_fonciere"),
+    dict(target_var="l_valeur_fonciere", neighborhood_var="arrondissement", mov_av_windows=[7, 30]),
+    dict(target_var="l_valeur_fonciere", numeric_filters={"valeur_fonciere_m2": (1000, 20000)}),
+]
+
+@pytest.mark.parametrize("args", PREPARE_ARGS)
+def test_prepare_dataset_parity(args, request):
+    df = make_dvf_frame()
+
+    columnar = prepare_dataset(df.copy(), print_summary=False, return_var_names=False, **args)
+
+    request.getfixturevalue("rowwise")
+    reference = prepare_dataset(df.copy(), print_summary=False, return_var_names=False, **args)
+
+    assert_frame_equal(columnar, reference, check_exact=True)
+
+@pytest.mark.parametrize("log", [True, False])
+def test_transform_price_parity(log):
+    price = np.array([250000., 0., np.nan, 180000., 95000., 0.])
+    area = np.array([50., 40., 30., 0., np.nan, 0.])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.testing.assert_array_equal(transform_price(price, log=log), transform_price_rowwise(price, log))
+        np.testing.assert_array_equal(transform_price(price, log=log, area=area), transform_price_rowwise(price, log, area))
+
+        for p, a in zip(price, area):
+            np.testing.assert_array_equal(transform_price(p, log=log, area=a), transform_price_scalar(p, log, a))
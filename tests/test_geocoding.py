@@ -0,0 +1,111 @@
+"""Description. Address normalization, cache hits and misses and offline lookups of geocoders."""
+
+from lib.inference.geocoding import (
+    Geocoder,
+    CachedGeocoder,
+    FallbackGeocoder,
+    OfflineGeocoder,
+    normalize_address,
+)
+
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+import pytest
+
+USER_ARGS = {"street_number": 11, "street_name": "Rue des Halles", "zip_code": 75001, "city": "Paris"}
+
+class CountingGeocoder(Geocoder):
+    """Description. Geocoder returning the same location and counting its calls."""
+
+    def __init__(self, location: Optional[Tuple]=(2.3, 48.8)):
+        self.location = location
+        self.n_calls = 0
+
+    def geocode(self, user_args: Dict) -> Optional[Tuple]:
+        self.n_calls += 1
+        return self.location
+
+def make_locations() -> pd.DataFrame:
+    return pd.DataFrame({
+        "adresse_numero": [11, 11, 13, 2, None],
+        "adresse_nom_voie": ["RUE DES HALLES", "Rue des Halles", "RUE DES HALLES", "RUE DE RIVOLI", "RUE DE RIVOLI"],
+        "code_postal": [75001, 75001, 75001, 75001, 75004],
+        "longitude": [2.0, 4.0, 6.0, 8.0, 10.0],
+        "latitude": [48.0, 50.0, 52.0, 54.0, None]
+    })
+
+def test_geocoder_is_abstract():
+    with pytest.raises(TypeError):
+        Geocoder()
+
+def test_normalize_address():
+    address = normalize_address({"street_number": 3, "street_name": "  Allée  de l'Église-Saint-Aignan ", "zip_code": 45000, "city": "ORLÉANS"})
+
+    assert address == "3 allee de l eglise saint aignan 45000 orleans"
+    assert normalize_address(USER_ARGS) == normalize_address({**USER_ARGS, "street_name": "RUE DES HALLES"})
+
+def test_cached_geocoder_hits_and_misses(tmp_path):
+    counting = CountingGeocoder()
+    geocoder = CachedGeocoder(cache_path=str(tmp_path / "geocodes.sqlite"), geocoder=counting)
+
+    assert geocoder(USER_ARGS) == (2.3, 48.8)
+    assert geocoder({**USER_ARGS, "street_name": "rue des halles"}) == (2.3, 48.8)
+
+    assert (geocoder.hits, geocoder.misses, counting.n_calls) == (1, 1, 1)
+    assert len(geocoder) == 1
+
+    # the cache is persisted on disk
+    reopened = CachedGeocoder(cache_path=str(tmp_path / "geocodes.sqlite"))
+
+    assert reopened(USER_ARGS) == (2.3, 48.8)
+    assert reopened({**USER_ARGS, "street_number": 13}) is None
+    assert (reopened.hits, reopened.misses) == (1, 1)
+
+def test_cached_geocoder_does_not_store_unknown_addresses(tmp_path):
+    counting = CountingGeocoder(location=None)
+    geocoder = CachedGeocoder(cache_path=str(tmp_path / "geocodes.sqlite"), geocoder=counting)
+
+    assert geocoder(USER_ARGS) is None
+    assert geocoder(USER_ARGS) is None
+
+    assert (geocoder.hits, geocoder.misses, counting.n_calls) == (0, 2, 2)
+    assert len(geocoder) == 0
+
+def test_offline_geocoder_lookups():
+    geocoder = OfflineGeocoder(make_locations())
+
+    # same street number, street and zip code
+    assert geocoder(USER_ARGS) == pytest.approx((3.0, 49.0))
+    # same street and zip code
+    assert geocoder({**USER_ARGS, "street_number": 99}) == pytest.approx((4.0, 50.0))
+    # same zip code
+    assert geocoder({**USER_ARGS, "street_name": "Rue du Louvre"}) == pytest.approx((5.0, 51.0))
+    # transactions without location are ignored
+    assert geocoder({**USER_ARGS, "zip_code": 75004, "street_name": "Rue de Rivoli"}) is None
+
+def test_offline_geocoder_without_zip_code_fallback():
+    geocoder = OfflineGeocoder(make_locations(), zip_code_fallback=False)
+
+    assert geocoder({**USER_ARGS, "street_number": 99}) == pytest.approx((4.0, 50.0))
+    assert geocoder({**USER_ARGS, "street_name": "Rue du Louvre"}) is None
+
+def test_offline_geocoder_add_averages_locations():
+    locations = make_locations()
+
+    geocoder = OfflineGeocoder(locations.iloc[:1])
+    geocoder.add(locations.iloc[1:])
+
+    assert geocoder(USER_ARGS) == pytest.approx(OfflineGeocoder(locations)(USER_ARGS))
+
+def test_fallback_geocoder_calls_geocoders_in_order():
+    offline = OfflineGeocoder(make_locations(), zip_code_fallback=False)
+    counting = CountingGeocoder()
+    geocoder = FallbackGeocoder([offline, counting])
+
+    assert geocoder(USER_ARGS) == pytest.approx((3.0, 49.0))
+    assert counting.n_calls == 0
+
+    assert geocoder({**USER_ARGS, "street_name": "Rue du Louvre"}) == (2.3, 48.8)
+    assert counting.n_calls == 1
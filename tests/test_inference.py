@@ -0,0 +1,51 @@
+"""Description. Batch predictions of PredictionEngine against single predictions, property by property."""
+
+from lib.inference import PredictionEngine, OfflineGeocoder
+from lib.inference.utils import check_num_rooms, check_num_rooms_batch
+
+from conftest import make_user_args
+
+import pandas as pd
+import numpy as np
+
+import pytest
+
+def make_users(raw: pd.DataFrame, n_users: int=20) -> list:
+    """Description. Properties at the address of transactions, every other one at the exact location of the transaction."""
+
+    rows = raw.iloc[np.linspace(0, len(raw) - 1, n_users).astype(int)]
+
+    return [
+        make_user_args(row, num_rooms=1 + i % 5, surface=30. + 7 * i, located=i % 2 == 0)
+        for i, (_, row) in enumerate(rows.iterrows())
+    ]
+
+@pytest.mark.parametrize("num_rooms", [
+    pd.Series([1, 3, 5, 3]),
+    pd.Series([1., 3., 5., 3.]),
+    pd.Series([1., 3., np.nan, 3.]),
+])
+def test_check_num_rooms_batch(num_rooms):
+    var = "nombre_pieces_principales_3"
+    expected = [check_num_rooms(int(n), var) if not np.isnan(n) else 0. for n in num_rooms]
+
+    assert check_num_rooms_batch(num_rooms, var).tolist() == expected
+
+@pytest.mark.parametrize("dtype", ["int64", "float64"])
+def test_predict_batch_matches_predict(area, dtype):
+    engine = PredictionEngine(area["data_dir"], area["model_dir"], backend="zip", geocoder=OfflineGeocoder(area["raw"]))
+    users = make_users(area["raw"])
+
+    details = [engine.predict(dict(user_args), return_details=True) for user_args in users]
+    distances = [d["closest"]["distance"] for d in details if d["closest"] is not None]
+
+    # exact matches use the features of the closest property instead of imputed values
+    assert any(distance == 0 for distance in distances)
+    assert any(distance > 0 for distance in distances)
+
+    batch = pd.DataFrame(users)
+    batch["num_rooms"] = batch["num_rooms"].astype(dtype)
+
+    prices = engine.predict_batch(batch)
+
+    np.testing.assert_array_equal(prices.values, np.array([d["price"] for d in details]))
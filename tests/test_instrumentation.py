@@ -0,0 +1,111 @@
+"""Description. Stage records sent to hooks by instrument_stage and statistics of RecordingHook."""
+
+from lib.inference import CallbackHook, RecordingHook
+from lib.inference import instrumentation
+from lib.inference.instrumentation import RSSSampler, get_rss, instrument_stage
+
+import numpy as np
+
+import pytest
+
+FRAME_SIZE = 200 * 1024 ** 2
+
+def allocate_and_free():
+    """Description. Allocate and touch a large array, then free it before the end of the stage."""
+
+    array = np.ones(FRAME_SIZE // 8)
+    del array
+
+def run_stage(hooks: list, stage: str="inference", n_rows: int=10, func=None):
+    with instrument_stage(hooks, stage, geo_area="essonne") as record:
+        record["n_rows_in"] = n_rows
+
+        if func is not None:
+            func()
+
+        record["n_rows_out"] = n_rows // 2
+
+def test_no_hooks():
+    with instrument_stage([], "inference", geo_area="essonne") as record:
+        pass
+
+    # nothing is measured without hooks
+    assert record == {"stage": "inference", "n_rows_in": None, "n_rows_out": None, "geo_area": "essonne"}
+
+def test_callback_hook():
+    records = []
+    run_stage([CallbackHook(records.append)])
+
+    assert len(records) == 1
+
+    record = records[0]
+
+    assert record["stage"] == "inference" and record["geo_area"] == "essonne"
+    assert (record["n_rows_in"], record["n_rows_out"]) == (10, 5)
+    assert record["failed"] is False and record["wall_time"] >= 0
+    assert {"peak_rss_delta", "rss_delta"} <= set(record)
+
+def test_failed_stage():
+    hook = RecordingHook()
+
+    with pytest.raises(RuntimeError):
+        with instrument_stage([hook], "geocoding"):
+            raise RuntimeError
+
+    assert len(hook) == 1 and hook.records[0]["failed"] is True
+
+@pytest.mark.parametrize("use_sampler", [False, True])
+def test_peak_rss(monkeypatch, use_sampler):
+    if get_rss() is None:
+        pytest.skip("RSS is unavailable.")
+
+    if use_sampler:
+        monkeypatch.setattr(instrumentation, "reset_peak_rss", lambda: False)
+    elif not instrumentation.reset_peak_rss():
+        pytest.skip("Peak RSS cannot be reset.")
+
+    hook = RecordingHook()
+    run_stage([hook], func=allocate_and_free)
+
+    record = hook.records[0]
+
+    # the frame is freed before the end of the stage: only the peak sees it
+    assert record["peak_rss_delta"] > .9 * FRAME_SIZE
+    assert record["rss_delta"] < .5 * FRAME_SIZE
+
+def test_rss_sampler():
+    if get_rss() is None:
+        pytest.skip("RSS is unavailable.")
+
+    sampler = RSSSampler().start()
+    rss = get_rss()
+    allocate_and_free()
+
+    assert sampler.stop() - rss > .9 * FRAME_SIZE
+
+def test_recording_hook():
+    hook = RecordingHook(max_records=5)
+
+    for n_rows in range(4):
+        run_stage([hook], "preprocessing", n_rows)
+        run_stage([hook], "inference", n_rows)
+
+    # oldest records are dropped first
+    assert len(hook) == 5
+    assert [record["stage"] for record in hook.records] == ["inference", "preprocessing", "inference", "preprocessing", "inference"]
+
+    summary = hook.summary()
+
+    assert summary.index.tolist() == ["inference", "preprocessing"]
+    assert summary["count"].tolist() == [3, 2]
+    assert summary.loc["inference", "mean_rows_in"] == 2.
+    assert {"mean_peak_rss_delta", "max_peak_rss_delta", "mean_rss_delta", "p95_time"} <= set(summary.columns)
+    assert (summary["max_time"] >= summary["p50_time"]).all()
+
+    counts, edges = hook.histogram("inference", bins=4)
+
+    assert counts.sum() == 3 and len(edges) == 5
+
+    hook.clear()
+
+    assert len(hook) == 0 and hook.summary().empty
@@ -0,0 +1,55 @@
+"""Description. Step-level pruning decisions of OptimPruner."""
+
+from lib.model.optimize import OptimPruner
+
+import optuna
+
+import pytest
+
+optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+BEST_CURVE = {10: 1., 20: .8, 30: .6, 40: .5}
+
+def make_study(pruner: OptimPruner, n_completed: int=1) -> optuna.Study:
+    """Description. Study whose first trial is the best one, followed by worse completed trials."""
+
+    study = optuna.create_study(direction="minimize", pruner=pruner)
+
+    for i in range(n_completed):
+        trial = study.ask()
+
+        for step, value in BEST_CURVE.items():
+            trial.report(value + i, step)
+
+        study.tell(trial, BEST_CURVE[40] + i)
+
+    return study
+
+def should_prune(study: optuna.Study, curve: dict) -> bool:
+    trial = study.ask()
+
+    for step, value in curve.items():
+        trial.report(value, step)
+
+    return trial.should_prune()
+
+def test_prune_right_after_improvement():
+    study = make_study(OptimPruner(n_warmup_trials=1, n_warmup_steps=30))
+
+    assert should_prune(study, {10: 1.5, 20: 1.4, 30: 1.3})
+    assert not should_prune(study, {10: 1.5, 20: .7, 30: .55})
+
+def test_no_pruning_during_warm_up():
+    study = make_study(OptimPruner(n_warmup_trials=1, n_warmup_steps=30))
+
+    assert not should_prune(study, {10: 1.5, 20: 1.4})
+
+    study = make_study(OptimPruner(n_warmup_trials=5, n_warmup_steps=30))
+
+    assert not should_prune(study, {10: 1.5, 20: 1.4, 30: 1.3})
+
+@pytest.mark.parametrize("n_completed, pruned", [(1, False), (3, True)])
+def test_n_trials_to_prune(n_completed, pruned):
+    study = make_study(OptimPruner(n_warmup_trials=1, n_trials_to_prune=3, n_warmup_steps=30), n_completed)
+
+    assert should_prune(study, {10: 1.5, 20: 1.4, 30: 1.3}) == pruned
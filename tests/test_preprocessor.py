@@ -0,0 +1,115 @@
+"""Description. Predictions with the fitted AreaPreprocessor against predictions preprocessing the whole partition."""
+
+from lib.inference import Prediction, PredictionEngine, OfflineGeocoder
+from lib.inference.preprocessor import AreaPreprocessor, get_partition_key
+from lib.inference.imputation import ImputationTable
+from lib.model.loader import load_model, save_model, to_builtin
+
+from conftest import GEO_AREA, PROPERTY_TYPE, ZIP_CODES, make_user_args
+
+from pandas.testing import assert_frame_equal
+
+import numpy as np
+
+import json
+import copy
+import pytest
+
+@pytest.fixture(scope="module")
+def preprocessed(area, tmp_path_factory):
+    """Description. Preprocessor fitted on the area and model directory where it is saved with the model."""
+
+    model_loader = load_model(area["model_dir"], "XGBRegressor", 0, GEO_AREA, PROPERTY_TYPE)
+    preprocessor = AreaPreprocessor(model_loader["feature_names"], PROPERTY_TYPE).fit(area["raw"])
+
+    model_dir = f"{tmp_path_factory.mktemp('preprocessed')}/"
+    save_model(
+        model_dir,
+        model_loader["model"],
+        model_loader["feature_names"],
+        model_loader["metrics"],
+        0,
+        GEO_AREA,
+        PROPERTY_TYPE,
+        preprocessor=preprocessor.to_dict()
+    )
+
+    return {"preprocessor": preprocessor, "model_dir": model_dir}
+
+def make_users(raw, n_users: int=15) -> list:
+    rows = raw.iloc[np.linspace(0, len(raw) - 1, n_users).astype(int)]
+
+    return [
+        make_user_args(row, num_rooms=1 + i % 5, surface=25. + 9 * i, located=i % 3 == 0)
+        for i, (_, row) in enumerate(rows.iterrows())
+    ]
+
+def predict(area, model_dir: str, user_args: dict, geocoder) -> Prediction:
+    prediction = Prediction(dict(user_args), geocoder=geocoder)
+    prediction.load_data(area["data_dir"], backend="zip")
+    prediction.load_model(model_dir)
+    prediction.predict()
+
+    return prediction
+
+def test_prediction_parity(area, preprocessed):
+    geocoder = OfflineGeocoder(area["raw"])
+
+    for user_args in make_users(area["raw"]):
+        reference = predict(area, area["model_dir"], user_args, geocoder)
+        prediction = predict(area, preprocessed["model_dir"], user_args, geocoder)
+
+        assert reference.preprocessor is None
+        assert prediction.preprocessor is not None
+
+        assert prediction._price_pred == reference._price_pred, user_args
+
+def test_engine_parity(area, preprocessed):
+    geocoder = OfflineGeocoder(area["raw"])
+    users = make_users(area["raw"])
+
+    reference = PredictionEngine(area["data_dir"], area["model_dir"], backend="zip", geocoder=geocoder)
+    engine = PredictionEngine(area["data_dir"], preprocessed["model_dir"], backend="zip", geocoder=geocoder)
+
+    assert [engine.predict(dict(u)) for u in users] == [reference.predict(dict(u)) for u in users]
+
+def test_dict_round_trip(area, preprocessed):
+    preprocessor = preprocessed["preprocessor"]
+    content = json.loads(json.dumps(preprocessor.to_dict(), default=to_builtin))
+
+    loaded = AreaPreprocessor.from_dict(content)
+
+    assert loaded.to_dict() == content
+    assert ZIP_CODES[0] in loaded and 75001 not in loaded
+
+    close_properties = area["raw"].iloc[:50]
+
+    assert_frame_equal(
+        loaded.transform(close_properties.copy(), ZIP_CODES[0]),
+        preprocessor.transform(close_properties.copy(), ZIP_CODES[0])
+    )
+
+    table = loaded.get_imputation_table(ZIP_CODES[0])
+
+    assert isinstance(table, ImputationTable)
+    assert table.feature_names == preprocessor.get_imputation_table(ZIP_CODES[0]).feature_names
+
+def test_version_1_imputed_values(preprocessed):
+    content = copy.deepcopy(preprocessed["preprocessor"].to_dict())
+    content["format_version"] = 1
+
+    # version 1 stored imputed values as a dictionary of features
+    key = get_partition_key(ZIP_CODES[0])
+    table = ImputationTable.from_dict(content["partitions"][key]["imputed_values"])
+    content["partitions"][key]["imputed_values"] = {var: table[var] for var in table.feature_names}
+
+    imputed_values = AreaPreprocessor.from_dict(content).get_imputation_table(ZIP_CODES[0])
+
+    assert isinstance(imputed_values, dict)
+    assert imputed_values == {var: table[var] for var in table.feature_names}
+
+def test_unsupported_version(preprocessed):
+    content = dict(preprocessed["preprocessor"].to_dict(), format_version=99)
+
+    with pytest.raises(ValueError):
+        AreaPreprocessor.from_dict(content)
@@ -0,0 +1,70 @@
+"""Description. Closest properties found with SpatialIndex against the geodesic search, and index without coordinates."""
+
+from lib.inference.spatial import SpatialIndex
+from lib.inference.utils import find_closest, return_close_properties
+
+from conftest import make_area_table
+
+import numpy as np
+
+import pytest
+
+def make_users(df, n_users: int=30, seed: int=0) -> list:
+    """Description. Users located a few hundred meters away from transactions, at an unknown number of their street or
+    an unknown street of their zip code so that several properties are compared."""
+
+    rng = np.random.default_rng(seed)
+
+    rows = df.dropna(subset=["latitude", "longitude"])
+    rows = rows.iloc[rng.choice(len(rows), n_users, replace=False)]
+
+    return [
+        {
+            "street_number": 1000,
+            "street_name": row["adresse_nom_voie"] if i % 2 == 0 else "Rue inconnue",
+            "zip_code": row["code_postal"],
+            "latitude": row["latitude"] + rng.normal(0, .003),
+            "longitude": row["longitude"] + rng.normal(0, .003)
+        }
+        for i, (_, row) in enumerate(rows.iterrows())
+    ]
+
+def test_find_closest_parity():
+    df = make_area_table(n_rows=1500)
+    df.loc[df.index[::10], ["latitude", "longitude"]] = np.nan
+
+    spatial_index = SpatialIndex(df)
+
+    for user_args in make_users(df):
+        close_properties = return_close_properties(df, user_args, spatial_index)
+        located = close_properties.dropna(subset=["latitude", "longitude"])
+
+        closest = find_closest(close_properties.copy(), user_args, spatial_index)
+        expected = find_closest(located.copy(), user_args)
+
+        assert closest.name == expected.name, user_args
+
+        # haversine and geodesic distances differ by less than 0.5%
+        assert closest["distance"] == pytest.approx(expected["distance"], rel=5e-3)
+
+def test_no_coordinates():
+    df = make_area_table(n_rows=100)
+    user_args = make_users(df, n_users=1)[0]
+
+    df[["latitude", "longitude"]] = np.nan
+    spatial_index = SpatialIndex(df)
+
+    positions, distances = spatial_index.query(48.65, 2.25, k=5)
+    assert len(positions) == len(distances) == 0
+
+    positions, distances = spatial_index.query_radius(48.65, 2.25, radius=1000.)
+    assert len(positions) == len(distances) == 0
+
+    positions, distance = spatial_index.nearest(48.65, 2.25)
+    assert len(positions) == 0 and np.isnan(distance)
+
+    # addresses are still looked up without coordinates
+    close_properties = return_close_properties(df, user_args, spatial_index)
+
+    assert len(close_properties) > 0
+    assert find_closest(close_properties, user_args, spatial_index) is None
@@ -0,0 +1,62 @@
+"""Description. Parity of TrendPriceStore with calc_movav_prices and of incremental updates with a single update."""
+
+from lib.dataset.trend import TrendPriceStore
+from lib.dataset.utils import calc_movav_prices
+
+from pandas.core.frame import DataFrame
+from pandas.testing import assert_frame_equal
+
+import pandas as pd
+import numpy as np
+
+import pytest
+
+WINDOWS = [7, 30]
+
+def make_transactions(n_rows: int=4000, seed: int=0) -> DataFrame:
+    """Description. Transactions over a year in a few neighborhoods, some days without transaction in a neighborhood."""
+
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        "date_mutation": (pd.to_datetime("2022-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D")).strftime("%Y-%m-%d"),
+        "arrondissement": rng.choice(["1", "2", "3", "4"], n_rows, p=[.55, .3, .1, .05]),
+        "valeur_fonciere": rng.lognormal(12, .5, n_rows).round()
+    })
+
+@pytest.mark.parametrize("neighborhood_var", [None, "arrondissement"])
+@pytest.mark.parametrize("lag", [0, 1, 3])
+def test_compute_parity(neighborhood_var, lag):
+    df = make_transactions()
+
+    store = TrendPriceStore(neighborhood_var=neighborhood_var).update(df)
+    mov_avg_prices = store.compute(WINDOWS, lag)
+
+    keys = store.keys
+
+    for window in WINDOWS:
+        expected = calc_movav_prices(df, window, lag, neighborhood_var=neighborhood_var)
+        var = f"valeur_fonciere_ma{window}"
+
+        merged = pd.merge(mov_avg_prices[keys + [var]], expected[keys + [var]], on=keys, how="outer", suffixes=("", "_expected"))
+
+        assert len(merged) == len(mov_avg_prices) == len(expected)
+        np.testing.assert_allclose(merged[var], merged[f"{var}_expected"], rtol=1e-10, equal_nan=True)
+
+        # windows without enough days are missing
+        assert merged[var].isna().sum() == merged[f"{var}_expected"].isna().sum() > 0
+
+@pytest.mark.parametrize("neighborhood_var", [None, "arrondissement"])
+def test_update_in_several_calls(neighborhood_var):
+    df = make_transactions()
+
+    # random split, so that the same days of a neighborhood are added by both calls
+    is_first = np.random.default_rng(1).random(len(df)) < .5
+
+    store = TrendPriceStore(neighborhood_var=neighborhood_var).update(df)
+    updated = TrendPriceStore(neighborhood_var=neighborhood_var).update(df[is_first]).update(df[~is_first])
+
+    assert_frame_equal(updated.aggregates, store.aggregates, check_dtype=False)
+    assert_frame_equal(updated.compute(WINDOWS, lag=1), store.compute(WINDOWS, lag=1))
+
+    assert updated.last_prices(WINDOWS, lag=1) == pytest.approx(store.last_prices(WINDOWS, lag=1))
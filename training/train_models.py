@@ -0,0 +1,68 @@
+"""Description. Automated script to train, optimize and save the models of all (geo_area, property_type) couples of ESTIMATORS.
+
+Jobs run in parallel in a process pool. Each job writes a checkpoint and an optuna study in the checkpoint directory 
+so that the script can be stopped and relaunched: finished jobs are skipped and interrupted studies are resumed.
+Training and test sets are cached in backup/cache unless -no_cache is provided.
+-matrix_format compact (float32 arrays) or sparse (CSR matrices, RandomForest only) reduces the memory of large tables.
+Features of tables above 150000 training rows (or of all tables with -screening) are selected on stratified subsamples.
+
+Example:
+~\mon-predicteur-immo\training> python train_models.py
+~\mon-predicteur-immo\training> python train_models.py -property_type flats -n_trials 50 -n_threads 2 -max_memory 8
+~\mon-predicteur-immo\training> python train_models.py -geo_area Paris -geo_area Lyon -no_resume -no_cache
+~\mon-predicteur-immo\training> python train_models.py -property_type houses -matrix_format sparse
+xgbregressor-paris-flats-v0: done (1832s)
+xgbregressor-lyon-flats-v0: done (954s)
+"""
+
+# required libraries
+import sys
+sys.path.append("../")
+
+from lib.model.training import list_training_jobs, train_all
+
+# enums
+DATA_DIR = "../data/"
+BACKUP_DIR = "../backup/"
+
+def extract_info(flag: str):
+    """Description. Extract information from command line."""
+    i = sys.argv.index(flag) + 1
+    return sys.argv[i]
+
+def extract_all_info(flag: str):
+    """Description. Extract information of repeated flag from command line."""
+    return [sys.argv[i + 1] for i, arg in enumerate(sys.argv) if arg == flag]
+
+if __name__ == "__main__":
+
+    jobs = list_training_jobs(
+        property_types=extract_all_info(flag="-property_type") or None, 
+        geo_areas=extract_all_info(flag="-geo_area") or None
+    )
+
+    if len(jobs) == 0:
+        print("No model matches the provided flags.")
+        sys.exit(1)
+
+    max_memory = float(extract_info(flag="-max_memory")) if "-max_memory" in sys.argv else None
+
+    checkpoints = train_all(
+        data_dir=DATA_DIR, 
+        model_dir=f"{BACKUP_DIR}models", 
+        checkpoint_dir=f"{BACKUP_DIR}training", 
+        jobs=jobs, 
+        n_workers=int(extract_info(flag="-n_workers")) if "-n_workers" in sys.argv else None, 
+        n_threads=int(extract_info(flag="-n_threads")) if "-n_threads" in sys.argv else 1, 
+        resume="-no_resume" not in sys.argv, 
+        version=int(extract_info(flag="-version")) if "-version" in sys.argv else 0, 
+        n_trials=int(extract_info(flag="-n_trials")) if "-n_trials" in sys.argv else 20, 
+        timeout=float(extract_info(flag="-timeout")) if "-timeout" in sys.argv else None, 
+        cache_dir=f"{BACKUP_DIR}cache" if "-no_cache" not in sys.argv else None, 
+        matrix_format=extract_info(flag="-matrix_format") if "-matrix_format" in sys.argv else "dense", 
+        screening=True if "-screening" in sys.argv else None, 
+        max_memory=int(max_memory * 1024 ** 3) if max_memory is not None else None
+    )
+
+    n_failed = len([checkpoint for checkpoint in checkpoints if checkpoint["status"] != "done"])
+    print(f"{len(checkpoints) - n_failed} models trained, {n_failed} failed.")